@@ -1,4 +1,29 @@
-from .lib_csv import *
+# STDLIB
+import importlib
+
+# typing is not imported at runtime - it costs more than the rest of the package import
+TYPE_CHECKING = False
+if TYPE_CHECKING:                   # pragma: no cover
+    from typing import Any, List
+    from .lib_csv import *
+    from .schema import *
+    from .validation import *
+    from .sqlite_loader import *
+    from .interning import *
+    from .multi_file import *
+    from .hot_reload import *
+    from .parser_engine import *
+    from .bytes_reader import *
+    from .random_access import *
+    from .profiling import *
+    from .sink import *
+    from .keyed_store import *
+    from .partitioned_writer import *
+    from .dedup import *
+    from .shared_table import *
+    from .indexed_table import *
+    from .pipeline import *
+    from .spill_dict import *
 
 # this needs to come after the module imports, otherwise circular import under windows
 from . import __init__conf__
@@ -9,3 +34,130 @@ __url__ = __init__conf__.url
 __author__ = __init__conf__.author
 __author_email__ = __init__conf__.author_email
 __shell_command__ = __init__conf__.shell_command
+
+# the public names of the package and the submodule they live in.
+# the submodules are only imported on first access of one of their names,
+# so "import lib_csv" stays cheap for short living processes.
+_lazy_attributes = {
+    'logger': 'lib_csv',
+    'CWriterObject': 'lib_csv',
+    'read_csv_file_with_header_to_hashed_odict_of_odicts': 'lib_csv',
+    'read_csv_file_with_header_to_list_of_dicts': 'lib_csv',
+    'read_csv_file_with_header_to_iterator_of_dicts': 'lib_csv',
+    'read_csv_file_header': 'lib_csv',
+    'write_hashed_odict_of_odicts_to_csv_file': 'lib_csv',
+    'open_atomic_for_write': 'lib_csv',
+    'write_ll_data_to_csv_file': 'lib_csv',
+    'write_ll_data_to_csv_file_ebay': 'lib_csv',
+    'get_ebay_csv_row': 'lib_csv',
+    'get_ebay_csv_rows_block': 'lib_csv',
+    'escape_quote_character_in_field': 'lib_csv',
+    'quote_field_if_needed': 'lib_csv',
+    'cast_list_2_csv': 'lib_csv',
+    'cast_csv_2_list': 'lib_csv',
+    'ls_rstrip_list': 'lib_csv',
+    'main': 'lib_csv',
+    'main_commandline': 'lib_csv',
+    'int_converter': 'schema',
+    'float_converter': 'schema',
+    'decimal_converter': 'schema',
+    'bool_converter': 'schema',
+    'date_converter': 'schema',
+    'nullable_converter': 'schema',
+    'compile_row_builder': 'schema',
+    'decimal_formatter': 'schema',
+    'bool_formatter': 'schema',
+    'date_formatter': 'schema',
+    'nullable_formatter': 'schema',
+    'compile_row_serializer': 'schema',
+    'ValidationSummary': 'validation',
+    'validate_csv_file': 'validation',
+    'load_csv_file_to_sqlite': 'sqlite_loader',
+    'query_sqlite_to_list_of_dicts': 'sqlite_loader',
+    'write_sqlite_query_to_csv_file': 'sqlite_loader',
+    'ValueInterner': 'interning',
+    'DictionaryEncodedTable': 'interning',
+    'read_csv_file_with_header_to_dictionary_encoded_table': 'interning',
+    'CsvFileResult': 'multi_file',
+    'get_csv_file_paths': 'multi_file',
+    'read_csv_files_concurrently': 'multi_file',
+    'read_csv_files_concurrently_merged': 'multi_file',
+    'TableDelta': 'hot_reload',
+    'HotReloadingKeyedTable': 'hot_reload',
+    'FastCsvReader': 'parser_engine',
+    'get_csv_reader': 'parser_engine',
+    'LazyDecodedBytes': 'bytes_reader',
+    'BytesCsvReader': 'bytes_reader',
+    'read_csv_file_with_header_to_iterator_of_bytes_dicts': 'bytes_reader',
+    'read_csv_file_with_header_to_list_of_bytes_dicts': 'bytes_reader',
+    'read_csv_file_tail': 'random_access',
+    'read_csv_file_rows': 'random_access',
+    'read_csv_file_sample': 'random_access',
+    'CsvFileProfile': 'profiling',
+    'count_records': 'profiling',
+    'profile_file': 'profiling',
+    'CsvSink': 'sink',
+    'KeyedCsvStore': 'keyed_store',
+    'CsvPartFile': 'partitioned_writer',
+    'write_ll_data_to_partitioned_csv_files': 'partitioned_writer',
+    'RowDeduplicator': 'dedup',
+    'DeduplicationSummary': 'dedup',
+    'deduplicate_csv_file': 'dedup',
+    'SharedCsvTable': 'shared_table',
+    'load_csv_file_to_shared_memory': 'shared_table',
+    'attach_shared_csv_table': 'shared_table',
+    'IndexedTable': 'indexed_table',
+    'read_csv_file_with_header_to_indexed_table': 'indexed_table',
+    'PipelineStage': 'pipeline',
+    'PipelineStageMetrics': 'pipeline',
+    'run_pipeline': 'pipeline',
+    'run_csv_pipeline': 'pipeline',
+    'SpilledHashedDict': 'spill_dict',
+    'read_csv_file_with_header_to_spilled_hashed_dict': 'spill_dict',
+}
+
+__all__ = sorted(_lazy_attributes)
+
+
+def __getattr__(name: str) -> 'Any':
+    """
+    imports the submodule of a public name on first access
+
+    >>> # setup
+    >>> import pathlib
+    >>> import subprocess
+    >>> import sys
+    >>> package_directory = pathlib.Path(__file__).absolute().parent.parent
+
+    >>> # the cli and the readers / writers are not loaded on "import lib_csv"
+    >>> code = ('import sys, lib_csv; '
+    ...         'print(sorted(m for m in ("docopt", "lib_csv.lib_csv", "csv", "logging", "pathlib") if m in sys.modules))')
+    >>> subprocess.run([sys.executable, '-c', code], cwd=str(package_directory), stdout=subprocess.PIPE, check=True).stdout.decode().strip()
+    '[]'
+
+    >>> # no submodule except __init__conf__ is loaded on "import lib_csv"
+    >>> code = ('import sys, lib_csv; '
+    ...         'print(sorted(m for m in sys.modules if m.startswith("lib_csv.") and m != "lib_csv.__init__conf__"))')
+    >>> subprocess.run([sys.executable, '-c', code], cwd=str(package_directory), stdout=subprocess.PIPE, check=True).stdout.decode().strip()
+    '[]'
+
+    >>> # names are loaded on first use
+    >>> import lib_csv
+    >>> lib_csv.cast_csv_2_list('a,b')
+    ['a', 'b']
+    >>> lib_csv.not_existing
+    Traceback (most recent call last):
+        ...
+    AttributeError: module 'lib_csv' has no attribute 'not_existing'
+
+    """
+    if name in _lazy_attributes:
+        module = importlib.import_module('.' + _lazy_attributes[name], __init__conf__.name)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module '{__init__conf__.name}' has no attribute '{name}'")
+
+
+def __dir__() -> 'List[str]':
+    return sorted(set(globals()) | set(__all__))
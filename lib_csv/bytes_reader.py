@@ -0,0 +1,235 @@
+# STDLIB
+import codecs
+import csv
+import functools
+import io
+import pathlib
+from typing import Any, Dict, IO, Iterator, List, Optional
+
+# PROJ
+try:
+    from .lib_csv import get_codec_name, ls_rstrip_list
+    from .parser_engine import FastCsvReader
+    from .schema import compile_row_builder
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import get_codec_name, ls_rstrip_list      # type: ignore  # pragma: no cover
+    from parser_engine import FastCsvReader                 # type: ignore  # pragma: no cover
+    from schema import compile_row_builder                  # type: ignore  # pragma: no cover
+
+
+class LazyDecodedBytes(bytes):
+    """
+    the raw bytes of a field, decoded only when the text is needed : with str() or .text
+    it compares and hashes like bytes. get_ebay_csv_row writes it unchanged if the encodings match.
+
+    >>> field = make_lazy_decoded_bytes('Bühne'.encode('ISO-8859-1'), 'ISO-8859-1')
+    >>> field, field.text, str(field), field == b'B\\xfchne'
+    (b'B\\xfchne', 'Bühne', 'Bühne', True)
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(field)).text
+    'Bühne'
+    >>> from lib_csv.lib_csv import get_ebay_csv_row
+    >>> get_ebay_csv_row([field], delimiter=b';', quotechar=b'"', escapechar=b'"', encoding='utf-8')
+    b'B\\xc3\\xbchne'
+    """
+
+    __slots__ = ()
+    encoding = 'utf-8'
+
+    @property
+    def text(self) -> str:
+        return self.decode(self.encoding)
+
+    def __str__(self) -> str:
+        return self.decode(self.encoding)
+
+    def __reduce__(self) -> Any:
+        return make_lazy_decoded_bytes, (bytes(self), self.encoding)
+
+
+@functools.lru_cache(maxsize=None)
+def get_lazy_decoded_bytes_type(encoding: str) -> type:
+    """ one subclass per encoding, so the encoding does not need to be stored in every field """
+    return type('LazyDecodedBytes', (LazyDecodedBytes, ), {'__slots__': (), 'encoding': get_codec_name(encoding)})
+
+
+def make_lazy_decoded_bytes(data: bytes, encoding: str) -> LazyDecodedBytes:
+    return get_lazy_decoded_bytes_type(encoding)(data)     # type: ignore
+
+
+class BytesCsvReader(FastCsvReader):
+    """
+    parses the binary file without decoding it - the fields are the bytes of the file.
+    the encoding must be ascii compatible (utf-8, ISO-8859-x, cp125x, ...), the delimiter, quotechar and escapechar ascii characters.
+
+    the file is parsed through a latin-1 view, which maps every byte to one character - the rows are the rows of
+    FastCsvReader or csv.reader, with the fields encoded back to the original bytes.
+
+    >>> reader = BytesCsvReader(io.BytesIO('a;"ü;x"\\r\\nb;c'.encode('utf-8')))
+    >>> list(reader), reader.line_num
+    ([[b'a', b'\\xc3\\xbc;x'], [b'b', b'c']], 2)
+    >>> BytesCsvReader(io.BytesIO(b''), encoding='utf-16')
+    Traceback (most recent call last):
+        ...
+    ValueError: the encoding "utf-16" is not ascii compatible
+
+    """
+
+    def __init__(self,
+                 f_csv_file: IO[bytes],
+                 encoding: str = "ISO-8859-1",
+                 delimiter: str = ";",
+                 quotechar: Optional[str] = '"',
+                 quoting: int = csv.QUOTE_MINIMAL,
+                 doublequote: bool = True,
+                 escapechar: Optional[str] = None,
+                 block_size: int = 256 * 1024) -> None:
+        check_ascii_compatible_encoding(encoding, delimiter + (quotechar or '') + (escapechar or ''))
+        # newline=None like the text readers : \r\n and \r are read as \n
+        f_text_file = io.TextIOWrapper(f_csv_file, encoding='latin-1', newline=None)    # type: ignore
+        super().__init__(f_text_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote,
+                         escapechar=escapechar, block_size=block_size)
+        self.b_delimiter = delimiter.encode('ascii')
+
+    def _iter_clean_block_rows(self, l_lines: List[str], block: str) -> Iterator[List[bytes]]:    # type: ignore
+        b_delimiter = self.b_delimiter
+        line_num = self.line_num
+        l_b_lines = block.encode('latin-1').split(b'\n')
+        if len(l_b_lines) > len(l_lines):
+            # the block ends with a newline
+            l_b_lines.pop()
+        for b_line in l_b_lines:
+            line_num += 1
+            self.line_num = line_num
+            yield b_line.split(b_delimiter) if b_line else []
+
+    def _iter_block_rows(self, l_lines: List[str], it_file_lines: Iterator[str]) -> Iterator[List[bytes]]:    # type: ignore
+        for row in super()._iter_block_rows(l_lines, it_file_lines):
+            yield [field.encode('latin-1') for field in row]     # type: ignore
+
+
+def check_ascii_compatible_encoding(encoding: str, special_chars: str = ';"') -> None:
+    """
+    raises ValueError if the encoding is not compatible with parsing the bytes
+
+    >>> check_ascii_compatible_encoding('cp1252')
+    >>> check_ascii_compatible_encoding('ISO-8859-1', special_chars='§')
+    Traceback (most recent call last):
+        ...
+    ValueError: the delimiter, quotechar and escapechar must be ascii characters: "§"
+    """
+    codec_name = get_codec_name(encoding)
+    if codec_name == 'utf-8-sig':
+        codec_name = 'utf-8'
+    test_chars = '\n\r' + special_chars
+    if not all(ord(char) < 128 for char in special_chars):
+        raise ValueError(f'the delimiter, quotechar and escapechar must be ascii characters: "{special_chars}"')
+    try:
+        is_compatible = test_chars.encode(codec_name) == test_chars.encode('ascii') and b'\n'.decode(codec_name) == '\n'
+    except (UnicodeError, LookupError):
+        is_compatible = False
+    if not is_compatible:
+        raise ValueError(f'the encoding "{encoding}" is not ascii compatible')
+
+
+def read_csv_file_with_header_to_iterator_of_bytes_dicts(path_csv_file: pathlib.Path,
+                                                         encoding: str = "ISO-8859-1",
+                                                         delimiter: str = ";",
+                                                         quotechar: str = '"',
+                                                         quoting: int = csv.QUOTE_MINIMAL,
+                                                         doublequote: bool = True,
+                                                         check_row_length: bool = True,
+                                                         escapechar: Optional[str] = None,
+                                                         lazy_decode: bool = False) -> 'Iterator[Dict[str, bytes]]':
+    """
+    like read_csv_file_with_header_to_iterator_of_dicts, but the file is not decoded : the keys are the decoded fieldnames,
+    the values are the bytes of the fields, to be decoded only if they are inspected - or written by get_ebay_csv_row with
+    source_encoding=encoding, unchanged if the encodings match.
+
+    lazy_decode: the values are LazyDecodedBytes with the encoding of the file, which decode with str() or .text.
+                 they are instances of a python class, tracked by the garbage collector - so they are slower to create than bytes.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile1 = test_directory / '2018-04-26_alle_Navision_Artikel.csv'
+    >>> testfile2 = test_directory / 'eBay-active-listing-wrong_doublequote.csv'
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+
+    >>> # Test OK
+    >>> it_dict_data = read_csv_file_with_header_to_iterator_of_bytes_dicts(path_csv_file=testfile1, check_row_length=False, lazy_decode=True)
+    >>> dict_row = next(it_dict_data)
+    >>> dict_row['Nr.'], dict_row['Beschreibung'], dict_row['Beschreibung'].text
+    (b'HUB025', b'Arbeitsb\\xfchne APF-A-10-125, H\\xf6he 10m, Cap. 125kg', 'Arbeitsbühne APF-A-10-125, Höhe 10m, Cap. 125kg')
+    >>> it_dict_data.close()
+
+    >>> # Test same values as the text reader, utf-8-sig
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_bytes_dicts(path_csv_file=testfile2, encoding='utf-8-sig', check_row_length=False,
+    ...                                                                lazy_decode=True)
+    >>> l_dict_text = read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile2, encoding='utf-8-sig', check_row_length=False)
+    >>> [{key: str(value) for key, value in dict_row.items()} for dict_row in l_dict_data] == l_dict_text
+    True
+
+    >>> # Test bytes, passed through by the eBay writer
+    >>> from lib_csv.lib_csv import get_ebay_csv_row, write_ll_data_to_csv_file_ebay
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_bytes_dicts(path_csv_file=testfile2, encoding='utf-8-sig', check_row_length=False)
+    >>> type(l_dict_data[0]['Title'])
+    <class 'bytes'>
+    >>> get_ebay_csv_row([l_dict_data[0]['Item number'], l_dict_data[0]['Title']], delimiter=b';', quotechar=b'"', escapechar=b'"', source_encoding='utf-8')
+    b'112100026397;100 Stk. (1 Packung) Kabelbinder 370mm x 7.6mm, Farbe Schwarz, UV Best\\xc3\\xa4ndig 55kg'
+
+    >>> # Test round trip ISO-8859-1 bytes to the utf-8 eBay writer, transcoded
+    >>> path_export_file = test_directory / 'bytes_reader_export_test.csv'
+    >>> l_dict_text = read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile1, check_row_length=False)
+    >>> for lazy_decode, source_encoding in ((False, 'ISO-8859-1'), (True, None)):
+    ...     l_dict_data = read_csv_file_with_header_to_list_of_bytes_dicts(path_csv_file=testfile1, check_row_length=False, lazy_decode=lazy_decode)
+    ...     ll_data = [list(l_dict_data[0])] + [list(dict_row.values()) for dict_row in l_dict_data]
+    ...     write_ll_data_to_csv_file_ebay(ll_data, path_export_file, source_encoding=source_encoding)
+    ...     read_csv_file_with_header_to_list_of_dicts(path_csv_file=path_export_file, encoding='utf-8', check_row_length=False) == l_dict_text
+    True
+    True
+    >>> write_ll_data_to_csv_file_ebay(ll_data[:1] + [list(map(bytes, ll_data[1]))], path_export_file)
+    Traceback (most recent call last):
+        ...
+    ValueError: the encoding of the bytes field b'Nein' is unknown - pass source_encoding, or read it as LazyDecodedBytes
+    >>> path_export_file.unlink()
+
+    """
+    if lazy_decode:
+        value_type = get_lazy_decoded_bytes_type(encoding)     # type: Any
+    with open(str(path_csv_file), 'rb') as f_csv_file:
+        if get_codec_name(encoding) == 'utf-8-sig' and f_csv_file.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+            f_csv_file.seek(0)
+        my_csv_reader = BytesCsvReader(f_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting,     # type: Any
+                                       doublequote=doublequote, escapechar=escapechar)
+        b_fieldnames = next(my_csv_reader, [])     # type: List[bytes]
+        # there must not be empty header fields - like read_csv_file_with_header_to_iterator_of_dicts
+        fieldnames = ls_rstrip_list([b_fieldname.decode(encoding) for b_fieldname in b_fieldnames])
+        len_of_header_rows = len(fieldnames)
+        build_row = compile_row_builder(fieldnames, source=str(path_csv_file))
+
+        for row in my_csv_reader:
+            len_current_row = len(row)
+            if check_row_length and len_current_row != len_of_header_rows:
+                raise ValueError(f'csv file "{path_csv_file}": header has {len_of_header_rows} rows,'
+                                 f' current row has {len_current_row} rows: Header: {fieldnames}, current Row: {row}')
+            if lazy_decode:
+                row = list(map(value_type, row))
+            yield build_row(row, my_csv_reader.line_num)
+
+
+def read_csv_file_with_header_to_list_of_bytes_dicts(path_csv_file: pathlib.Path,
+                                                     encoding: str = "ISO-8859-1",
+                                                     delimiter: str = ";",
+                                                     quotechar: str = '"',
+                                                     quoting: int = csv.QUOTE_MINIMAL,
+                                                     doublequote: bool = True,
+                                                     check_row_length: bool = True,
+                                                     escapechar: Optional[str] = None,
+                                                     lazy_decode: bool = False) -> 'List[Dict[str, bytes]]':
+    """
+    reads the csv file into a list of dicts, see read_csv_file_with_header_to_iterator_of_bytes_dicts
+    """
+    return list(read_csv_file_with_header_to_iterator_of_bytes_dicts(path_csv_file=path_csv_file, encoding=encoding, delimiter=delimiter,
+                                                                     quotechar=quotechar, quoting=quoting, doublequote=doublequote,
+                                                                     check_row_length=check_row_length, escapechar=escapechar, lazy_decode=lazy_decode))
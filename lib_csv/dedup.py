@@ -0,0 +1,399 @@
+# STDLIB
+import csv
+import hashlib
+import itertools
+import math
+import pathlib
+import sqlite3
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional
+
+# PROJ
+try:
+    from .lib_csv import open_atomic_for_write, read_csv_file_header, read_csv_file_with_header_to_iterator_of_dicts
+    from .profiling import count_records
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import open_atomic_for_write, read_csv_file_header, read_csv_file_with_header_to_iterator_of_dicts      # type: ignore  # pragma: no cover
+    from profiling import count_records                     # type: ignore  # pragma: no cover
+
+
+MODES = ('exact', 'bloom')
+KEEP_POLICIES = ('first', 'last')
+
+# the estimated memory of one fingerprint in the dict of the exact mode : the bytes object, the int and the hash table slot
+BYTES_PER_FINGERPRINT = 120
+
+# the fingerprints of a batch of rows are looked up at once in the spill database
+BATCH_SIZE = 1000
+
+# the marker of None in the fingerprint - the other values are prefixed with their length and ':', which never starts with '-'
+NULL_MARKER = '-'
+
+
+class _FingerprintStore(object):
+    """
+    {fingerprint: row number} in a dict, which is moved to a sqlite table in a temporary directory when it holds max_fingerprints_in_memory.
+    the dict holds the newer row numbers
+    """
+
+    def __init__(self, max_fingerprints_in_memory: int, path_spill_directory: Optional[pathlib.Path] = None) -> None:
+        self.max_fingerprints_in_memory = max_fingerprints_in_memory
+        self.path_spill_directory = path_spill_directory
+        self.number_of_spills = 0
+        self.dict_fingerprints = dict()                     # type: Dict[bytes, int]
+        self._temporary_directory = None                    # type: Optional[tempfile.TemporaryDirectory[str]]
+        self._connection = None                             # type: Optional[sqlite3.Connection]
+
+    def get_many(self, l_fingerprints: List[bytes]) -> Dict[bytes, int]:
+        """ the row numbers of the fingerprints which are in the store """
+        dict_fingerprints = self.dict_fingerprints
+        dict_found = {fingerprint: dict_fingerprints[fingerprint] for fingerprint in l_fingerprints if fingerprint in dict_fingerprints}
+        if self._connection is not None:
+            l_on_disk = [fingerprint for fingerprint in set(l_fingerprints) if fingerprint not in dict_found]
+            for index in range(0, len(l_on_disk), 500):
+                l_chunk = l_on_disk[index:index + 500]
+                query = f'SELECT fingerprint, row_number FROM fingerprints WHERE fingerprint IN ({",".join("?" * len(l_chunk))})'
+                dict_found.update(self._connection.execute(query, l_chunk))
+        return dict_found
+
+    def set_many(self, dict_fingerprints: Dict[bytes, int]) -> None:
+        self.dict_fingerprints.update(dict_fingerprints)
+        if len(self.dict_fingerprints) >= self.max_fingerprints_in_memory:
+            self._spill()
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._temporary_directory is not None:
+            self._temporary_directory.cleanup()
+            self._temporary_directory = None
+
+    def _spill(self) -> None:
+        if self._connection is None:
+            self._temporary_directory = tempfile.TemporaryDirectory(prefix='lib_csv_dedup_', dir=self.path_spill_directory)
+            self._connection = sqlite3.connect(str(pathlib.Path(self._temporary_directory.name) / 'fingerprints.db'))
+            self._connection.execute('PRAGMA synchronous = OFF')
+            self._connection.execute('PRAGMA journal_mode = OFF')
+            self._connection.execute('CREATE TABLE fingerprints (fingerprint BLOB PRIMARY KEY, row_number INTEGER) WITHOUT ROWID')
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO fingerprints VALUES (?, ?)', self.dict_fingerprints.items())
+        self.dict_fingerprints = dict()
+        self.number_of_spills += 1
+
+
+class _BloomFilter(object):
+    """
+    a bit array of number_of_bits bits with number_of_hashes positions per fingerprint, derived by double hashing
+    from the 128 bit fingerprint
+    """
+
+    def __init__(self, expected_number_of_items: int, false_positive_rate: float, max_bytes: Optional[int] = None) -> None:
+        number_of_bits = math.ceil(-max(expected_number_of_items, 1) * math.log(false_positive_rate) / math.log(2) ** 2)
+        if max_bytes is not None:
+            number_of_bits = min(number_of_bits, max_bytes * 8)
+        self.number_of_bits = max(number_of_bits, 64)
+        self.number_of_hashes = max(1, round(self.number_of_bits / max(expected_number_of_items, 1) * math.log(2)))
+        self.number_of_items = 0
+        self.bits = bytearray((self.number_of_bits + 7) // 8)
+
+    def add(self, fingerprint: bytes) -> bool:
+        """ sets the bits of the fingerprint, returns True if all bits were set before - the fingerprint was (probably) added before """
+        bits = self.bits
+        number_of_bits = self.number_of_bits
+        hash_value = int.from_bytes(fingerprint, 'little')
+        position = hash_value & 0xFFFFFFFFFFFFFFFF
+        step = (hash_value >> 64) | 1
+        is_contained = True
+        for _ in range(self.number_of_hashes):
+            bit_index = position % number_of_bits
+            mask = 1 << (bit_index & 7)
+            if not bits[bit_index >> 3] & mask:
+                bits[bit_index >> 3] |= mask
+                is_contained = False
+            position += step
+        if not is_contained:
+            self.number_of_items += 1
+        return is_contained
+
+    @property
+    def estimated_false_positive_rate(self) -> float:
+        """ for the number of items added so far """
+        return (1 - math.exp(-self.number_of_hashes * self.number_of_items / self.number_of_bits)) ** self.number_of_hashes
+
+
+class RowDeduplicator(object):
+    """
+    a streaming filter for duplicate rows : filter() yields the first row of every key and counts the duplicates.
+    the key of a row are the values of key_fieldnames (all values if None), its fingerprint is the 128 bit blake2b hash of the values.
+
+    mode:
+        'exact' : the fingerprints are kept in a dict, and moved to a sqlite table in a temporary directory
+                  (in path_spill_directory) when they need more than memory_budget bytes.
+                  a wrong duplicate needs a collision of the 128 bit fingerprints
+        'bloom' : a Bloom filter for expected_number_of_rows keys with the false_positive_rate, the bit array takes at most memory_budget bytes.
+                  a unique row is dropped as duplicate with the false positive rate - more, if there are more keys than expected.
+
+    >>> rows = [{'nr': '1', 'x': 'a'}, {'nr': '2', 'x': 'b'}, {'nr': '1', 'x': 'c'}, {'nr': '3', 'x': 'a'}]
+    >>> deduplicator = RowDeduplicator(key_fieldnames=['nr'])
+    >>> list(deduplicator.filter(rows)), deduplicator
+    ([{'nr': '1', 'x': 'a'}, {'nr': '2', 'x': 'b'}, {'nr': '3', 'x': 'a'}], RowDeduplicator(mode='exact', rows=4, duplicates=1))
+    >>> deduplicator.is_duplicate({'nr': '2', 'x': 'z'}), deduplicator.is_duplicate({'nr': '4', 'x': 'z'})
+    (True, False)
+
+    >>> # Test spill to disk
+    >>> deduplicator = RowDeduplicator(memory_budget=BYTES_PER_FINGERPRINT * 100)
+    >>> sum(1 for _ in deduplicator.filter({'nr': str(index % 1000)} for index in range(5000))), deduplicator.number_of_spills > 0
+    (1000, True)
+    >>> deduplicator.close()
+
+    >>> # Test bloom filter
+    >>> deduplicator = RowDeduplicator(mode='bloom', expected_number_of_rows=1000, false_positive_rate=0.01)
+    >>> sum(1 for _ in deduplicator.filter({'nr': str(index % 1000)} for index in range(5000))) > 980, deduplicator.memory_size
+    (True, 1199)
+
+    """
+
+    def __init__(self,
+                 key_fieldnames: Optional[List[str]] = None,
+                 mode: str = 'exact',
+                 memory_budget: int = 256 * 1024 * 1024,
+                 expected_number_of_rows: int = 10000000,
+                 false_positive_rate: float = 0.001,
+                 path_spill_directory: Optional[pathlib.Path] = None) -> None:
+        if mode not in MODES:
+            raise ValueError(f'mode must be "exact" or "bloom", not "{mode}"')
+        self.key_fieldnames = key_fieldnames
+        self.mode = mode
+        self.number_of_rows = 0
+        self.number_of_duplicates = 0
+        if mode == 'exact':
+            self._fingerprint_store = _FingerprintStore(max(memory_budget // BYTES_PER_FINGERPRINT, 1), path_spill_directory)
+        else:
+            self._bloom_filter = _BloomFilter(expected_number_of_rows, false_positive_rate, max_bytes=memory_budget)
+
+    @property
+    def number_of_spills(self) -> int:
+        return self._fingerprint_store.number_of_spills if self.mode == 'exact' else 0
+
+    @property
+    def memory_size(self) -> int:
+        """ the bytes of the bit array, or the estimated bytes of the fingerprints in memory """
+        if self.mode == 'exact':
+            return len(self._fingerprint_store.dict_fingerprints) * BYTES_PER_FINGERPRINT
+        return len(self._bloom_filter.bits)
+
+    @property
+    def estimated_false_positive_rate(self) -> float:
+        return self._bloom_filter.estimated_false_positive_rate if self.mode == 'bloom' else 0.0
+
+    def get_fingerprint(self, row: Mapping[str, Any]) -> bytes:
+        values = row.values() if self.key_fieldnames is None else (row[fieldname] for fieldname in self.key_fieldnames)
+        return get_fingerprint(values)
+
+    def is_duplicate(self, row: Mapping[str, Any]) -> bool:
+        """ adds the row, returns True if a row with the same key was added before """
+        return self._add_fingerprints([self.get_fingerprint(row)])[0]
+
+    def filter(self, rows: Iterable[Mapping[str, Any]]) -> Iterator[Any]:
+        """ yields the rows whose key was not seen before """
+        it_rows = iter(rows)
+        while True:
+            l_rows = list(itertools.islice(it_rows, BATCH_SIZE))
+            if not l_rows:
+                return
+            l_is_duplicate = self._add_fingerprints([self.get_fingerprint(row) for row in l_rows])
+            yield from itertools.compress(l_rows, (not is_duplicate for is_duplicate in l_is_duplicate))
+
+    def close(self) -> None:
+        """ removes the spill database """
+        if self.mode == 'exact':
+            self._fingerprint_store.close()
+
+    def __enter__(self) -> 'RowDeduplicator':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f'RowDeduplicator(mode={self.mode!r}, rows={self.number_of_rows}, duplicates={self.number_of_duplicates})'
+
+    def _add_fingerprints(self, l_fingerprints: List[bytes]) -> List[bool]:
+        if self.mode == 'bloom':
+            l_is_duplicate = list(map(self._bloom_filter.add, l_fingerprints))
+        else:
+            dict_found = self._fingerprint_store.get_many(l_fingerprints)
+            dict_new = dict()                               # type: Dict[bytes, int]
+            l_is_duplicate = []
+            for fingerprint in l_fingerprints:
+                is_duplicate = fingerprint in dict_found or fingerprint in dict_new
+                if not is_duplicate:
+                    dict_new[fingerprint] = 0
+                l_is_duplicate.append(is_duplicate)
+            self._fingerprint_store.set_many(dict_new)
+        self.number_of_rows += len(l_fingerprints)
+        self.number_of_duplicates += sum(l_is_duplicate)
+        return l_is_duplicate
+
+
+def get_fingerprint(values: Iterable[Any]) -> bytes:
+    """
+    the 128 bit blake2b hash of the values as str, each prefixed with its length - so the values can not run into each other,
+    and None is not the same as an empty value
+
+    >>> get_fingerprint(['a', 1]) == get_fingerprint(['a', '1']), get_fingerprint(['a;b']) == get_fingerprint(['a', 'b']), len(get_fingerprint(['a']))
+    (True, False, 16)
+    >>> get_fingerprint(['a\\x1fb', 'c']) == get_fingerprint(['a', 'b\\x1fc']), get_fingerprint(['1:a']) == get_fingerprint(['a', 'a'])
+    (False, False)
+    >>> get_fingerprint([None]) == get_fingerprint(['']), get_fingerprint([None]) == get_fingerprint(['-'])
+    (False, False)
+    """
+    l_parts = []
+    for value in values:
+        if value is None:
+            l_parts.append(NULL_MARKER)
+        else:
+            text = str(value)
+            l_parts.append(f'{len(text)}:{text}')
+    text = ''.join(l_parts)
+    return hashlib.blake2b(text.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+
+
+class DeduplicationSummary(object):
+    """
+    the result of deduplicate_csv_file
+    """
+
+    def __init__(self, path_csv_file: pathlib.Path, mode: str, keep: str, number_of_rows: int, number_of_duplicates: int,
+                 estimated_false_positive_rate: float = 0.0) -> None:
+        self.path_csv_file = path_csv_file
+        self.mode = mode
+        self.keep = keep
+        self.number_of_rows = number_of_rows
+        self.number_of_duplicates = number_of_duplicates
+        self.estimated_false_positive_rate = estimated_false_positive_rate
+
+    @property
+    def number_of_unique_rows(self) -> int:
+        return self.number_of_rows - self.number_of_duplicates
+
+    def __repr__(self) -> str:
+        return (f'DeduplicationSummary(mode={self.mode!r}, keep={self.keep!r}, rows={self.number_of_rows}, '
+                f'unique_rows={self.number_of_unique_rows}, duplicates={self.number_of_duplicates})')
+
+
+def deduplicate_csv_file(path_csv_file: pathlib.Path,
+                         path_output_file: pathlib.Path,
+                         key_fieldnames: Optional[List[str]] = None,
+                         keep: str = 'first',
+                         mode: str = 'exact',
+                         memory_budget: int = 256 * 1024 * 1024,
+                         expected_number_of_rows: Optional[int] = None,
+                         false_positive_rate: float = 0.001,
+                         path_spill_directory: Optional[pathlib.Path] = None,
+                         encoding: str = "ISO-8859-1",
+                         delimiter: str = ";",
+                         quotechar: str = '"',
+                         quoting: int = csv.QUOTE_MINIMAL) -> DeduplicationSummary:
+    """
+    writes the rows of the csv file without duplicates of key_fieldnames to path_output_file, see RowDeduplicator.
+    the output file is written with open_atomic_for_write.
+
+    keep:
+        'first' : the first row of every key is kept, the file is read once
+        'last'  : the last row of every key is kept at its position - the file is read twice : the first pass stores the last
+                  row number of every fingerprint, the second pass writes the rows with these row numbers. needs mode 'exact'
+    expected_number_of_rows: for the size of the Bloom filter, if None the records of the file are counted with lib_csv.profiling.count_records
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / 'dedup_test.csv'
+    >>> path_output_file = test_directory / 'dedup_test_output.csv'
+    >>> _ = testfile.write_text('nr;price\\n1;10\\n2;20\\n1;11\\n3;30\\n1;12\\n')
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+
+    >>> # Test keep first
+    >>> deduplicate_csv_file(testfile, path_output_file, key_fieldnames=['nr'])
+    DeduplicationSummary(mode='exact', keep='first', rows=5, unique_rows=3, duplicates=2)
+    >>> [(dict_row['nr'], dict_row['price']) for dict_row in read_csv_file_with_header_to_list_of_dicts(path_output_file)]
+    [('1', '10'), ('2', '20'), ('3', '30')]
+
+    >>> # Test keep last, with spill to disk
+    >>> deduplicate_csv_file(testfile, path_output_file, key_fieldnames=['nr'], keep='last', memory_budget=1)
+    DeduplicationSummary(mode='exact', keep='last', rows=5, unique_rows=3, duplicates=2)
+    >>> [(dict_row['nr'], dict_row['price']) for dict_row in read_csv_file_with_header_to_list_of_dicts(path_output_file)]
+    [('2', '20'), ('3', '30'), ('1', '12')]
+
+    >>> # Test bloom filter
+    >>> deduplicate_csv_file(testfile, path_output_file, key_fieldnames=['nr'], mode='bloom')
+    DeduplicationSummary(mode='bloom', keep='first', rows=5, unique_rows=3, duplicates=2)
+    >>> deduplicate_csv_file(testfile, path_output_file, keep='last', mode='bloom')
+    Traceback (most recent call last):
+        ...
+    ValueError: keep="last" needs mode="exact"
+
+    >>> # Teardown
+    >>> testfile.unlink()
+    >>> path_output_file.unlink()
+
+    """
+    if keep not in KEEP_POLICIES:
+        raise ValueError(f'keep must be "first" or "last", not "{keep}"')
+    if keep == 'last' and mode != 'exact':
+        raise ValueError('keep="last" needs mode="exact"')
+    dict_reader_kwargs = dict(encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting)     # type: Dict[str, Any]
+    fieldnames = read_csv_file_header(path_csv_file, **dict_reader_kwargs)
+    for fieldname in key_fieldnames or []:
+        if fieldname not in fieldnames:
+            raise ValueError(f'Field "{fieldname}" is not available, or the csv file does not have header information')
+    if mode == 'bloom' and expected_number_of_rows is None:
+        expected_number_of_rows = count_records(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar)
+
+    deduplicator = RowDeduplicator(key_fieldnames=key_fieldnames, mode=mode, memory_budget=memory_budget,
+                                   expected_number_of_rows=expected_number_of_rows or 1, false_positive_rate=false_positive_rate,
+                                   path_spill_directory=path_spill_directory)
+    with deduplicator, open_atomic_for_write(path_output_file, 'w', encoding=encoding, newline='', buffering=1024 * 1024) as f_output_file:
+        csv_writer = csv.writer(f_output_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting)
+        csv_writer.writerow(fieldnames)
+        it_rows = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file, **dict_reader_kwargs)
+        if keep == 'first':
+            csv_writer.writerows(row.values() for row in deduplicator.filter(it_rows))
+        else:
+            csv_writer.writerows(row.values() for row in _iter_last_rows(path_csv_file, deduplicator, dict_reader_kwargs))
+    return DeduplicationSummary(pathlib.Path(path_csv_file), mode, keep, deduplicator.number_of_rows, deduplicator.number_of_duplicates,
+                                deduplicator.estimated_false_positive_rate)
+
+
+def _iter_last_rows(path_csv_file: pathlib.Path, deduplicator: RowDeduplicator, dict_reader_kwargs: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """ keep='last' : the first pass stores the last row number of every fingerprint, the second pass yields the rows with these row numbers """
+    fingerprint_store = deduplicator._fingerprint_store
+    get_fingerprint = deduplicator.get_fingerprint
+    it_rows = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file, **dict_reader_kwargs)
+    row_number = 0
+    while True:
+        l_rows = list(itertools.islice(it_rows, BATCH_SIZE))
+        if not l_rows:
+            break
+        dict_last_row_numbers = dict()                      # type: Dict[bytes, int]
+        for row in l_rows:
+            dict_last_row_numbers[get_fingerprint(row)] = row_number
+            row_number += 1
+        fingerprint_store.set_many(dict_last_row_numbers)
+
+    it_rows = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file, **dict_reader_kwargs)
+    row_number = 0
+    while True:
+        l_rows = list(itertools.islice(it_rows, BATCH_SIZE))
+        if not l_rows:
+            break
+        l_fingerprints = [get_fingerprint(row) for row in l_rows]
+        dict_last_row_numbers = fingerprint_store.get_many(l_fingerprints)
+        for row, fingerprint in zip(l_rows, l_fingerprints):
+            if dict_last_row_numbers[fingerprint] == row_number:
+                yield row
+            else:
+                deduplicator.number_of_duplicates += 1
+            row_number += 1
+        deduplicator.number_of_rows += len(l_rows)
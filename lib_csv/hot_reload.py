@@ -0,0 +1,219 @@
+# STDLIB
+from collections import OrderedDict
+import logging
+import os
+import pathlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# PROJ
+try:
+    from .lib_csv import read_csv_file_with_header_to_hashed_odict_of_odicts
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import read_csv_file_with_header_to_hashed_odict_of_odicts      # type: ignore  # pragma: no cover
+
+
+logger = logging.getLogger()     # type: logging.Logger
+
+
+class TableDelta(object):
+    """
+    the keys which were added, changed or removed by a reload
+    """
+
+    def __init__(self, l_added_keys: List[Any], l_changed_keys: List[Any], l_removed_keys: List[Any]) -> None:
+        self.l_added_keys = l_added_keys
+        self.l_changed_keys = l_changed_keys
+        self.l_removed_keys = l_removed_keys
+
+    def __bool__(self) -> bool:
+        return bool(self.l_added_keys or self.l_changed_keys or self.l_removed_keys)
+
+    def __repr__(self) -> str:
+        return f'TableDelta(added={self.l_added_keys}, changed={self.l_changed_keys}, removed={self.l_removed_keys})'
+
+
+class HotReloadingKeyedTable(object):
+    """
+    holds the result of read_csv_file_with_header_to_hashed_odict_of_odicts and follows the changes of the csv file.
+
+    a background thread (start / stop, or use it as context manager) polls the modification time and size of the file every poll_interval seconds.
+    on a change the file is read again, every row is fingerprinted and only the added, changed and removed keys are patched
+    into a copy of the current table. unchanged rows keep their objects, new keys are appended at the end.
+    the new version is published by replacing one reference, so readers never block and never see a half updated table.
+    if the file can not be read (for instance while it is written non atomically) the current version is kept.
+
+    the rows of a published version must not be modified by the readers.
+
+    >>> # setup
+    >>> import time
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / 'hot_reload_test.csv'
+    >>> _ = testfile.write_text('nr;price\\n1;10\\n2;20\\n3;30\\n')
+    >>> os.utime(str(testfile), ns=(1500000000 * 10 ** 9, 1500000000 * 10 ** 9))
+
+    >>> # Test OK
+    >>> table = HotReloadingKeyedTable(testfile, hash_by_fieldname='nr')
+    >>> table.get('2'), len(table), table.version
+    (OrderedDict([('nr', '2'), ('price', '20')]), 3, 1)
+    >>> row_1 = table['1']
+
+    >>> # Test delta reload
+    >>> _ = testfile.write_text('nr;price\\n1;10\\n2;21\\n4;40\\n')
+    >>> os.utime(str(testfile), ns=(1500000001 * 10 ** 9, 1500000001 * 10 ** 9))
+    >>> table.reload_if_changed()
+    TableDelta(added=['4'], changed=['2'], removed=['3'])
+    >>> list(table), table['2']['price'], table['1'] is row_1, table.version
+    (['1', '2', '4'], '21', True, 2)
+    >>> table.reload_if_changed() is None
+    True
+
+    >>> # Test a changed header with the same values is a change
+    >>> _ = testfile.write_text('nr;cost\\n1;10\\n2;21\\n4;40\\n')
+    >>> os.utime(str(testfile), ns=(1500000002 * 10 ** 9, 1500000002 * 10 ** 9))
+    >>> table.reload_if_changed()
+    TableDelta(added=[], changed=['1', '2', '4'], removed=[])
+
+    >>> # Test background thread, a broken file keeps the current version
+    >>> with table:
+    ...     _ = testfile.write_text('nr;price\\n1;10\\n1;11\\n')
+    ...     os.utime(str(testfile), ns=(1500000003 * 10 ** 9, 1500000003 * 10 ** 9))
+    ...     for _ in range(1000):
+    ...         if table.last_exception is not None:
+    ...             break
+    ...         time.sleep(0.01)
+    >>> table.version, table.last_exception
+    (3, ValueError('Index is not unique, field: "nr", value: "1"'))
+
+    >>> # Teardown
+    >>> testfile.unlink()
+
+    """
+
+    def __init__(self, path_csv_file: pathlib.Path, hash_by_fieldname: str, poll_interval: float = 0.1, **reader_kwargs: Any) -> None:
+        self.path_csv_file = pathlib.Path(path_csv_file)
+        self.hash_by_fieldname = hash_by_fieldname
+        self.poll_interval = poll_interval
+        self.reader_kwargs = reader_kwargs
+        self.version = 0
+        self.last_delta = None                          # type: Optional[TableDelta]
+        self.last_exception = None                      # type: Optional[BaseException]
+        self._reload_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None                             # type: Optional[threading.Thread]
+        self._file_signature = self._get_file_signature()
+        self._table = self._read_table()                # type: OrderedDict[Any, OrderedDict[str, Any]]
+        self._dict_fingerprints = {key: _get_fingerprint(row) for key, row in self._table.items()}
+        self.version = 1
+
+    # reading : one reference is read, the published tables are never modified
+
+    def snapshot(self) -> 'OrderedDict[Any, OrderedDict[str, Any]]':
+        """ the current version of the table, it stays consistent while the table is reloaded """
+        return self._table
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self._table.get(key, default)
+
+    def __getitem__(self, key: Any) -> 'OrderedDict[str, Any]':
+        return self._table[key]
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._table)
+
+    # reloading
+
+    def reload_if_changed(self) -> Optional[TableDelta]:
+        """
+        reads the file again if its modification time or size changed, and publishes the new version if there is a delta.
+        returns the delta, or None if the file did not change
+        """
+        with self._reload_lock:
+            file_signature = self._get_file_signature()
+            if file_signature == self._file_signature:
+                return None
+            new_table = self._read_table()
+            if self._get_file_signature() != file_signature:
+                # changed while reading - read it on the next poll
+                return None
+            self._file_signature = file_signature
+
+            dict_new_fingerprints = dict()
+            l_added_keys, l_changed_keys = list(), list()
+            for key, row in new_table.items():
+                fingerprint = _get_fingerprint(row)
+                dict_new_fingerprints[key] = fingerprint
+                old_fingerprint = self._dict_fingerprints.get(key)
+                if old_fingerprint is None:
+                    l_added_keys.append(key)
+                elif old_fingerprint != fingerprint:
+                    l_changed_keys.append(key)
+            l_removed_keys = [key for key in self._dict_fingerprints if key not in dict_new_fingerprints]
+            delta = TableDelta(l_added_keys, l_changed_keys, l_removed_keys)
+
+            if delta:
+                patched_table = self._table.copy()
+                for key in l_removed_keys:
+                    del patched_table[key]
+                for key in l_changed_keys:
+                    patched_table[key] = new_table[key]
+                for key in l_added_keys:
+                    patched_table[key] = new_table[key]
+                # publish - a single reference assignment is atomic
+                self._table = patched_table
+                self._dict_fingerprints = dict_new_fingerprints
+                self.version += 1
+            self.last_delta = delta
+            return delta
+
+    def start(self) -> None:
+        """ starts the background thread which polls the file """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll_file, name=f'HotReloadingKeyedTable {self.path_csv_file.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ stops the background thread """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self) -> 'HotReloadingKeyedTable':
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def _poll_file(self) -> None:
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.reload_if_changed()
+                self.last_exception = None
+            except Exception as exc:
+                if repr(exc) != repr(self.last_exception):
+                    logger.warning(f'csv file "{self.path_csv_file}" could not be reloaded, keeping version {self.version}: {exc}')
+                self.last_exception = exc
+
+    def _read_table(self) -> 'OrderedDict[Any, OrderedDict[str, Any]]':
+        return read_csv_file_with_header_to_hashed_odict_of_odicts(self.path_csv_file, hash_by_fieldname=self.hash_by_fieldname, **self.reader_kwargs)
+
+    def _get_file_signature(self) -> Tuple[int, int]:
+        stat_file = os.stat(str(self.path_csv_file))
+        return stat_file.st_mtime_ns, stat_file.st_size
+
+
+def _get_fingerprint(row: Dict[str, Any]) -> int:
+    """ the hash of the fieldnames and values - a collision (2 ** -64 per row) would hide a change """
+    return hash(tuple(row.items()))
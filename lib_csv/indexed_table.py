@@ -0,0 +1,233 @@
+# STDLIB
+import bisect
+import csv
+import operator
+import pathlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+# PROJ
+try:
+    from .lib_csv import read_csv_file_with_header_to_iterator_of_dicts
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import read_csv_file_with_header_to_iterator_of_dicts      # type: ignore  # pragma: no cover
+
+
+class _TableIndex(object):
+    """
+    one index of an IndexedTable : the key is the value of the field, or the tuple of the values of the fields of a composite index.
+    a unique index maps the key to the row, a non unique index maps the key to the list of the rows in the order of the table
+    """
+
+    def __init__(self, name: str, fieldnames: Tuple[str, ...], is_unique: bool) -> None:
+        self.name = name
+        self.fieldnames = fieldnames
+        self.is_unique = is_unique
+        self.get_key = operator.itemgetter(*fieldnames)     # type: Callable[[Mapping[str, Any]], Any]
+        self.dict_rows = dict()                             # type: Dict[Any, Any]
+        self._l_sorted_keys = None                          # type: Optional[List[Any]]
+
+    def add_row(self, key: Any, dict_row: Dict[str, Any]) -> None:
+        if self.is_unique:
+            self.dict_rows[key] = dict_row
+        else:
+            l_rows = self.dict_rows.get(key)
+            if l_rows is None:
+                self.dict_rows[key] = [dict_row]
+            else:
+                l_rows.append(dict_row)
+        self._l_sorted_keys = None
+
+    def get_all(self, key: Any) -> List[Dict[str, Any]]:
+        if self.is_unique:
+            dict_row = self.dict_rows.get(key)
+            return [] if dict_row is None else [dict_row]
+        return list(self.dict_rows.get(key, []))
+
+    def get_keys_by_prefix(self, prefix: Any) -> Iterator[Any]:
+        """ the keys which start with the prefix, in sorted order - the sorted keys are kept until the next row is added """
+        if self._l_sorted_keys is None:
+            self._l_sorted_keys = sorted(self.dict_rows)
+        l_sorted_keys = self._l_sorted_keys
+        if isinstance(prefix, tuple):
+            def is_prefix_of(key: Any) -> bool:
+                return bool(key[:len(prefix)] == prefix)
+        else:
+            def is_prefix_of(key: Any) -> bool:
+                return bool(key.startswith(prefix))
+        for index in range(bisect.bisect_left(l_sorted_keys, prefix), len(l_sorted_keys)):
+            key = l_sorted_keys[index]
+            if not is_prefix_of(key):
+                break
+            yield key
+
+
+class IndexedTable(object):
+    """
+    the rows of a csv file with several indexes, which are built while the rows are added -
+    use read_csv_file_with_header_to_indexed_table to build the indexes in the same pass as the parsing.
+
+    unique_indexes, indexes: {index_name: fieldname or sequence of fieldnames}. a sequence of fieldnames is a composite index,
+                             its keys are the tuples of the values. a row with a key which already exists in a unique index
+                             raises ValueError and is not added. the keys of a non unique index can have many rows.
+    the keys are the values of the rows, so with a schema of the reader they are the converted values.
+
+    get(index_name, key)      : the row, for a non unique index the first row, or default
+    get_all(index_name, key)  : the list of the rows, in the order of the table
+    get_by_prefix(index_name, prefix) : the rows whose key starts with the prefix, ordered by key - the prefix of a composite
+                                        index is the tuple of the values of its first fields. the keys must be comparable, like str.
+                                        the sorted keys are built on the first prefix lookup after rows were added
+
+    >>> table = IndexedTable([{'nr': 'A1', 'ean': '400', 'supplier': 'S1', 'article': 'x'},
+    ...                       {'nr': 'A2', 'ean': '401', 'supplier': 'S1', 'article': 'y'},
+    ...                       {'nr': 'B1', 'ean': '402', 'supplier': 'S2', 'article': 'x'}],
+    ...                      unique_indexes={'nr': 'nr', 'supplier_article': ('supplier', 'article')}, indexes={'supplier': 'supplier'})
+    >>> table.get('supplier_article', ('S1', 'y'))['nr'], [row['nr'] for row in table.get_all('supplier', 'S1')]
+    ('A2', ['A1', 'A2'])
+    >>> [row['nr'] for row in table.get_by_prefix('nr', 'A')], [row['nr'] for row in table.get_by_prefix('supplier_article', ('S2', ))]
+    (['A1', 'A2'], ['B1'])
+    >>> table.add_row({'nr': 'A1', 'ean': '403', 'supplier': 'S3', 'article': 'z'})
+    Traceback (most recent call last):
+        ...
+    ValueError: Index is not unique, field: "nr", value: "A1"
+    >>> len(table), table.get('nr', 'C1'), table.get_all('supplier', 'S3')
+    (3, None, [])
+
+    """
+
+    def __init__(self,
+                 l_dict_data: Iterable[Dict[str, Any]] = (),
+                 unique_indexes: Optional[Mapping[str, Union[str, Sequence[str]]]] = None,
+                 indexes: Optional[Mapping[str, Union[str, Sequence[str]]]] = None) -> None:
+        self.l_dict_data = []                               # type: List[Dict[str, Any]]
+        self.dict_indexes = dict()                          # type: Dict[str, _TableIndex]
+        for dict_index_definitions, is_unique in ((unique_indexes or {}, True), (indexes or {}, False)):
+            for index_name, fieldnames in dict_index_definitions.items():
+                if index_name in self.dict_indexes:
+                    raise ValueError(f'the index "{index_name}" is defined twice')
+                t_fieldnames = (fieldnames, ) if isinstance(fieldnames, str) else tuple(fieldnames)
+                if not t_fieldnames:
+                    raise ValueError(f'the index "{index_name}" has no fields')
+                self.dict_indexes[index_name] = _TableIndex(index_name, t_fieldnames, is_unique)
+        self._l_unique_indexes = [index for index in self.dict_indexes.values() if index.is_unique]
+        self._l_non_unique_indexes = [index for index in self.dict_indexes.values() if not index.is_unique]
+        self.add_rows(l_dict_data)
+
+    def add_row(self, dict_row: Dict[str, Any]) -> None:
+        self.add_rows((dict_row, ))
+
+    def add_rows(self, l_dict_data: Iterable[Dict[str, Any]]) -> None:
+        l_unique_indexes = [(index.get_key, index.dict_rows, index) for index in self._l_unique_indexes]
+        l_non_unique_indexes = [(index.get_key, index) for index in self._l_non_unique_indexes]
+        is_first_row = not self.l_dict_data
+        for dict_row in l_dict_data:
+            if is_first_row:
+                is_first_row = False
+                self._check_fieldnames(dict_row)
+            # all unique keys are checked before the row is added to any index
+            l_unique_keys = [get_key(dict_row) for get_key, _, _ in l_unique_indexes]
+            for key, (_, dict_rows, index) in zip(l_unique_keys, l_unique_indexes):
+                if key in dict_rows:
+                    raise ValueError('Index is not unique, field: "{}", value: "{}"'.format(index.name, key))
+            for key, (_, _, index) in zip(l_unique_keys, l_unique_indexes):
+                index.add_row(key, dict_row)
+            for get_key, index in l_non_unique_indexes:
+                index.add_row(get_key(dict_row), dict_row)
+            self.l_dict_data.append(dict_row)
+
+    def get(self, index_name: str, key: Any, default: Any = None) -> Any:
+        index = self._get_index(index_name)
+        value = index.dict_rows.get(key)
+        if value is None:
+            return default
+        return value if index.is_unique else value[0]
+
+    def get_all(self, index_name: str, key: Any) -> List[Dict[str, Any]]:
+        return self._get_index(index_name).get_all(key)
+
+    def get_by_prefix(self, index_name: str, prefix: Any) -> List[Dict[str, Any]]:
+        index = self._get_index(index_name)
+        l_rows = []                                         # type: List[Dict[str, Any]]
+        for key in index.get_keys_by_prefix(prefix):
+            l_rows.extend(index.get_all(key))
+        return l_rows
+
+    def keys(self, index_name: str) -> Iterator[Any]:
+        """ the distinct keys of the index, in the order of their first row """
+        return iter(self._get_index(index_name).dict_rows)
+
+    def __len__(self) -> int:
+        return len(self.l_dict_data)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return self.l_dict_data[index]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.l_dict_data)
+
+    def __repr__(self) -> str:
+        return f'IndexedTable(rows={len(self.l_dict_data)}, indexes={list(self.dict_indexes)})'
+
+    def _get_index(self, index_name: str) -> _TableIndex:
+        index = self.dict_indexes.get(index_name)
+        if index is None:
+            raise KeyError(f'the index "{index_name}" does not exist')
+        return index
+
+    def _check_fieldnames(self, dict_row: Mapping[str, Any]) -> None:
+        for index in self.dict_indexes.values():
+            for fieldname in index.fieldnames:
+                if fieldname not in dict_row:
+                    raise ValueError('Field "{}" is not available, or the csv file does not have header information'.format(fieldname))
+
+
+def read_csv_file_with_header_to_indexed_table(path_csv_file: pathlib.Path,
+                                               unique_indexes: Optional[Mapping[str, Union[str, Sequence[str]]]] = None,
+                                               indexes: Optional[Mapping[str, Union[str, Sequence[str]]]] = None,
+                                               encoding: str = "ISO-8859-1",
+                                               delimiter: str = ";",
+                                               quotechar: str = '"',
+                                               quoting: int = csv.QUOTE_MINIMAL,
+                                               check_row_length: bool = True,
+                                               schema: Optional[Dict[str, Callable[[str], Any]]] = None,
+                                               value_interner: Any = None,
+                                               engine: str = 'auto') -> IndexedTable:
+    """
+    reads the csv file into an IndexedTable, the indexes are built while the rows are parsed.
+    the other parameters are passed to read_csv_file_with_header_to_iterator_of_dicts
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / '2018-04-26_alle_Navision_Artikel.csv'
+
+    >>> # Test unique, non unique and composite indexes
+    >>> table = read_csv_file_with_header_to_indexed_table(testfile, unique_indexes={'nr': 'Nr.'},
+    ...                                                    indexes={'supplier': 'Kreditorennr.', 'supplier_article': ('Kreditorennr.', 'Kred.-Artikelnr.')},
+    ...                                                    check_row_length=False)
+    >>> table
+    IndexedTable(rows=4626, indexes=['nr', 'supplier', 'supplier_article'])
+    >>> table.get('nr', 'HUB025')['Beschreibung'], len(table.get_all('supplier', '377020'))
+    ('Arbeitsbühne APF-A-10-125, Höhe 10m, Cap. 125kg', 334)
+    >>> len(table.get_all('supplier_article', ('377011', 'parbeau KSD302, NC, etc...'))), len(table.get_by_prefix('supplier_article', ('377020', )))
+    (22, 334)
+    >>> [row['Nr.'] for row in table.get_by_prefix('nr', 'HUB00')]
+    ['HUB001', 'HUB002', 'HUB003', 'HUB004', 'HUB005', 'HUB006', 'HUB007', 'HUB008', 'HUB009']
+
+    >>> # Test composite key is not unique
+    >>> read_csv_file_with_header_to_indexed_table(testfile, unique_indexes={'supplier_article': ('Kreditorennr.', 'Kred.-Artikelnr.')},
+    ...                                            check_row_length=False)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    ValueError: Index is not unique, field: "supplier_article", value: "(...)"
+
+    >>> # Test field not available
+    >>> read_csv_file_with_header_to_indexed_table(testfile, indexes={'ean': 'EAN'}, check_row_length=False)
+    Traceback (most recent call last):
+        ...
+    ValueError: Field "EAN" is not available, or the csv file does not have header information
+
+    """
+    it_dict_data = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar,
+                                                                  quoting=quoting, check_row_length=check_row_length, schema=schema,
+                                                                  value_interner=value_interner, engine=engine)
+    return IndexedTable(it_dict_data, unique_indexes=unique_indexes, indexes=indexes)
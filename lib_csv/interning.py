@@ -0,0 +1,230 @@
+# STDLIB
+import array
+import csv
+import pathlib
+import sys
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+
+class ValueInterner(object):
+    """
+    shares one str object per distinct value of low cardinality columns, like 'Ja' / 'Nein' flags.
+    pass it as value_interner to the readers.
+
+    fieldnames: the columns to intern, if None the low cardinality columns are detected automatically :
+                every column is interned until it has more than max_distinct_values distinct values.
+    bytes_saved: the size of the str objects which were replaced by an already existing one
+
+    >>> interner = ValueInterner()
+    >>> interner.set_fieldnames(['flag', 'nr'])
+    >>> l_rows = [interner.intern_row([''.join(['J', 'a']), str(index)]) for index in range(1000)]
+    >>> all(row[0] is l_rows[0][0] for row in l_rows)
+    True
+    >>> interner.l_interned_fieldnames
+    ['flag']
+    >>> interner.bytes_saved
+    50949
+    """
+
+    def __init__(self, fieldnames: Optional[Iterable[str]] = None, max_distinct_values: int = 256) -> None:
+        self.fieldnames = list(fieldnames) if fieldnames is not None else None
+        self.max_distinct_values = max_distinct_values
+        self.bytes_saved = 0
+        self.number_of_interned_values = 0
+        self._l_header = list()                                 # type: List[str]
+        self._dict_values_by_index = dict()                     # type: Dict[int, Dict[str, str]]
+        self._l_active_columns = list()                         # type: List[Tuple[int, Dict[str, str]]]
+
+    def set_fieldnames(self, header: List[str]) -> None:
+        """ sets the header of the file, called by the readers """
+        self._l_header = list(header)
+        if self.fieldnames is None:
+            indexes = range(len(header))    # type: Iterable[int]
+        else:
+            for fieldname in self.fieldnames:
+                if fieldname not in header:
+                    raise ValueError(f'Field "{fieldname}" is not available, or the csv file does not have header information')
+            indexes = [header.index(fieldname) for fieldname in self.fieldnames]
+        self._dict_values_by_index = {index: dict() for index in indexes}
+        self._l_active_columns = list(self._dict_values_by_index.items())
+
+    @property
+    def l_interned_fieldnames(self) -> List[str]:
+        """ the columns which are (still) interned """
+        return [self._l_header[index] for index in sorted(self._dict_values_by_index)]
+
+    def intern_row(self, row: List[str]) -> List[str]:
+        """ replaces the values of the interned columns in place by the shared objects and returns the row """
+        number_of_fields = len(row)
+        is_column_dropped = False
+        for index, dict_values in self._l_active_columns:
+            if index >= number_of_fields:
+                continue
+            value = row[index]
+            shared_value = dict_values.get(value)
+            if shared_value is None:
+                dict_values[value] = value
+                if self.fieldnames is None and len(dict_values) > self.max_distinct_values:
+                    # high cardinality - interning would only cost memory for the lookup dict
+                    del self._dict_values_by_index[index]
+                    is_column_dropped = True
+            elif shared_value is not value:
+                row[index] = shared_value
+                self.bytes_saved += sys.getsizeof(value)
+                self.number_of_interned_values += 1
+        if is_column_dropped:
+            self._l_active_columns = list(self._dict_values_by_index.items())
+        return row
+
+
+class DictionaryEncodedTable(object):
+    """
+    stores the rows column wise, low cardinality columns as small integer codes with a lookup table.
+    the columns are encoded while the rows are added, so the rows can come from a reader without a list of all rows -
+    use read_csv_file_with_header_to_dictionary_encoded_table to encode the columns in the same pass as the parsing.
+    a column with more than max_distinct_values distinct values is stored as list of the values.
+    the rows are built as dicts on access.
+
+    >>> l_dict_data = [{'flag': 'Ja' if index % 3 else 'Nein', 'nr': str(index)} for index in range(1000)]
+    >>> table = DictionaryEncodedTable(iter(l_dict_data))
+    >>> len(table), table[2], table[3]
+    (1000, {'flag': 'Ja', 'nr': '2'}, {'flag': 'Nein', 'nr': '3'})
+    >>> table.dict_lookup_tables
+    {'flag': ['Nein', 'Ja']}
+    >>> list(table)[:2]
+    [{'flag': 'Nein', 'nr': '0'}, {'flag': 'Ja', 'nr': '1'}]
+    >>> table.bytes_saved > 40000
+    True
+
+    >>> # Test the codes are widened beyond 256 distinct values
+    >>> table = DictionaryEncodedTable(({'nr': str(index % 300)} for index in range(600)), max_distinct_values=1000)
+    >>> table.dict_columns['nr'].typecode, table[299], table[599]
+    ('H', {'nr': '299'}, {'nr': '299'})
+    """
+
+    def __init__(self, l_dict_data: Iterable[Mapping[str, Any]] = (), fieldnames: Optional[List[str]] = None, max_distinct_values: int = 256) -> None:
+        self.fieldnames = list(fieldnames) if fieldnames is not None else None
+        self.max_distinct_values = max_distinct_values
+        self.dict_lookup_tables = dict()      # type: Dict[str, List[Any]]
+        self.dict_columns = dict()            # type: Dict[str, Any]
+        self._dict_codes_by_fieldname = dict()      # type: Dict[str, Dict[Any, int]]
+        self._number_of_rows = 0
+        if self.fieldnames is not None:
+            self._set_fieldnames(self.fieldnames)
+        self.add_rows(l_dict_data)
+
+    def add_rows(self, l_dict_data: Iterable[Mapping[str, Any]]) -> None:
+        """ encodes the rows, the fieldnames are taken from the first row if they are not set """
+        max_distinct_values = self.max_distinct_values
+        for dict_row in l_dict_data:
+            if self.fieldnames is None:
+                self.fieldnames = list(dict_row.keys())
+                self._set_fieldnames(self.fieldnames)
+            for fieldname in self.fieldnames:
+                value = dict_row.get(fieldname)
+                dict_codes = self._dict_codes_by_fieldname.get(fieldname)
+                if dict_codes is None:
+                    self.dict_columns[fieldname].append(value)
+                    continue
+                code = dict_codes.get(value)
+                if code is None:
+                    code = len(dict_codes)
+                    if code >= max_distinct_values:
+                        self._decode_column(fieldname)
+                        self.dict_columns[fieldname].append(value)
+                        continue
+                    dict_codes[value] = code
+                    self.dict_lookup_tables[fieldname].append(value)
+                    if code == 256 or code == 65536:
+                        self._widen_column(fieldname)
+                self.dict_columns[fieldname].append(code)
+            self._number_of_rows += 1
+
+    def add_row(self, dict_row: Mapping[str, Any]) -> None:
+        self.add_rows((dict_row, ))
+
+    @property
+    def bytes_saved(self) -> int:
+        """ the list of references and one object per value, against the array of the codes and every distinct object """
+        bytes_saved = 0
+        for fieldname, l_lookup_table in self.dict_lookup_tables.items():
+            codes = self.dict_columns[fieldname]
+            l_sizes = [sys.getsizeof(value) if value is not None else 0 for value in l_lookup_table]
+            size_plain = sys.getsizeof([None] * len(codes)) + sum(l_sizes[code] for code in codes)
+            size_encoded = sys.getsizeof(codes) + sum(l_sizes)
+            bytes_saved += size_plain - size_encoded
+        return bytes_saved
+
+    def __len__(self) -> int:
+        return self._number_of_rows
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if index < 0:
+            index += self._number_of_rows
+        if not 0 <= index < self._number_of_rows:
+            raise IndexError('DictionaryEncodedTable index out of range')
+        dict_row = dict()
+        for fieldname in self.fieldnames or ():
+            value = self.dict_columns[fieldname][index]
+            if fieldname in self.dict_lookup_tables:
+                value = self.dict_lookup_tables[fieldname][value]
+            dict_row[fieldname] = value
+        return dict_row
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self._number_of_rows):
+            yield self[index]
+
+    def _set_fieldnames(self, fieldnames: List[str]) -> None:
+        for fieldname in fieldnames:
+            self.dict_columns[fieldname] = array.array('B')
+            self.dict_lookup_tables[fieldname] = list()
+            self._dict_codes_by_fieldname[fieldname] = dict()
+
+    def _widen_column(self, fieldname: str) -> None:
+        codes = self.dict_columns[fieldname]
+        self.dict_columns[fieldname] = array.array('H' if codes.typecode == 'B' else 'L', codes)
+
+    def _decode_column(self, fieldname: str) -> None:
+        """ high cardinality - the codes would only cost memory for the lookup table """
+        l_lookup_table = self.dict_lookup_tables.pop(fieldname)
+        del self._dict_codes_by_fieldname[fieldname]
+        self.dict_columns[fieldname] = [l_lookup_table[code] for code in self.dict_columns[fieldname]]
+
+
+def read_csv_file_with_header_to_dictionary_encoded_table(path_csv_file: pathlib.Path,
+                                                          max_distinct_values: int = 256,
+                                                          encoding: str = "ISO-8859-1",
+                                                          delimiter: str = ";",
+                                                          quotechar: str = '"',
+                                                          quoting: int = csv.QUOTE_MINIMAL,
+                                                          check_row_length: bool = True,
+                                                          schema: Optional[Dict[str, Callable[[str], Any]]] = None,
+                                                          engine: str = 'auto') -> DictionaryEncodedTable:
+    """
+    reads the csv file into a DictionaryEncodedTable, the columns are encoded while the rows are parsed.
+    the other parameters are passed to read_csv_file_with_header_to_iterator_of_dicts
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / '2018-06-06_active_qty.csv'
+
+    >>> # Test same rows as the reader
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+    >>> table = read_csv_file_with_header_to_dictionary_encoded_table(testfile)
+    >>> list(table) == [dict(row) for row in read_csv_file_with_header_to_list_of_dicts(testfile)]
+    True
+    >>> 'ItemID' in table.dict_lookup_tables, 'Quantity' in table.dict_lookup_tables, len(table.dict_lookup_tables['SiteID'])
+    (False, True, 2)
+
+    """
+    # imported here, lib_csv imports the ValueInterner of this module
+    try:
+        from .lib_csv import read_csv_file_with_header_to_iterator_of_dicts
+    except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+        # imports for doctest
+        from lib_csv import read_csv_file_with_header_to_iterator_of_dicts      # type: ignore  # pragma: no cover
+
+    it_dict_data = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar,
+                                                                  quoting=quoting, check_row_length=check_row_length, schema=schema, engine=engine)
+    return DictionaryEncodedTable(it_dict_data, max_distinct_values=max_distinct_values)
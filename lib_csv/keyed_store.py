@@ -0,0 +1,430 @@
+# STDLIB
+from collections import OrderedDict
+import csv
+import io
+import logging
+import os
+import pathlib
+import threading
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+# PROJ
+try:
+    from .bytes_reader import check_ascii_compatible_encoding
+    from .lib_csv import open_atomic_for_write
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from bytes_reader import check_ascii_compatible_encoding     # type: ignore  # pragma: no cover
+    from lib_csv import open_atomic_for_write                    # type: ignore  # pragma: no cover
+
+
+logger = logging.getLogger()     # type: logging.Logger
+
+# the segments of the store
+_BASE = 0
+_LOG = 1
+
+LOG_OPERATION_FIELDNAME = 'operation'
+LOG_OPERATION_UPSERT = 'U'
+LOG_OPERATION_DELETE = 'D'
+
+
+class KeyedCsvStore(object):
+    """
+    a keyed table on top of a csv file with header, which is updated without rewriting the file.
+
+    the upserts and deletes are appended to the log segment <path_csv_file>.log - a csv file with the column "operation" ('U' or 'D')
+    before the fields. the in-memory index holds the segment and the byte offset of the current record of every key,
+    so a read seeks to one record and parses it - the rows are not kept in memory.
+
+    compact() writes the current rows to a new csv file with open_atomic_for_write, replaces the base file and starts a new log,
+    which keeps the entries appended while the compaction was running. compact_in_background() runs it in a thread - it is started
+    automatically after a write, if the log is larger than compaction_min_log_size and compaction_ratio * the size of the base file.
+    if the process stops between the replacement of the base file and the log, the log is applied again on the next open,
+    which gives the same rows.
+
+    the keys are the values of hash_by_fieldname like read_csv_file_with_header_to_hashed_odict_of_odicts, the rows are returned
+    as OrderedDict of str. the values of upserted rows are written with str(), None as empty field.
+    the encoding must be ascii compatible, the files are written with csv.writer (doublequote, no escapechar),
+    with the line terminator of the header of the csv file - \\n for a new file.
+
+    >>> # setup
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_hashed_odict_of_odicts
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / 'keyed_store_test.csv'
+    >>> _ = testfile.write_text('nr;text\\n1;a\\n2;"b\\nmehrzeilig"\\n3;c\\n')
+
+    >>> # Test OK
+    >>> store = KeyedCsvStore(testfile, hash_by_fieldname='nr')
+    >>> store.get('2'), len(store), '4' in store
+    (OrderedDict([('nr', '2'), ('text', 'b\\nmehrzeilig')]), 3, False)
+
+    >>> # Test unquoted quotechars in a field
+    >>> path_quotes_file = test_directory / 'keyed_store_quotes_test.csv'
+    >>> _ = path_quotes_file.write_bytes(b'nr;text\\r\\n1;Monitor 24" Zoll\\r\\n2;Kabel\\r\\n3;Tastatur 15" breit\\r\\n4;Maus\\r\\n')
+    >>> with KeyedCsvStore(path_quotes_file, hash_by_fieldname='nr') as quotes_store:
+    ...     quotes_store.upsert({'nr': '5', 'text': 'a"b'})
+    ...     list(quotes_store), quotes_store['3']['text'], quotes_store['5']['text']
+    (['1', '2', '3', '4', '5'], 'Tastatur 15" breit', 'a"b')
+    >>> path_quotes_file.with_name(path_quotes_file.name + '.log').read_bytes()
+    b'operation;nr;text\\r\\nU;5;"a""b"\\r\\n'
+    >>> path_quotes_file.unlink()
+    >>> path_quotes_file.with_name(path_quotes_file.name + '.log').unlink()
+
+    >>> # Test the base file may end without line terminator
+    >>> path_unterminated_file = test_directory / 'keyed_store_unterminated_test.csv'
+    >>> _ = path_unterminated_file.write_bytes(b'nr;text\\n1;a\\n2;b')
+    >>> with KeyedCsvStore(path_unterminated_file, hash_by_fieldname='nr') as unterminated_store:
+    ...     unterminated_store['2']['text']
+    ...     unterminated_store.compact()
+    'b'
+    >>> path_unterminated_file.read_bytes()
+    b'nr;text\\n1;a\\n2;b\\n'
+    >>> path_unterminated_file.unlink()
+    >>> path_unterminated_file.with_name(path_unterminated_file.name + '.log').unlink()
+
+    >>> # Test upsert and delete are appended to the log
+    >>> store.upsert({'nr': '2', 'text': 'x;y'})
+    >>> store.upsert_many([{'nr': 4, 'text': None}, {'nr': '5', 'text': 'e'}])
+    >>> store.delete('1')
+    >>> list(store), store['2']['text'], store['4']
+    (['2', '3', '4', '5'], 'x;y', OrderedDict([('nr', '4'), ('text', '')]))
+    >>> testfile.with_name(testfile.name + '.log').read_text().splitlines()
+    ['operation;nr;text', 'U;2;"x;y"', 'U;4;', 'U;5;e', 'D;1']
+    >>> store.delete('1')
+    Traceback (most recent call last):
+        ...
+    KeyError: '1'
+    >>> store.upsert({'nr': '6'})
+    Traceback (most recent call last):
+        ...
+    ValueError: Row "{'nr': '6'}" has not the correct length
+
+    >>> # Test the log is applied on open
+    >>> store.close()
+    >>> store = KeyedCsvStore(testfile, hash_by_fieldname='nr')
+    >>> [row['text'] for row in store.values()]
+    ['x;y', 'c', '', 'e']
+
+    >>> # Test compaction
+    >>> store.compact()
+    >>> dict(read_csv_file_with_header_to_hashed_odict_of_odicts(testfile, hash_by_fieldname='nr')) == dict(store.items())
+    True
+    >>> testfile.with_name(testfile.name + '.log').read_text().splitlines(), store['3']
+    (['operation;nr;text'], OrderedDict([('nr', '3'), ('text', 'c')]))
+    >>> store.close()
+
+    >>> # Teardown
+    >>> testfile.unlink()
+    >>> testfile.with_name(testfile.name + '.log').unlink()
+
+    """
+
+    def __init__(self,
+                 path_csv_file: pathlib.Path,
+                 hash_by_fieldname: str,
+                 fieldnames: Optional[List[str]] = None,
+                 encoding: str = "ISO-8859-1",
+                 delimiter: str = ";",
+                 quotechar: str = '"',
+                 quoting: int = csv.QUOTE_MINIMAL,
+                 compaction_ratio: Optional[float] = 1.0,
+                 compaction_min_log_size: int = 1024 * 1024) -> None:
+        """
+        fieldnames: the header of a new csv file, if path_csv_file does not exist
+        compaction_ratio: None to disable the automatic compaction
+        """
+        check_ascii_compatible_encoding(encoding, delimiter + quotechar)
+        self.path_csv_file = pathlib.Path(path_csv_file)
+        self.path_log_file = self.path_csv_file.with_name(self.path_csv_file.name + '.log')
+        self.hash_by_fieldname = hash_by_fieldname
+        self.encoding = encoding
+        self.compaction_ratio = compaction_ratio
+        self.compaction_min_log_size = compaction_min_log_size
+        self.last_exception = None                          # type: Optional[BaseException]
+        self._dict_csv_kwargs = dict(delimiter=delimiter, quotechar=quotechar, quoting=quoting)     # type: Dict[str, Any]
+        self._lineterminator = '\n'
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None                      # type: Optional[threading.Thread]
+        self._dict_index = dict()                           # type: Dict[str, Tuple[int, int]]
+        self._l_read_files = [None, None]                   # type: List[Optional[BinaryIO]]
+
+        if self.path_csv_file.exists():
+            with open(str(self.path_csv_file), 'rb') as f_csv_file:
+                if f_csv_file.readline().endswith(b'\r\n'):
+                    self._lineterminator = '\r\n'
+        else:
+            if fieldnames is None:
+                raise ValueError(f'csv file "{self.path_csv_file}" does not exist, the fieldnames are needed to create it')
+            with open_atomic_for_write(self.path_csv_file, 'wb') as f_csv_file:
+                f_csv_file.write(self._encode_row(fieldnames))
+        self._load_base()
+        self._load_log()
+        self._f_log_file = open(str(self.path_log_file), 'ab', buffering=0)
+
+    # reading
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            location = self._dict_index.get(key)
+            if location is None:
+                return default
+            return self._read_row(*location)
+
+    def __getitem__(self, key: str) -> 'OrderedDict[str, str]':
+        with self._lock:
+            return self._read_row(*self._dict_index[key])
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._dict_index
+
+    def __len__(self) -> int:
+        return len(self._dict_index)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._dict_index))
+
+    def values(self) -> Iterator['OrderedDict[str, str]']:
+        for _, row in self.items():
+            yield row
+
+    def items(self) -> Iterator[Tuple[str, 'OrderedDict[str, str]']]:
+        """ the keys in the order of the base file, new keys at the end - the rows are read one by one """
+        for key in self:
+            row = self.get(key)
+            if row is not None:
+                yield key, row
+
+    # writing
+
+    def upsert(self, row: Mapping[str, Any]) -> None:
+        self.upsert_many([row])
+
+    def upsert_many(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        """ appends the rows with one write to the log """
+        fieldnames = self.fieldnames
+        l_records = []
+        for row in rows:
+            if len(row) != len(fieldnames):
+                raise ValueError('Row "{}" has not the correct length'.format(row))
+            try:
+                l_values = ['' if row[fieldname] is None else str(row[fieldname]) for fieldname in fieldnames]
+            except KeyError:
+                raise ValueError('Row "{}" has not the correct length'.format(row)) from None
+            l_records.append((l_values[self._index_of_hash_field], self._encode_row([LOG_OPERATION_UPSERT] + l_values)))
+        self._append_to_log(l_records, is_delete=False)
+
+    def delete(self, key: str) -> None:
+        self.delete_many([key])
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        """ raises KeyError if a key is not in the store - then nothing is deleted """
+        l_records = [(key, self._encode_row([LOG_OPERATION_DELETE, key])) for key in keys]
+        with self._lock:
+            for key, _ in l_records:
+                if key not in self._dict_index:
+                    raise KeyError(key)
+            self._append_to_log(l_records, is_delete=True)
+
+    # compaction
+
+    def compact(self) -> None:
+        """ writes the current rows to a new base file and starts a new log """
+        with self._compaction_lock:
+            with self._lock:
+                dict_snapshot = dict(self._dict_index)
+                log_offset_snapshot = self._log_size
+
+            dict_new_offsets = dict()
+            is_locked = False
+            try:
+                with open_atomic_for_write(self.path_csv_file, 'wb', buffering=1024 * 1024) as f_new_csv_file:
+                    offset = f_new_csv_file.write(self._encode_row(self.fieldnames))
+                    for key, (segment, record_offset) in dict_snapshot.items():
+                        with self._lock:
+                            record, row = self._read_record(segment, record_offset)
+                        if segment == _LOG or not record.endswith(b'\n'):
+                            record = self._encode_row(row[1 if segment == _LOG else 0:])
+                        dict_new_offsets[key] = offset
+                        offset += f_new_csv_file.write(record)
+                    # the new base file and the new log are published together
+                    self._lock.acquire()
+                    is_locked = True
+                self._start_new_log(dict_new_offsets, log_offset_snapshot, offset)
+            finally:
+                if is_locked:
+                    self._lock.release()
+
+    def compact_in_background(self) -> threading.Thread:
+        """ starts the compaction in a thread, if it is not running. an error is logged and stored in last_exception """
+        with self._lock:
+            if self._compaction_thread is None or not self._compaction_thread.is_alive():
+                self._compaction_thread = threading.Thread(target=self._compact_logged, name=f'KeyedCsvStore {self.path_csv_file.name}', daemon=True)
+                self._compaction_thread.start()
+            return self._compaction_thread
+
+    def close(self) -> None:
+        """ waits for a running compaction and closes the files """
+        compaction_thread = self._compaction_thread
+        if compaction_thread is not None:
+            compaction_thread.join()
+        with self._lock:
+            self._f_log_file.close()
+            self._close_read_files()
+
+    def __enter__(self) -> 'KeyedCsvStore':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    # internals
+
+    def _load_base(self) -> None:
+        with open(str(self.path_csv_file), 'rb') as f_csv_file:
+            it_records = self._iter_records(f_csv_file, _BASE)
+            offset, record, header = next(it_records, (0, b'', []))
+            self.fieldnames = header or []
+            if self.hash_by_fieldname not in self.fieldnames:
+                raise ValueError('Field "{}" is not available, or the csv file does not have header information'.format(self.hash_by_fieldname))
+            self._index_of_hash_field = self.fieldnames.index(self.hash_by_fieldname)
+            number_of_rows = len(self.fieldnames)
+            self._base_size = offset + len(record)
+            for offset, record, row in it_records:
+                if row is None:
+                    raise ValueError(f'csv file "{self.path_csv_file}": incomplete record at offset {offset}: {record!r}')
+                if len(row) != number_of_rows:
+                    raise ValueError('Row has length {} instead of {} : "{}"'.format(len(row), number_of_rows, row))
+                key = row[self._index_of_hash_field]
+                if key in self._dict_index:
+                    raise ValueError('Index is not unique, field: "{}", value: "{}"'.format(self.hash_by_fieldname, key))
+                self._dict_index[key] = (_BASE, offset)
+                self._base_size = offset + len(record)
+
+    def _load_log(self) -> None:
+        log_header = [LOG_OPERATION_FIELDNAME] + self.fieldnames
+        if not self.path_log_file.exists():
+            with open_atomic_for_write(self.path_log_file, 'wb') as f_log_file:
+                self._log_size = f_log_file.write(self._encode_row(log_header))
+            return
+
+        with open(str(self.path_log_file), 'rb') as f_log_file:
+            it_records = self._iter_records(f_log_file, _LOG)
+            offset, record, header = next(it_records, (0, b'', []))
+            if header != log_header:
+                raise ValueError(f'log file "{self.path_log_file}": the header does not match the csv file "{self.path_csv_file}"')
+            self._log_size = offset + len(record)
+            for offset, record, row in it_records:
+                if row is None:
+                    # the last write was interrupted
+                    logger.warning(f'log file "{self.path_log_file}": the incomplete last record is removed: {record!r}')
+                    break
+                if row[:1] == [LOG_OPERATION_UPSERT] and len(row) == len(log_header):
+                    self._dict_index[row[1 + self._index_of_hash_field]] = (_LOG, offset)
+                elif row[:1] == [LOG_OPERATION_DELETE] and len(row) == 2:
+                    self._dict_index.pop(row[1], None)
+                else:
+                    raise ValueError(f'log file "{self.path_log_file}": invalid record at offset {offset}: "{row}"')
+                self._log_size = offset + len(record)
+        if self._log_size != self.path_log_file.stat().st_size:
+            os.truncate(str(self.path_log_file), self._log_size)
+
+    def _append_to_log(self, l_records: List[Tuple[str, bytes]], is_delete: bool) -> None:
+        if not l_records:
+            return
+        with self._lock:
+            offset = self._log_size
+            self._f_log_file.write(b''.join(record for _, record in l_records))
+            for key, record in l_records:
+                if is_delete:
+                    self._dict_index.pop(key, None)
+                else:
+                    self._dict_index[key] = (_LOG, offset)
+                offset += len(record)
+            self._log_size = offset
+            if self.compaction_ratio is not None and self._log_size > max(self.compaction_min_log_size, self.compaction_ratio * self._base_size):
+                self.compact_in_background()
+
+    def _start_new_log(self, dict_new_offsets: Dict[str, int], log_offset_snapshot: int, base_size: int) -> None:
+        """ the log entries appended after the snapshot are copied to the new log, the index is moved to the new files """
+        with open(str(self.path_log_file), 'rb') as f_log_file:
+            f_log_file.seek(log_offset_snapshot)
+            log_tail = f_log_file.read()
+        log_header = self._encode_row([LOG_OPERATION_FIELDNAME] + self.fieldnames)
+        with open_atomic_for_write(self.path_log_file, 'wb') as f_new_log_file:
+            f_new_log_file.write(log_header + log_tail)
+        self._f_log_file.close()
+        self._f_log_file = open(str(self.path_log_file), 'ab', buffering=0)
+        self._close_read_files()
+
+        log_offset_shift = len(log_header) - log_offset_snapshot
+        for key, (segment, offset) in self._dict_index.items():
+            if segment == _LOG and offset >= log_offset_snapshot:
+                self._dict_index[key] = (_LOG, offset + log_offset_shift)
+            else:
+                self._dict_index[key] = (_BASE, dict_new_offsets[key])
+        self._log_size = len(log_header) + len(log_tail)
+        self._base_size = base_size
+
+    def _compact_logged(self) -> None:
+        try:
+            self.compact()
+            self.last_exception = None
+        except Exception as exc:
+            logger.warning(f'csv file "{self.path_csv_file}" could not be compacted: {exc}')
+            self.last_exception = exc
+
+    def _read_row(self, segment: int, offset: int) -> 'OrderedDict[str, str]':
+        row = self._read_record(segment, offset)[1]
+        if segment == _LOG:
+            del row[0]
+        return OrderedDict(zip(self.fieldnames, row))
+
+    def _read_record(self, segment: int, offset: int) -> Tuple[bytes, List[str]]:
+        """ the bytes and the row of the record, must be called with the lock """
+        f_read_file = self._l_read_files[segment]
+        if f_read_file is None:
+            f_read_file = open(str(self.path_log_file if segment == _LOG else self.path_csv_file), 'rb')
+            self._l_read_files[segment] = f_read_file
+        f_read_file.seek(offset)
+        _, record, row = next(self._iter_records(f_read_file, segment))
+        return record, row or []
+
+    def _close_read_files(self) -> None:
+        for f_read_file in self._l_read_files:
+            if f_read_file is not None:
+                f_read_file.close()
+        self._l_read_files = [None, None]
+
+    def _iter_records(self, f_binary_file: BinaryIO, segment: int) -> Iterator[Tuple[int, bytes, Optional[List[str]]]]:
+        """
+        the offset, the bytes and the parsed row of the records from the current position. the lines are parsed by csv.reader,
+        the lines it took for a row are the bytes of the record. the row of an incomplete last record is None.
+        the base file may end without line terminator, in the log a record without line terminator is a torn write
+        """
+        is_line_terminator_needed = segment == _LOG
+        l_lines = []                # type: List[bytes]
+        l_is_end_of_file = [False]
+        encoding = self.encoding
+
+        def iter_lines() -> Iterator[str]:
+            for line in f_binary_file:
+                l_lines.append(line)
+                yield line.decode(encoding)
+            l_is_end_of_file[0] = True
+
+        offset = f_binary_file.tell()
+        for row in csv.reader(iter_lines(), **self._dict_csv_kwargs):
+            record = l_lines[0] if len(l_lines) == 1 else b''.join(l_lines)
+            # csv.reader returns an unterminated quoted field at the end of the file as row, after it asked for the next line
+            is_complete = not l_is_end_of_file[0] and (record.endswith(b'\n') or not is_line_terminator_needed)
+            yield offset, record, row if is_complete else None
+            offset += len(record)
+            l_lines.clear()
+
+    def _encode_row(self, row: List[str]) -> bytes:
+        f_text = io.StringIO()
+        csv.writer(f_text, lineterminator=self._lineterminator, **self._dict_csv_kwargs).writerow(row)
+        return f_text.getvalue().encode(self.encoding)
@@ -1,19 +1,28 @@
 # STDLIB
+import codecs
+import contextlib
 import csv
 from collections import OrderedDict
-from docopt import docopt           # type: ignore
+import functools
+import itertools
 import logging
+import operator
+import os
 import pathlib
-from typing import Dict, List, Optional, Union
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
 
 # PROJ
 try:
-    from .__doc__ import __doc__
     from . import __init__conf__
+    from .schema import compile_row_builder, compile_row_serializer, Formatter
+    from .interning import ValueInterner
+    from .parser_engine import get_csv_reader
 except (ImportError, ModuleNotFoundError):                 # pragma: no cover
     # imports for doctest
-    from __doc__ import __doc__     # type: ignore  # pragma: no cover
     import __init__conf__           # type: ignore  # pragma: no cover
+    from schema import compile_row_builder, compile_row_serializer, Formatter      # type: ignore  # pragma: no cover
+    from interning import ValueInterner         # type: ignore  # pragma: no cover
+    from parser_engine import get_csv_reader    # type: ignore  # pragma: no cover
 
 
 logger = logging.getLogger()
@@ -36,11 +45,19 @@ def read_csv_file_with_header_to_hashed_odict_of_odicts(path_csv_file: pathlib.P
                                                         encoding: str = "ISO-8859-1",
                                                         delimiter: str = ";",
                                                         quotechar: str = '"',
-                                                        quoting: int = csv.QUOTE_MINIMAL) -> 'OrderedDict[str, OrderedDict[str, str]]':
+                                                        quoting: int = csv.QUOTE_MINIMAL,
+                                                        schema: Optional[Dict[str, Callable[[str], Any]]] = None,
+                                                        value_interner: 'Optional[ValueInterner]' = None,
+                                                        engine: str = 'auto') -> 'OrderedDict[str, OrderedDict[str, str]]':
     """
     reads the csv file into an ordered dict of ordered dicts
     returns: {'indexfield':{fieldname1:value, fieldname2:value}, 'indexfield2':{fieldname1:value, fieldname2:value}}
 
+    schema: optional {fieldname: converter}, see lib_csv.schema - the values are converted while parsing.
+    the index is built from the converted value of the hash field.
+    value_interner: optional lib_csv.interning.ValueInterner, to share one str object per distinct value of low cardinality columns
+    engine: 'auto', 'fast' or 'csv', see lib_csv.parser_engine - the blocks of the file without quotes are split with str.split
+
     >>> # setup
     >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
     >>> testfile1 = test_directory / '2018-04-26_alle_Navision_Artikel.csv'
@@ -70,17 +87,53 @@ def read_csv_file_with_header_to_hashed_odict_of_odicts(path_csv_file: pathlib.P
     ...
     ValueError: Row has length 3 instead of 4 : "['1', '2', '3']"
 
+    >>> # Test schema
+    >>> from lib_csv.schema import bool_converter, decimal_converter, nullable_converter
+    >>> schema = {'HTMLpublish': nullable_converter(bool_converter()),
+    ...           'VK-Preis netto': nullable_converter(decimal_converter(decimal_separator=',', thousands_separator='.'))}
+    >>> r_csv(path_csv_file=testfile1, hash_by_fieldname='Nr.', schema=schema)['HUB025']  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
+    OrderedDict([('HTMLpublish', False), ... ('VK-Preis netto', Decimal('7017.00')), ...])
 
+    >>> # Test schema conversion error
+    >>> r_csv(path_csv_file=testfile1, hash_by_fieldname='Nr.', schema={'Beschreibung': int})  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
+    Traceback (most recent call last):
+    ...
+    ValueError: csv file ".../2018-04-26_alle_Navision_Artikel.csv", line 2, field "Beschreibung": can not convert "Arbeitsbühne ...": ...
+
+    >>> # Test value interning of the low cardinality columns
+    >>> from lib_csv.interning import ValueInterner
+    >>> value_interner = ValueInterner()
+    >>> dict_data = r_csv(path_csv_file=testfile1, hash_by_fieldname='Nr.', value_interner=value_interner)
+    >>> value_interner.l_interned_fieldnames[:3], value_interner.bytes_saved > 1000000
+    (['HTMLpublish', 'Artikel Nicht Verfügbar', 'Sperre Angebot'], True)
+    >>> dict_data['HUB025']['HTMLpublish'] is dict_data['HUB101']['HTMLpublish']
+    True
 
     """
+    dict_result = OrderedDict()     # type: OrderedDict[str, OrderedDict[str, str]]
+    return _read_csv_file_with_header_to_hashed_mapping(path_csv_file, hash_by_fieldname, dict_result, encoding=encoding, delimiter=delimiter,
+                                                        quotechar=quotechar, quoting=quoting, schema=schema, value_interner=value_interner,
+                                                        engine=engine)
+
+
+def _read_csv_file_with_header_to_hashed_mapping(path_csv_file: pathlib.Path,
+                                                 hash_by_fieldname: str,
+                                                 dict_result: Any,
+                                                 encoding: str,
+                                                 delimiter: str,
+                                                 quotechar: str,
+                                                 quoting: int,
+                                                 schema: Optional[Dict[str, Callable[[str], Any]]],
+                                                 value_interner: 'Optional[ValueInterner]',
+                                                 engine: str) -> Any:
+    """ fills the mapping dict_result with the rows as OrderedDicts, see read_csv_file_with_header_to_hashed_odict_of_odicts """
     with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
         is_first_row = True
         fieldnames = []
         index_of_hash_field = 0
         number_of_rows = 0
-        dict_result = OrderedDict()
 
-        my_csv_reader = csv.reader(f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting)
+        my_csv_reader = get_csv_reader(f_csv_file, engine=engine, delimiter=delimiter, quotechar=quotechar, quoting=quoting)
         for row in my_csv_reader:
 
             if is_first_row:
@@ -90,17 +143,22 @@ def read_csv_file_with_header_to_hashed_odict_of_odicts(path_csv_file: pathlib.P
                     raise ValueError('Field "{}" is not available, or the csv file does not have header information'.format(hash_by_fieldname))
                 index_of_hash_field = fieldnames.index(hash_by_fieldname)
                 number_of_rows = len(fieldnames)
+                build_row = compile_row_builder(fieldnames, schema=schema, dict_type=OrderedDict, source=str(path_csv_file))
+                if value_interner is not None:
+                    value_interner.set_fieldnames(fieldnames)
                 continue
 
             if len(row) != number_of_rows:
                 raise ValueError('Row has length {} instead of {} : "{}"'.format(len(row), number_of_rows, row))
 
-            dict_row = OrderedDict()
-
-            for index, value in enumerate(row):
-                dict_row[fieldnames[index]] = value
+            if value_interner is not None:
+                value_interner.intern_row(row)
+            dict_row = build_row(row, my_csv_reader.line_num)
 
-            index_value = row[index_of_hash_field]
+            if schema:
+                index_value = dict_row[hash_by_fieldname]
+            else:
+                index_value = row[index_of_hash_field]
             if index_value not in dict_result:
                 dict_result[index_value] = dict_row
             else:
@@ -116,11 +174,18 @@ def read_csv_file_with_header_to_list_of_dicts(path_csv_file: pathlib.Path,
                                                quoting: int = csv.QUOTE_MINIMAL,
                                                doublequote: bool = True,
                                                check_row_length: bool = True,
-                                               escapechar: Optional[str] = None) -> 'List[Dict[str, str]]':
+                                               escapechar: Optional[str] = None,
+                                               schema: Optional[Dict[str, Callable[[str], Any]]] = None,
+                                               value_interner: 'Optional[ValueInterner]' = None,
+                                               engine: str = 'auto') -> 'List[Dict[str, str]]':
     """
     reads the csv file into a list of dicts
     the keys of the dict corresponds to the Fieldnames in the Header
 
+    schema: optional {fieldname: converter}, see lib_csv.schema - the values are converted while parsing
+    value_interner: optional lib_csv.interning.ValueInterner, to share one str object per distinct value of low cardinality columns
+    engine: 'auto', 'fast' or 'csv', see lib_csv.parser_engine - the blocks of the file without quotes are split with str.split
+
     >>> # setup
     >>> logger.setLevel(logging.INFO)
     >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
@@ -152,6 +217,47 @@ def read_csv_file_with_header_to_list_of_dicts(path_csv_file: pathlib.Path,
     ...                                             check_row_length=False )
     [{'a': '1', 'b': '2', 'c': '3', 'd': '4'}]
 
+    >>> # Test schema
+    >>> from lib_csv.schema import int_converter, nullable_converter
+    >>> schema = {'Quantity': nullable_converter(int_converter()), 'BuyItNowPrice': nullable_converter(float)}
+    >>> read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile1, schema=schema)[0]  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
+    {'Action(SiteID=Germany|Country=DE|Currency=EUR|Version=585|CC=UTF-8)': 'Revise', ... 'BuyItNowPrice': None, 'Quantity': 0, ...}
+
+    >>> # Test the engines read the same rows
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile1, engine='fast')
+    >>> l_dict_data == read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile1, engine='csv')
+    True
+
+    """
+
+    return list(read_csv_file_with_header_to_iterator_of_dicts(path_csv_file=path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar,
+                                                               quoting=quoting, doublequote=doublequote, check_row_length=check_row_length,
+                                                               escapechar=escapechar, schema=schema, value_interner=value_interner, engine=engine))
+
+
+def read_csv_file_with_header_to_iterator_of_dicts(path_csv_file: pathlib.Path,
+                                                   encoding: str = "ISO-8859-1",
+                                                   delimiter: str = ";",
+                                                   quotechar: str = '"',
+                                                   quoting: int = csv.QUOTE_MINIMAL,
+                                                   doublequote: bool = True,
+                                                   check_row_length: bool = True,
+                                                   escapechar: Optional[str] = None,
+                                                   schema: Optional[Dict[str, Callable[[str], Any]]] = None,
+                                                   value_interner: 'Optional[ValueInterner]' = None,
+                                                   engine: str = 'auto') -> 'Iterator[Dict[str, str]]':
+    """
+    like read_csv_file_with_header_to_list_of_dicts, but yields the rows one by one while reading the file
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile1 = test_directory / '2018-06-06_active_qty.csv'
+
+    >>> # Test Ok
+    >>> it_dict_data = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file=testfile1)
+    >>> next(it_dict_data)['CustomLabel'], next(it_dict_data)['CustomLabel']
+    ('GEN232', 'HEATER053')
+    >>> it_dict_data.close()
 
     """
 
@@ -159,8 +265,8 @@ def read_csv_file_with_header_to_list_of_dicts(path_csv_file: pathlib.Path,
         is_first_row = True
         fieldnames = []
         len_of_header_rows = 0
-        l_dict_result = list()
-        my_csv_reader = csv.reader(f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote, escapechar=escapechar)
+        my_csv_reader = get_csv_reader(f_csv_file, engine=engine, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                       doublequote=doublequote, escapechar=escapechar)
 
         for row in my_csv_reader:
 
@@ -171,6 +277,9 @@ def read_csv_file_with_header_to_list_of_dicts(path_csv_file: pathlib.Path,
                 # were we had a trailing ";" in the header line
                 fieldnames = ls_rstrip_list(fieldnames)
                 len_of_header_rows = len(fieldnames)
+                build_row = compile_row_builder(fieldnames, schema=schema, source=str(path_csv_file))
+                if value_interner is not None:
+                    value_interner.set_fieldnames(fieldnames)
                 continue
 
             len_current_row = len(row)
@@ -179,50 +288,159 @@ def read_csv_file_with_header_to_list_of_dicts(path_csv_file: pathlib.Path,
                 raise ValueError(f'csv file "{path_csv_file}": header has {len_of_header_rows} rows,'
                                  f' current row has {len_current_row} rows: Header: {fieldnames}, current Row: {row}')
 
-            dict_data = dict()
+            if value_interner is not None:
+                value_interner.intern_row(row)
+            yield build_row(row, my_csv_reader.line_num)
 
-            for index, value in enumerate(row):
-                if index < len_of_header_rows:
-                    dict_data[fieldnames[index]] = value
-                else:
-                    if check_row_length:
-                        raise ValueError(f'csv file "{path_csv_file}": Row has more fields than the header: {row}')
 
-            l_dict_result.append(dict_data)
+def read_csv_file_header(path_csv_file: pathlib.Path,
+                         encoding: str = "ISO-8859-1",
+                         delimiter: str = ";",
+                         quotechar: str = '"',
+                         quoting: int = csv.QUOTE_MINIMAL,
+                         doublequote: bool = True,
+                         escapechar: Optional[str] = None,
+                         rstrip: bool = True) -> List[str]:
+    """
+    reads only the header line of the csv file.
+    with rstrip=True the empty fields at the end are removed, like read_csv_file_with_header_to_list_of_dicts does
 
-        return l_dict_result
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> read_csv_file_header(test_directory / 'csv_file_broken_less_fields_than_header.csv')
+    ['a', 'b', 'c', 'd']
+    >>> path_navision_file = test_directory / '2018-04-26_alle_Navision_Artikel.csv'
+    >>> len(read_csv_file_header(path_navision_file)), len(read_csv_file_header(path_navision_file, rstrip=False))
+    (17, 24)
+    """
+    with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
+        my_csv_reader = csv.reader(f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote, escapechar=escapechar)
+        fieldnames = next(my_csv_reader, [])
+    if rstrip:
+        fieldnames = ls_rstrip_list(fieldnames)
+    return fieldnames
 
 
-def write_hashed_odict_of_odicts_to_csv_file(dict_data: 'OrderedDict[str, OrderedDict[str, str]]',
+def write_hashed_odict_of_odicts_to_csv_file(dict_data: 'Union[Mapping[str, Mapping[str, Any]], Iterable[Mapping[str, Any]]]',
                                              path_csv_file: pathlib.Path,
                                              encoding: str = "ISO-8859-1",
                                              delimiter: str = ";",
                                              quotechar: str = '"',
-                                             quoting: int = csv.QUOTE_MINIMAL) -> None:
+                                             quoting: int = csv.QUOTE_MINIMAL,
+                                             fieldnames: Optional[List[str]] = None,
+                                             missing_field_policy: str = 'raise',
+                                             buffer_size: int = 1024 * 1024) -> None:
+    """
+    writes the rows of the hashed odict (or any iterable of mappings) to the csv file.
+    the fieldnames are taken from the first row, if not given.
+
+    missing_field_policy:
+        'raise' : a row with missing or additional fields raises ValueError
+        'empty' : missing fields are written as empty field, additional fields are ignored
+
+    the file is written to a temporary file in the same directory, which is renamed after fsync,
+    so the file is never seen partially written, and an existing file is kept if an error occurs.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / 'export_test_hashed.csv'
+    >>> dict_data = OrderedDict([('1', OrderedDict([('a', '1'), ('b', 'x;y')])), ('2', OrderedDict([('a', '2'), ('b', 'z')]))])
+
+    >>> # Test OK
+    >>> write_hashed_odict_of_odicts_to_csv_file(dict_data, path_csv_file=testfile)
+    >>> read_csv_file_with_header_to_hashed_odict_of_odicts(path_csv_file=testfile, hash_by_fieldname='a') == dict_data
+    True
+
+    >>> # Test any iterable of mappings with given fieldnames
+    >>> write_hashed_odict_of_odicts_to_csv_file(iter([{'b': 'z', 'a': '3'}]), path_csv_file=testfile, fieldnames=['a', 'b'])
+    >>> read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile)
+    [{'a': '3', 'b': 'z'}]
+
+    >>> # Test missing field, the existing file is kept
+    >>> write_hashed_odict_of_odicts_to_csv_file([{'a': '1', 'b': '2'}, {'a': '1'}], path_csv_file=testfile)
+    Traceback (most recent call last):
+        ...
+    ValueError: Row "{'a': '1'}" has not the correct length
+    >>> read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile)
+    [{'a': '3', 'b': 'z'}]
+    >>> sorted(path.name for path in test_directory.glob('.export_test_hashed.csv.*'))
+    []
+
+    >>> # Test missing field policy 'empty'
+    >>> write_hashed_odict_of_odicts_to_csv_file([{'a': '1', 'b': '2'}, {'a': '1', 'c': '3'}], path_csv_file=testfile, missing_field_policy='empty')
+    >>> read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile)
+    [{'a': '1', 'b': '2'}, {'a': '1', 'b': ''}]
+
+    >>> # Teardown
+    >>> if testfile.is_file(): testfile.unlink()
+
+    """
+    if missing_field_policy not in ('raise', 'empty'):
+        raise ValueError(f'missing_field_policy must be "raise" or "empty", not "{missing_field_policy}"')
 
-    with open(path_csv_file, 'w', encoding=encoding, newline='\n') as csvfile:
+    values = dict_data.values() if isinstance(dict_data, Mapping) else dict_data
+    it_rows = iter(values)
+    first_row = next(it_rows, None)
+    if fieldnames is None:
+        fieldnames = list(first_row.keys()) if first_row is not None else []
+    number_of_fields = len(fieldnames)
+
+    # the field order is resolved once, itemgetter picks the fields of a row in C
+    get_fields = operator.itemgetter(*fieldnames) if number_of_fields > 1 else (lambda row: tuple(row[fieldname] for fieldname in fieldnames))
+
+    with open_atomic_for_write(path_csv_file, 'w', encoding=encoding, newline='\n', buffering=buffer_size) as csvfile:
         my_csv_writer = csv.writer(csvfile, delimiter=delimiter, quotechar=quotechar, quoting=quoting)
-        b_first_line = True
-        n_number_of_fields = 0
-
-        for value in dict_data.values():
-            row = []
-            # Feldnamen schreiben
-            if b_first_line:
-                b_first_line = False
-                for fieldname in value.keys():
-                    row.append(fieldname)
-                n_number_of_fields = len(row)
-                my_csv_writer.writerow(row)
-                row = []
-
-            for field_value in value.values():
-                row.append(field_value)
-
-            if len(row) == n_number_of_fields:
-                my_csv_writer.writerow(row)
-            else:
-                raise ValueError('Row "{}" has not the correct length'.format(row))
+        writerow = my_csv_writer.writerow
+        if first_row is None and not number_of_fields:
+            return
+        writerow(fieldnames)
+        if first_row is None:
+            return
+
+        for row in itertools.chain((first_row,), it_rows):
+            try:
+                if len(row) != number_of_fields:
+                    raise KeyError
+                writerow(get_fields(row))
+            except KeyError:
+                if missing_field_policy == 'raise':
+                    raise ValueError('Row "{}" has not the correct length'.format(row)) from None
+                writerow([row.get(fieldname, '') for fieldname in fieldnames])
+
+
+@contextlib.contextmanager
+def open_atomic_for_write(path_file: pathlib.Path, mode: str = 'w', **kwargs: Any) -> Iterator[IO[Any]]:
+    """
+    opens a temporary file in the directory of path_file for writing, the keyword arguments are passed to open().
+    when the block is left without error, the temporary file is flushed, synced to disk and renamed to path_file.
+    on error the temporary file is removed and path_file is untouched.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / 'atomic_test.txt'
+
+    >>> with open_atomic_for_write(testfile) as f_test:
+    ...     _ = f_test.write('test')
+    ...     testfile.exists()
+    False
+    >>> testfile.read_text()
+    'test'
+    >>> testfile.unlink()
+
+    """
+    path_file = pathlib.Path(path_file)
+    # created with mode 'x' (and not with tempfile) so the file permissions follow the umask like a normal file
+    path_temp_file = path_file.with_name(f'.{path_file.name}.{os.getpid()}.{os.urandom(4).hex()}.tmp')
+    f_temp_file = open(str(path_temp_file), mode.replace('w', 'x'), **kwargs)
+    try:
+        with f_temp_file:
+            yield f_temp_file
+            f_temp_file.flush()
+            os.fsync(f_temp_file.fileno())
+        os.replace(str(path_temp_file), str(path_file))
+    except BaseException:
+        if path_temp_file.exists():
+            path_temp_file.unlink()
+        raise
 
 
 def write_ll_data_to_csv_file(ll_data: List[List[str]],
@@ -233,8 +451,11 @@ def write_ll_data_to_csv_file(ll_data: List[List[str]],
                               quoting: int = csv.QUOTE_MINIMAL,
                               lineterminator: str = '\n',
                               escapechar: str = '"',
-                              doublequote: bool = True) -> None:
+                              doublequote: bool = True,
+                              output_schema: Optional[Dict[str, Formatter]] = None) -> None:
     """
+    output_schema: optional {fieldname: formatter}, see lib_csv.schema - the values are formatted with a row serializer,
+                   which is compiled once. values which are already str are written unchanged
 
     >>> # setup
     >>> logger.setLevel(logging.INFO)
@@ -267,6 +488,12 @@ def write_ll_data_to_csv_file(ll_data: List[List[str]],
     >>> read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile)  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
     [{'a': '1', 'b': '2', 'c': 'das ist ein "TE;ST">'}, {'a': '2', 'b': '3', 'c': 'das ist ein TE;ST'}]
 
+    >>> # Test output schema
+    >>> from lib_csv.schema import bool_formatter, decimal_formatter
+    >>> ll_data = [['a', 'b', 'c'], [1.5, True, None], [2, False, 'x']]
+    >>> write_ll_data_to_csv_file(ll_data, testfile, output_schema={'a': decimal_formatter(decimal_separator=','), 'b': bool_formatter()})
+    >>> testfile.read_text()
+    'a;b;c\\n1,50;Ja;\\n2,00;Nein;x\\n'
 
     """
     csv.register_dialect('MyDialect', delimiter=delimiter, quotechar=quotechar, quoting=quoting,
@@ -279,8 +506,12 @@ def write_ll_data_to_csv_file(ll_data: List[List[str]],
             raise ValueError('Nothing to export')
 
         number_of_fields = len(ll_data[0])
+        it_rows = iter(ll_data)     # type: Iterator[List[Any]]
+        if output_schema is not None:
+            # the header is not formatted
+            it_rows = itertools.chain(ll_data[:1], map(compile_row_serializer(ll_data[0], output_schema), ll_data[1:]))
 
-        for l_data in ll_data:
+        for l_data in it_rows:
             my_csv_writer.writerow(l_data)
             if len(l_data) != number_of_fields:
                 raise ValueError(f'row "{l_data}" has a different length as the header line')
@@ -292,10 +523,20 @@ def write_ll_data_to_csv_file_ebay(ll_data: List[List[str]],
                                    delimiter: str = ";",
                                    quotechar: str = '"',
                                    lineterminator: str = '\n',
-                                   escapechar: str = '"') -> None:
+                                   escapechar: str = '"',
+                                   processes: int = 1,
+                                   chunk_size: int = 10000,
+                                   output_schema: Optional[Dict[str, Formatter]] = None,
+                                   source_encoding: Optional[str] = None) -> None:
     """
     bevor :  encoding: str = "ISO-8859-1",
 
+    processes: if > 1, chunks of chunk_size rows are encoded in a process pool and written in order,
+               the output is byte identical to the serial export
+    output_schema: optional {fieldname: formatter}, see write_ll_data_to_csv_file - the rows are formatted as they are encoded,
+                   with processes > 1 in the worker processes, so the formatters must be picklable (like the formatters of lib_csv.schema)
+    source_encoding: the encoding of bytes fields, see get_ebay_csv_row
+
 
     :return:    number of lines exported, including header line
 
@@ -340,6 +581,26 @@ def write_ll_data_to_csv_file_ebay(ll_data: List[List[str]],
     [{'ö': '', 'ä': '2', 'ü': 'das ist ein "TE;ST">'}]
 
 
+    >>> # Test parallel export is byte identical
+    >>> ll_data = [['a', 'b', 'c']] + [[index, 'te"st', 'φ;x'] for index in range(1000)] + [[1, 2]]
+    >>> write_ll_data_to_csv_file_ebay(ll_data=ll_data, path_csv_file=test_file)
+    >>> serial_data = test_file.read_bytes()
+    >>> write_ll_data_to_csv_file_ebay(ll_data=ll_data, path_csv_file=test_file, processes=2, chunk_size=300)
+    >>> test_file.read_bytes() == serial_data
+    True
+
+    >>> # Test output schema
+    >>> from lib_csv.schema import bool_formatter, nullable_formatter
+    >>> write_ll_data_to_csv_file_ebay([['a', 'b'], [True, None]], path_csv_file=test_file, output_schema={'b': nullable_formatter(bool_formatter(), 'NULL')})
+    >>> test_file.read_bytes()
+    b'a;b\\nTrue;NULL\\n'
+    >>> ll_data = [['a', 'b']] + [[index, index % 3 == 0] for index in range(1000)]
+    >>> write_ll_data_to_csv_file_ebay(ll_data, path_csv_file=test_file, output_schema={'b': bool_formatter()})
+    >>> serial_data = test_file.read_bytes()
+    >>> write_ll_data_to_csv_file_ebay(ll_data, path_csv_file=test_file, output_schema={'b': bool_formatter()}, processes=2, chunk_size=300)
+    >>> test_file.read_bytes() == serial_data, serial_data[:16]
+    (True, b'a;b\\n0;Ja\\n1;Nein\\n')
+
     >>> # Teardown
     >>> if test_file.is_file(): test_file.unlink()
 
@@ -357,24 +618,99 @@ def write_ll_data_to_csv_file_ebay(ll_data: List[List[str]],
             raise RuntimeError('Nothing to export')
 
         number_of_fields = len(ll_data[0])
-
-        for l_data in ll_data:
-            csvfile.write(get_ebay_csv_row(l_data, delimiter=b_delimiter, quotechar=b_quotechar, escapechar=b_escapechar, encoding='utf-8') + b_lineterminator)
+        # the header is written first and not formatted, the rows are formatted chunk by chunk as they are encoded
+        csvfile.write(get_ebay_csv_row(ll_data[0], delimiter=b_delimiter, quotechar=b_quotechar, escapechar=b_escapechar, encoding='utf-8',
+                                       source_encoding=source_encoding) + b_lineterminator)
+
+        if processes > 1 and len(ll_data) > chunk_size:
+            import concurrent.futures
+            lll_chunks = [ll_data[index:index + chunk_size] for index in range(1, len(ll_data), chunk_size)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                # executor.map yields the results in the order of the chunks
+                results = executor.map(get_ebay_csv_rows_block, lll_chunks, itertools.repeat(b_delimiter), itertools.repeat(b_quotechar),
+                                       itertools.repeat(b_escapechar), itertools.repeat(b_lineterminator), itertools.repeat(number_of_fields),
+                                       itertools.repeat('utf-8'), itertools.repeat(source_encoding),
+                                       itertools.repeat(ll_data[0] if output_schema is not None else None), itertools.repeat(output_schema))
+                for ll_chunk, (block, l_index_wrong_length) in zip(lll_chunks, results):
+                    csvfile.write(block)
+                    for index in l_index_wrong_length:
+                        logger.warning(f'row {ll_chunk[index]} has a different length as the header line')
+            return
+
+        serialize_row = compile_row_serializer(ll_data[0], output_schema) if output_schema is not None else None
+        for l_data in itertools.islice(ll_data, 1, None):
+            csvfile.write(get_ebay_csv_row(serialize_row(l_data) if serialize_row is not None else l_data, delimiter=b_delimiter,
+                                           quotechar=b_quotechar, escapechar=b_escapechar, encoding='utf-8',
+                                           source_encoding=source_encoding) + b_lineterminator)
             if len(l_data) != number_of_fields:
                 logger.warning(f'row {l_data} has a different length as the header line')
 
 
-def get_ebay_csv_row(l_data: List[str], delimiter: bytes, quotechar: bytes, escapechar: bytes, encoding: str = 'utf-8') -> bytes:
+def get_ebay_csv_rows_block(ll_data: List[List[str]], delimiter: bytes, quotechar: bytes, escapechar: bytes, lineterminator: bytes,
+                            number_of_fields: int, encoding: str = 'utf-8', source_encoding: Optional[str] = None,
+                            fieldnames: Optional[List[str]] = None, output_schema: Optional[Dict[str, Formatter]] = None) -> Tuple[bytes, List[int]]:
     """
+    encodes the rows into one block of bytes, each row terminated by lineterminator.
+    returns the block and the indices of the rows with a different length as number_of_fields.
+    fieldnames, output_schema: if given, the rows are formatted with compile_row_serializer before they are encoded
+    this runs in the worker processes of write_ll_data_to_csv_file_ebay, so it must stay a module level function
+
+    >>> get_ebay_csv_rows_block([['a', 'b'], ['te"st', 1], [2]], delimiter=b';', quotechar=b'"', escapechar=b'"', lineterminator=b'\\n', number_of_fields=2)
+    (b'a;b\\n"te""st";1\\n2\\n', [2])
+    """
+    it_rows = iter(ll_data)     # type: Iterator[List[str]]
+    if output_schema is not None:
+        it_rows = map(compile_row_serializer(fieldnames or [], output_schema), ll_data)
+    l_rows = []
+    l_index_wrong_length = []
+    for index, l_data in enumerate(it_rows):
+        l_rows.append(get_ebay_csv_row(l_data, delimiter=delimiter, quotechar=quotechar, escapechar=escapechar, encoding=encoding,
+                                       source_encoding=source_encoding))
+        if len(l_data) != number_of_fields:
+            l_index_wrong_length.append(index)
+    l_rows.append(b'')
+    return lineterminator.join(l_rows), l_index_wrong_length
+
+
+def get_ebay_csv_row(l_data: List[str], delimiter: bytes, quotechar: bytes, escapechar: bytes, encoding: str = 'utf-8',
+                     source_encoding: Optional[str] = None) -> bytes:
+    """
+    source_encoding: the encoding of the bytes fields, for instance of lib_csv.bytes_reader - they are copied unchanged if it is the encoding,
+                     otherwise transcoded. LazyDecodedBytes carry their encoding. bytes without a known encoding raise ValueError
+
     >>> get_ebay_csv_row(['test','teφst','te"st','te;st'], delimiter=b';', quotechar=b'"', escapechar=b'"', encoding='utf-8')
     b'test;te\xcf\x86st;"te""st";"te;st"'
     >>> get_ebay_csv_row(['test','teφst','te"st','te;st'], delimiter=b';', quotechar=b'"', escapechar=b'"', encoding='ISO-8859-1')
     b'test;"te&#966;st";"te""st";"te;st"'
+
+    >>> # bytes of the same encoding are passed through unchanged, bytes of another encoding are transcoded
+    >>> get_ebay_csv_row([b'test', b'te"st', None, 1], delimiter=b';', quotechar=b'"', escapechar=b'"', encoding='utf-8', source_encoding='utf8')
+    b'test;"te""st";;1'
+    >>> get_ebay_csv_row([b'B\\xfchne'], delimiter=b';', quotechar=b'"', escapechar=b'"', encoding='utf-8', source_encoding='ISO-8859-1')
+    b'B\\xc3\\xbchne'
+    >>> get_ebay_csv_row([b'B\\xfchne'], delimiter=b';', quotechar=b'"', escapechar=b'"', encoding='utf-8')
+    Traceback (most recent call last):
+        ...
+    ValueError: the encoding of the bytes field b'B\\xfchne' is unknown - pass source_encoding, or read it as LazyDecodedBytes
     """
+    is_source_encoding_equal = source_encoding is not None and get_codec_name(source_encoding) == get_codec_name(encoding)
     l_str_data = []
     for str_data in l_data:
         if str_data is None:
             byte_data = b''
+        elif isinstance(str_data, bytes):
+            # already encoded, for instance by lib_csv.bytes_reader
+            field_encoding = getattr(str_data, 'encoding', None)
+            if field_encoding is not None:
+                is_encoding_equal = get_codec_name(field_encoding) == get_codec_name(encoding)
+            elif source_encoding is not None:
+                field_encoding, is_encoding_equal = source_encoding, is_source_encoding_equal
+            else:
+                raise ValueError(f'the encoding of the bytes field {bytes(str_data)!r} is unknown - pass source_encoding, or read it as LazyDecodedBytes')
+            if is_encoding_equal:
+                byte_data = str_data
+            else:
+                byte_data = str_data.decode(field_encoding).encode(encoding, errors='xmlcharrefreplace')
         else:
             byte_data = str(str_data).encode(encoding, errors='xmlcharrefreplace')
         byte_data = escape_quote_character_in_field(field_data=byte_data, quotechar=quotechar, escapechar=escapechar)
@@ -384,6 +720,17 @@ def get_ebay_csv_row(l_data: List[str], delimiter: bytes, quotechar: bytes, esca
     return str_row
 
 
+@functools.lru_cache(maxsize=None)
+def get_codec_name(encoding: str) -> str:
+    """
+    the normalized name of the encoding
+
+    >>> get_codec_name('ISO-8859-1'), get_codec_name('latin-1'), get_codec_name('UTF8')
+    ('iso8859-1', 'iso8859-1', 'utf-8')
+    """
+    return codecs.lookup(encoding).name
+
+
 def escape_quote_character_in_field(field_data: bytes, quotechar: bytes, escapechar: bytes) -> bytes:
     """
     >>> escape_quote_character_in_field('test'.encode('ISO-8859-1'), quotechar=b'"', escapechar=b'"')
@@ -537,7 +884,15 @@ def main_commandline() -> None:
     docopt.DocoptExit: ...
 
     """
-    docopt_args = docopt(__doc__)
+    # the cli is only needed on the commandline - import it here to keep the package import fast
+    from docopt import docopt           # type: ignore
+    try:
+        from .__doc__ import __doc__ as cli_doc
+    except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+        # imports for doctest
+        from __doc__ import __doc__ as cli_doc     # type: ignore  # pragma: no cover
+
+    docopt_args = docopt(cli_doc)
     main(docopt_args)       # pragma: no cover
 
 
@@ -0,0 +1,378 @@
+# STDLIB
+import concurrent.futures
+import glob
+import itertools
+import logging
+import os
+import pathlib
+import queue
+import threading
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Optional, Tuple, Union
+
+# PROJ
+try:
+    from .lib_csv import read_csv_file_header, read_csv_file_with_header_to_iterator_of_dicts, read_csv_file_with_header_to_list_of_dicts
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import (read_csv_file_header, read_csv_file_with_header_to_iterator_of_dicts,      # type: ignore  # pragma: no cover
+                         read_csv_file_with_header_to_list_of_dicts)
+
+
+logger = logging.getLogger()     # type: logging.Logger
+
+PathsOrPattern = Union[pathlib.Path, str, Iterable[pathlib.Path]]
+
+# the keyword arguments of read_csv_file_with_header_to_list_of_dicts, which are needed to read the header
+HEADER_KWARGS = ('encoding', 'delimiter', 'quotechar', 'quoting', 'doublequote', 'escapechar')
+
+
+class CsvFileResult(object):
+    """
+    the result of reading one file : the rows, or the exception if reading the file failed
+    """
+
+    def __init__(self, path_csv_file: pathlib.Path, fieldnames: Optional[List[str]] = None,
+                 l_dict_data: Optional[List[Dict[str, Any]]] = None, exception: Optional[BaseException] = None) -> None:
+        self.path_csv_file = path_csv_file
+        self.fieldnames = fieldnames if fieldnames is not None else list()
+        self.l_dict_data = l_dict_data if l_dict_data is not None else list()
+        self.exception = exception
+
+    @property
+    def is_ok(self) -> bool:
+        return self.exception is None
+
+    def __repr__(self) -> str:
+        if self.exception is not None:
+            return f'CsvFileResult({self.path_csv_file.name}, exception={self.exception!r})'
+        return f'CsvFileResult({self.path_csv_file.name}, rows={len(self.l_dict_data)})'
+
+
+def get_csv_file_paths(paths_or_pattern: PathsOrPattern, pattern: str = '*.csv') -> List[pathlib.Path]:
+    """
+    returns the sorted list of files for a directory (matching pattern), a glob pattern or an iterable of paths
+
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> [path.name for path in get_csv_file_paths(test_directory, pattern='csv_file_broken_*.csv')]
+    ['csv_file_broken_less_fields_than_header.csv', 'csv_file_broken_more_fields_than_header.csv']
+    >>> [path.name for path in get_csv_file_paths(str(test_directory / '2018-0*.csv'))]
+    ['2018-04-26_alle_Navision_Artikel.csv', '2018-06-06_active_qty.csv']
+    """
+    if isinstance(paths_or_pattern, (str, pathlib.Path)):
+        path = pathlib.Path(paths_or_pattern)
+        if path.is_dir():
+            return sorted(path.glob(pattern))
+        if path.is_file():
+            return [path]
+        return sorted(pathlib.Path(file_name) for file_name in glob.glob(str(paths_or_pattern)))
+    return [pathlib.Path(path) for path in paths_or_pattern]
+
+
+def read_csv_files_concurrently(paths_or_pattern: PathsOrPattern,
+                                pattern: str = '*.csv',
+                                max_workers: Optional[int] = None,
+                                use_processes: bool = False,
+                                header_compatibility: str = 'equal',
+                                fieldnames: Optional[List[str]] = None,
+                                dict_reader_kwargs_by_filename: Optional[Dict[str, Dict[str, Any]]] = None,
+                                **reader_kwargs: Any) -> List[CsvFileResult]:
+    """
+    reads the files concurrently with read_csv_file_with_header_to_list_of_dicts in a thread pool (or process pool),
+    and returns one CsvFileResult per file, in the order of the files.
+    an exception while reading a file is kept in the result of that file, the other files are not affected.
+
+    reader_kwargs: passed to read_csv_file_with_header_to_list_of_dicts for all files
+    dict_reader_kwargs_by_filename: {file name: reader kwargs} - per file overrides, for instance another delimiter or encoding
+    header_compatibility: 'equal' : the header must be equal to the header of the first file (or fieldnames)
+                          'same_fields' : the same fields in any order
+                          'none' : no check
+    use_processes: the reader kwargs must be picklable then - for instance no converters defined in functions in the schema
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+
+    >>> # Test failures are isolated
+    >>> read_csv_files_concurrently(test_directory, pattern='csv_file_broken_*.csv')
+    [CsvFileResult(csv_file_broken_less_fields_than_header.csv, exception=ValueError(...)),
+     CsvFileResult(csv_file_broken_more_fields_than_header.csv, exception=ValueError(...))]
+    >>> read_csv_files_concurrently(test_directory, pattern='csv_file_broken_*.csv', check_row_length=False)
+    [CsvFileResult(csv_file_broken_less_fields_than_header.csv, rows=1), CsvFileResult(csv_file_broken_more_fields_than_header.csv, rows=1)]
+
+    >>> # Test header compatibility
+    >>> l_paths = [test_directory / '0001_aktive_preis_qty.csv', test_directory / '2018-06-06_active_qty.csv',
+    ...            test_directory / 'csv_file_broken_less_fields_than_header.csv']
+    >>> l_results = read_csv_files_concurrently(l_paths, check_row_length=False)
+    >>> l_results
+    [CsvFileResult(0001_aktive_preis_qty.csv, rows=1488), CsvFileResult(2018-06-06_active_qty.csv, rows=1462),
+     CsvFileResult(csv_file_broken_less_fields_than_header.csv, exception=ValueError(...))]
+    >>> l_results[2].exception
+    ValueError('csv file ".../csv_file_broken_less_fields_than_header.csv": the header is not compatible with the header ...')
+
+    >>> # Test per file overrides in a process pool
+    >>> dict_reader_kwargs_by_filename = {'eBay-active-listing-wrong_doublequote.csv': {'encoding': 'utf-8-sig', 'check_row_length': False}}
+    >>> read_csv_files_concurrently([test_directory / '2018-06-06_active_qty.csv', test_directory / 'eBay-active-listing-wrong_doublequote.csv'],
+    ...                             use_processes=True, max_workers=2, header_compatibility='none',
+    ...                             dict_reader_kwargs_by_filename=dict_reader_kwargs_by_filename)
+    [CsvFileResult(2018-06-06_active_qty.csv, rows=1462), CsvFileResult(eBay-active-listing-wrong_doublequote.csv, rows=13)]
+
+    """
+    l_paths = get_csv_file_paths(paths_or_pattern, pattern=pattern)
+    if dict_reader_kwargs_by_filename is None:
+        dict_reader_kwargs_by_filename = dict()
+    if header_compatibility not in ('equal', 'same_fields', 'none'):
+        raise ValueError(f'header_compatibility must be "equal", "same_fields" or "none", not "{header_compatibility}"')
+
+    executor_class = concurrent.futures.ProcessPoolExecutor if use_processes else concurrent.futures.ThreadPoolExecutor  # type: Any
+    with executor_class(max_workers=max_workers) as executor:
+        l_futures = list()
+        for path_csv_file in l_paths:
+            dict_file_kwargs = dict(reader_kwargs)
+            dict_file_kwargs.update(dict_reader_kwargs_by_filename.get(path_csv_file.name, dict()))
+            l_futures.append(executor.submit(_read_csv_file_with_header, path_csv_file, dict_file_kwargs))
+
+        l_results = list()
+        for path_csv_file, future in zip(l_paths, l_futures):
+            try:
+                file_fieldnames, l_dict_data = future.result()
+            except Exception as exc:
+                logger.warning(f'csv file "{path_csv_file}" could not be read: {exc}')
+                l_results.append(CsvFileResult(path_csv_file, exception=exc))
+                continue
+
+            if fieldnames is None and header_compatibility != 'none':
+                fieldnames = file_fieldnames
+            if header_compatibility != 'none' and not is_header_compatible(file_fieldnames, fieldnames, header_compatibility):
+                exc_header = ValueError(f'csv file "{path_csv_file}": the header is not compatible with the header {fieldnames}: {file_fieldnames}')
+                l_results.append(CsvFileResult(path_csv_file, fieldnames=file_fieldnames, exception=exc_header))
+                continue
+            l_results.append(CsvFileResult(path_csv_file, fieldnames=file_fieldnames, l_dict_data=l_dict_data))
+    return l_results
+
+
+def read_csv_files_concurrently_merged(paths_or_pattern: PathsOrPattern,
+                                       source_fieldname: Optional[str] = 'source_file',
+                                       l_failed_results: Optional[List[CsvFileResult]] = None,
+                                       pattern: str = '*.csv',
+                                       max_workers: Optional[int] = None,
+                                       use_processes: bool = False,
+                                       header_compatibility: str = 'equal',
+                                       fieldnames: Optional[List[str]] = None,
+                                       dict_reader_kwargs_by_filename: Optional[Dict[str, Dict[str, Any]]] = None,
+                                       is_ordered: bool = True,
+                                       queue_size: int = 16,
+                                       batch_size: int = 1000,
+                                       **reader_kwargs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    reads the files concurrently like read_csv_files_concurrently and yields the rows of all files while they are read.
+    each file is read with read_csv_file_with_header_to_iterator_of_dicts in a worker thread, which puts batches of batch_size rows
+    into a queue of queue_size batches - so the memory is bounded by the queues, not by the size of the files.
+    is_ordered: the rows are yielded in the order of the files, otherwise in the order they are read
+    use_processes: the files are read completely in a process pool, up to max_workers files ahead of the yielded rows
+
+    the name of the file is added to each row as field source_fieldname (if not None).
+    the header of every file is compared with fieldnames, or the header of the first file whose header can be read.
+    the files which could not be read are logged as warning and appended to l_failed_results (if given) -
+    a file which fails while reading stops yielding rows at the error, a file with a not compatible header never yields rows.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> l_failed_results = []
+
+    >>> # Test OK
+    >>> it_rows = read_csv_files_concurrently_merged(test_directory, pattern='csv_file_broken_*.csv', check_row_length=False,
+    ...                                              header_compatibility='none')
+    >>> list(it_rows)
+    [{'a': '1', 'b': '2', 'c': '3', 'source_file': 'csv_file_broken_less_fields_than_header.csv'},
+     {'a': '1', 'b': '2', 'c': '3', 'd': '4', 'source_file': 'csv_file_broken_more_fields_than_header.csv'}]
+
+    >>> # Test failed files
+    >>> list(read_csv_files_concurrently_merged(test_directory, pattern='csv_file_broken_*.csv', l_failed_results=l_failed_results))
+    []
+    >>> l_failed_results
+    [CsvFileResult(csv_file_broken_less_fields_than_header.csv, exception=ValueError(...)),
+     CsvFileResult(csv_file_broken_more_fields_than_header.csv, exception=ValueError(...))]
+
+    >>> # Test small queues, not ordered, header not compatible, processes
+    >>> l_paths = [test_directory / '0001_aktive_preis_qty.csv', test_directory / '2018-06-06_active_qty.csv',
+    ...            test_directory / '2018-04-26_alle_Navision_Artikel.csv']
+    >>> l_failed_results = []
+    >>> l_rows = list(read_csv_files_concurrently_merged(l_paths, l_failed_results=l_failed_results, header_compatibility='same_fields',
+    ...                                                  is_ordered=False, queue_size=1, batch_size=10, check_row_length=False))
+    >>> len(l_rows), sorted(set(row['source_file'] for row in l_rows)), l_failed_results
+    (2950, ['0001_aktive_preis_qty.csv', '2018-06-06_active_qty.csv'],
+     [CsvFileResult(2018-04-26_alle_Navision_Artikel.csv, exception=ValueError(...))])
+    >>> l_rows_processes = list(read_csv_files_concurrently_merged(l_paths[:2], use_processes=True, max_workers=1, header_compatibility='none',
+    ...                                                            check_row_length=False))
+    >>> [row['ItemID'] for row in l_rows_processes] == [row['ItemID'] for row in read_csv_files_concurrently_merged(l_paths[:2],
+    ...                                                 header_compatibility='none', queue_size=1, batch_size=10, check_row_length=False)]
+    True
+
+    >>> # Test stop reading
+    >>> it_rows = read_csv_files_concurrently_merged(l_paths, queue_size=1, batch_size=10, check_row_length=False)
+    >>> next(it_rows)['source_file']
+    '0001_aktive_preis_qty.csv'
+    >>> it_rows.close()
+
+    """
+    l_paths = get_csv_file_paths(paths_or_pattern, pattern=pattern)
+    if dict_reader_kwargs_by_filename is None:
+        dict_reader_kwargs_by_filename = dict()
+    if header_compatibility not in ('equal', 'same_fields', 'none'):
+        raise ValueError(f'header_compatibility must be "equal", "same_fields" or "none", not "{header_compatibility}"')
+    l_dict_file_kwargs = list()
+    for path_csv_file in l_paths:
+        dict_file_kwargs = dict(reader_kwargs)
+        dict_file_kwargs.update(dict_reader_kwargs_by_filename.get(path_csv_file.name, dict()))
+        l_dict_file_kwargs.append(dict_file_kwargs)
+
+    if fieldnames is None and header_compatibility != 'none':
+        for path_csv_file, dict_file_kwargs in zip(l_paths, l_dict_file_kwargs):
+            try:
+                fieldnames = read_csv_file_header(path_csv_file, **{key: value for key, value in dict_file_kwargs.items() if key in HEADER_KWARGS})
+                break
+            except Exception:
+                continue
+
+    if use_processes:
+        it_messages = _get_messages_from_processes(l_paths, l_dict_file_kwargs, max_workers)
+        yield from _get_merged_rows(it_messages, l_paths, source_fieldname, l_failed_results, header_compatibility, fieldnames, None)
+        return
+
+    # one queue per file to yield in the order of the files, otherwise all workers share one queue
+    if is_ordered:
+        l_queues = [queue.Queue(maxsize=queue_size) for _ in l_paths]   # type: List[queue.Queue[Tuple[int, str, Any]]]
+    else:
+        l_queues = [queue.Queue(maxsize=queue_size)] * len(l_paths)
+    l_stop_events = [threading.Event() for _ in l_paths]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for index, (path_csv_file, dict_file_kwargs) in enumerate(zip(l_paths, l_dict_file_kwargs)):
+                executor.submit(_put_csv_file_rows, index, path_csv_file, dict_file_kwargs, batch_size, l_queues[index], l_stop_events[index])
+            it_messages = _get_messages_from_queues(l_queues, is_ordered)
+            yield from _get_merged_rows(it_messages, l_paths, source_fieldname, l_failed_results, header_compatibility, fieldnames, l_stop_events)
+        finally:
+            # the workers stop at the next put, also if the rows are not read to the end
+            for stop_event in l_stop_events:
+                stop_event.set()
+
+
+def is_header_compatible(fieldnames: List[str], reference_fieldnames: Optional[List[str]], header_compatibility: str = 'equal') -> bool:
+    """
+    >>> is_header_compatible(['a', 'b'], ['a', 'b']), is_header_compatible(['b', 'a'], ['a', 'b'])
+    (True, False)
+    >>> is_header_compatible(['b', 'a'], ['a', 'b'], 'same_fields'), is_header_compatible(['b', 'c'], ['a', 'b'], 'same_fields')
+    (True, False)
+    """
+    if header_compatibility == 'none' or reference_fieldnames is None:
+        return True
+    if header_compatibility == 'same_fields':
+        return sorted(fieldnames) == sorted(reference_fieldnames)
+    return fieldnames == reference_fieldnames
+
+
+def _read_csv_file_with_header(path_csv_file: pathlib.Path, dict_reader_kwargs: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """ runs in the worker threads or processes, so it must stay a module level function """
+    dict_header_kwargs = {key: value for key, value in dict_reader_kwargs.items() if key in HEADER_KWARGS}
+    fieldnames = read_csv_file_header(path_csv_file, **dict_header_kwargs)
+    l_dict_data = read_csv_file_with_header_to_list_of_dicts(path_csv_file, **dict_reader_kwargs)
+    return fieldnames, l_dict_data
+
+
+def _put_csv_file_rows(index: int, path_csv_file: pathlib.Path, dict_reader_kwargs: Dict[str, Any], batch_size: int,
+                       queue_rows: 'queue.Queue[Tuple[int, str, Any]]', stop_event: threading.Event) -> None:
+    """ runs in the worker threads : puts the header, the batches of rows and the end (or the exception) of the file into the queue """
+    def put(kind: str, value: Any) -> bool:
+        while not stop_event.is_set():
+            try:
+                queue_rows.put((index, kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        dict_header_kwargs = {key: value for key, value in dict_reader_kwargs.items() if key in HEADER_KWARGS}
+        if not put('header', read_csv_file_header(path_csv_file, **dict_header_kwargs)):
+            return
+        it_dict_data = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file, **dict_reader_kwargs)
+        try:
+            while True:
+                l_dict_data = list(itertools.islice(it_dict_data, batch_size))
+                if not l_dict_data:
+                    break
+                if not put('rows', l_dict_data):
+                    return
+        finally:
+            it_dict_data.close()    # type: ignore
+    except Exception as exc:
+        put('error', exc)
+        return
+    put('end', None)
+
+
+def _get_merged_rows(it_messages: 'Generator[Tuple[int, str, Any], Optional[str], None]', l_paths: List[pathlib.Path],
+                     source_fieldname: Optional[str], l_failed_results: Optional[List[CsvFileResult]], header_compatibility: str,
+                     fieldnames: Optional[List[str]], l_stop_events: Optional[List[threading.Event]]) -> Iterator[Dict[str, Any]]:
+    """ yields the rows of the messages, checks the headers and collects the failed files """
+    reply = None        # type: Optional[str]
+    while True:
+        try:
+            index, kind, value = it_messages.send(reply)
+        except StopIteration:
+            return
+        reply = None
+        path_csv_file = l_paths[index]
+        if kind == 'header':
+            if header_compatibility != 'none' and not is_header_compatible(value, fieldnames, header_compatibility):
+                exc_header = ValueError(f'csv file "{path_csv_file}": the header is not compatible with the header {fieldnames}: {value}')
+                if l_failed_results is not None:
+                    l_failed_results.append(CsvFileResult(path_csv_file, fieldnames=value, exception=exc_header))
+                if l_stop_events is not None:
+                    l_stop_events[index].set()
+                reply = 'close'
+        elif kind == 'rows':
+            for dict_row in value:
+                if source_fieldname is not None:
+                    dict_row[source_fieldname] = path_csv_file.name
+                yield dict_row
+        elif kind == 'error':
+            logger.warning(f'csv file "{path_csv_file}" could not be read: {value}')
+            if l_failed_results is not None:
+                l_failed_results.append(CsvFileResult(path_csv_file, exception=value))
+
+
+def _get_messages_from_queues(l_queues: 'List[queue.Queue[Tuple[int, str, Any]]]',
+                              is_ordered: bool) -> 'Generator[Tuple[int, str, Any], Optional[str], None]':
+    """ the messages of the workers, until the end of every file - a file can be closed by the consumer with the message 'close' """
+    set_open_indexes = set(range(len(l_queues)))
+    index = 0
+    while set_open_indexes:
+        if is_ordered and index not in set_open_indexes:
+            index += 1
+            continue
+        message = l_queues[index].get()
+        if message[0] not in set_open_indexes:
+            continue
+        reply = yield message
+        if message[1] in ('end', 'error') or reply == 'close':
+            set_open_indexes.discard(message[0])
+
+
+def _get_messages_from_processes(l_paths: List[pathlib.Path], l_dict_file_kwargs: List[Dict[str, Any]],
+                                 max_workers: Optional[int]) -> 'Generator[Tuple[int, str, Any], Optional[str], None]':
+    """ the messages like _put_csv_file_rows, the files are read completely in the worker processes and submitted max_workers files ahead """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        number_of_files_ahead = max_workers or os.cpu_count() or 1
+        dict_futures = dict()       # type: Dict[int, concurrent.futures.Future[Tuple[List[str], List[Dict[str, Any]]]]]
+        for index in range(len(l_paths)):
+            for index_submit in range(index, min(index + number_of_files_ahead, len(l_paths))):
+                if index_submit not in dict_futures:
+                    dict_futures[index_submit] = executor.submit(_read_csv_file_with_header, l_paths[index_submit], l_dict_file_kwargs[index_submit])
+            try:
+                file_fieldnames, l_dict_data = dict_futures.pop(index).result()
+            except Exception as exc:
+                yield index, 'error', exc
+                continue
+            if (yield index, 'header', file_fieldnames) != 'close':
+                yield index, 'rows', l_dict_data
+                yield index, 'end', None
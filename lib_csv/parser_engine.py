@@ -0,0 +1,159 @@
+# STDLIB
+import csv
+import itertools
+import operator
+from typing import Any, Dict, IO, Iterator, List, Optional
+
+
+ENGINES = ('auto', 'fast', 'csv')
+
+# csv.QUOTE_NONNUMERIC converts the unquoted fields to float, and the newer quoting modes return None for empty fields
+FAST_ENGINE_QUOTING = (csv.QUOTE_MINIMAL, csv.QUOTE_ALL, csv.QUOTE_NONE)
+
+
+class FastCsvReader(object):
+    """
+    reads blocks of lines and splits the lines of a block with str.split, if the block does not contain
+    the quotechar, the escapechar or another character which needs the state machine of csv.reader.
+    the other blocks are parsed at once by csv.reader, or row by row if a record spans lines - then a record
+    which continues after the end of the block is read on from the file.
+
+    the rows are the same as the rows of csv.reader - an empty line is an empty row.
+    like csv.reader it can be iterated, and line_num is the number of lines read from the file.
+    skip_records: the number of records to skip at the start of the file - the lines of blocks without special characters are not split.
+
+    >>> import io
+    >>> reader = FastCsvReader(io.StringIO('a;b\\n\\n;\\nx;"y\\nz";w\\nlast'), block_size=1)
+    >>> list(reader), reader.line_num
+    ([['a', 'b'], [], ['', ''], ['x', 'y\\nz', 'w'], ['last']], 6)
+    >>> reader = FastCsvReader(io.StringIO('a;b\\n\\n;\\nx;"y\\nz";w\\nlast'), block_size=1, skip_records=3)
+    >>> list(reader), reader.line_num
+    ([['x', 'y\\nz', 'w'], ['last']], 6)
+
+    """
+
+    def __init__(self,
+                 f_csv_file: IO[str],
+                 delimiter: str = ";",
+                 quotechar: Optional[str] = '"',
+                 quoting: int = csv.QUOTE_MINIMAL,
+                 doublequote: bool = True,
+                 escapechar: Optional[str] = None,
+                 block_size: int = 256 * 1024,
+                 skip_records: int = 0) -> None:
+        if quoting not in FAST_ENGINE_QUOTING:
+            raise ValueError(f'the fast engine does not support quoting={quoting}, use engine="csv"')
+        self.f_csv_file = f_csv_file
+        self.delimiter = delimiter
+        self.block_size = block_size
+        self.line_num = 0
+        self.skip_records = skip_records
+        self._l_special_chars = ['\r', '\0']
+        if quotechar and quoting != csv.QUOTE_NONE:
+            self._l_special_chars.append(quotechar)
+        if escapechar:
+            self._l_special_chars.append(escapechar)
+        self._dict_csv_kwargs = dict(delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                     doublequote=doublequote, escapechar=escapechar)     # type: Dict[str, Any]
+        self._it_rows = self._iter_rows()
+
+    def __iter__(self) -> Iterator[List[str]]:
+        return self._it_rows
+
+    def __next__(self) -> List[str]:
+        return next(self._it_rows)
+
+    def _iter_rows(self) -> Iterator[List[str]]:
+        l_special_chars = self._l_special_chars
+        # a record which continues after the end of a block is read on line by line from the file
+        it_file_lines = iter(self.f_csv_file.readline, '')
+        while True:
+            l_lines = self.f_csv_file.readlines(self.block_size)
+            if not l_lines:
+                return
+            block = ''.join(l_lines)
+            if any(special_char in block for special_char in l_special_chars):
+                it_block_rows = self._iter_block_rows(l_lines, it_file_lines)
+                if self.skip_records:
+                    self.skip_records -= sum(1 for _ in itertools.islice(it_block_rows, self.skip_records))
+                yield from it_block_rows
+            else:
+                if self.skip_records:
+                    # the skipped lines are not split
+                    number_of_skipped_lines = min(self.skip_records, len(l_lines))
+                    self.skip_records -= number_of_skipped_lines
+                    self.line_num += number_of_skipped_lines
+                    if number_of_skipped_lines == len(l_lines):
+                        continue
+                    l_lines = l_lines[number_of_skipped_lines:]
+                    block = ''.join(l_lines)
+                yield from self._iter_clean_block_rows(l_lines, block)
+
+    def _iter_clean_block_rows(self, l_lines: List[str], block: str) -> Iterator[List[str]]:
+        """ splits a block without special characters """
+        delimiter = self.delimiter
+        line_num = self.line_num
+        for line in l_lines:
+            line_num += 1
+            self.line_num = line_num
+            if line[-1:] == '\n':
+                line = line[:-1]
+            yield line.split(delimiter) if line else []
+
+    def _iter_block_rows(self, l_lines: List[str], it_file_lines: Iterator[str]) -> Iterator[List[str]]:
+        """ parses a block with csv.reader """
+        line_num = self.line_num
+        # strict=True only adds errors, it raises at the end of the block if the last record is not complete
+        try:
+            l_rows = list(csv.reader(l_lines, strict=True, **self._dict_csv_kwargs))
+        except csv.Error:
+            l_rows = []
+        if len(l_rows) == len(l_lines):
+            # no record spans lines
+            for row in l_rows:
+                line_num += 1
+                self.line_num = line_num
+                yield row
+            return
+
+        it_block_lines = iter(l_lines)
+        csv_reader = csv.reader(itertools.chain(it_block_lines, it_file_lines), **self._dict_csv_kwargs)
+        for row in csv_reader:
+            self.line_num = line_num + csv_reader.line_num
+            yield row
+            # csv.reader does not read ahead, so the block is left exactly after its last record
+            if not operator.length_hint(it_block_lines):
+                break
+
+
+def get_csv_reader(f_csv_file: IO[str],
+                   engine: str = 'auto',
+                   delimiter: str = ";",
+                   quotechar: Optional[str] = '"',
+                   quoting: int = csv.QUOTE_MINIMAL,
+                   doublequote: bool = True,
+                   escapechar: Optional[str] = None) -> Any:
+    """
+    returns the reader for the engine :
+        'csv'  : csv.reader
+        'fast' : FastCsvReader - raises ValueError if the quoting is not supported by the fast engine
+        'auto' : FastCsvReader if the quoting is supported, otherwise csv.reader
+
+    >>> import io
+    >>> type(get_csv_reader(io.StringIO(''))).__name__, type(get_csv_reader(io.StringIO(''), quoting=csv.QUOTE_NONNUMERIC)).__name__
+    ('FastCsvReader', 'reader')
+    >>> get_csv_reader(io.StringIO(''), engine='fast', quoting=csv.QUOTE_NONNUMERIC)
+    Traceback (most recent call last):
+        ...
+    ValueError: the fast engine does not support quoting=2, use engine="csv"
+    >>> get_csv_reader(io.StringIO(''), engine='pandas')
+    Traceback (most recent call last):
+        ...
+    ValueError: engine must be "auto", "fast" or "csv", not "pandas"
+
+    """
+    if engine not in ENGINES:
+        raise ValueError(f'engine must be "auto", "fast" or "csv", not "{engine}"')
+    if engine == 'fast' or (engine == 'auto' and quoting in FAST_ENGINE_QUOTING):
+        return FastCsvReader(f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote, escapechar=escapechar)
+    return csv.reader(f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote, escapechar=escapechar)
@@ -0,0 +1,262 @@
+# STDLIB
+import concurrent.futures
+import csv
+import hashlib
+import io
+import logging
+import pathlib
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+# PROJ
+try:
+    from .lib_csv import get_ebay_csv_row
+    from .sink import ENCODERS
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import get_ebay_csv_row      # type: ignore  # pragma: no cover
+    from sink import ENCODERS                 # type: ignore  # pragma: no cover
+
+
+logger = logging.getLogger()     # type: logging.Logger
+
+
+class CsvPartFile(object):
+    """
+    one part of write_ll_data_to_partitioned_csv_files : the file, the partition, the number of rows without the header,
+    the number of bytes and the sha256 of the file
+    """
+
+    def __init__(self, path_csv_file: pathlib.Path, partition: Optional[str], part_number: int) -> None:
+        self.path_csv_file = path_csv_file
+        self.partition = partition
+        self.part_number = part_number
+        self.number_of_rows = 0
+        self.number_of_bytes = 0
+        self._hash = hashlib.sha256()
+        self._l_pending_chunks = []                         # type: List[bytes]
+        self._number_of_pending_bytes = 0
+        self._is_created = False
+        self._future = None                                 # type: Optional[concurrent.futures.Future[None]]
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def __repr__(self) -> str:
+        return f'CsvPartFile({self.path_csv_file.name}, partition={self.partition!r}, rows={self.number_of_rows}, bytes={self.number_of_bytes})'
+
+
+def write_ll_data_to_partitioned_csv_files(ll_data: Iterable[List[Any]],
+                                           path_csv_file: pathlib.Path,
+                                           partition_by_fieldname: Optional[str] = None,
+                                           max_rows_per_file: Optional[int] = None,
+                                           max_bytes_per_file: Optional[int] = None,
+                                           encoder: str = 'ebay',
+                                           encoding: str = "utf-8",
+                                           delimiter: str = ";",
+                                           quotechar: str = '"',
+                                           quoting: int = csv.QUOTE_MINIMAL,
+                                           lineterminator: str = '\n',
+                                           escapechar: str = '"',
+                                           max_open_files: int = 8,
+                                           buffer_size: int = 1024 * 1024,
+                                           max_buffered_bytes: int = 64 * 1024 * 1024) -> List[CsvPartFile]:
+    """
+    writes the rows of ll_data (the first row is the header) into part files, each with the header as first row.
+    returns the manifest : the CsvPartFile of every part, in the order of their first row.
+
+    partition_by_fieldname: the rows are routed by the value of this column into the files <stem>_<value>_<part>.<suffix>,
+                            the characters of the value which are not letters, digits, '.', '-' or '_' are replaced by '_'.
+                            values with the same file name (compared case insensitive) raise ValueError
+    max_rows_per_file, max_bytes_per_file: a new part is started before a part would exceed the limits,
+                                           without partition_by_fieldname the files are <stem>_<part>.<suffix>.
+                                           a row which is larger than max_bytes_per_file is written alone into a part
+    encoder:
+        'ebay' : the encoder of write_ll_data_to_csv_file_ebay, rows with a different length as the header are logged as warning -
+                 but a row which is too short for the partition field raises ValueError, it can not be routed
+        'csv'  : csv.writer, rows with a different length as the header raise ValueError
+
+    the rows are encoded in the calling thread and collected per part. chunks of buffer_size bytes are written by a pool of
+    max_open_files threads - each thread opens a file for one chunk, so not more than max_open_files files are open at the same time.
+    all pending chunks are written, when more than max_buffered_bytes are collected.
+
+    >>> # setup
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / 'partition_test.csv'
+    >>> ll_data = [['nr', 'category', 'title']] + [[index, ['Kabel', 'Rohr/Fitting'][index % 2], 'te"st'] for index in range(5)]
+
+    >>> # Test partitions with max rows
+    >>> l_parts = write_ll_data_to_partitioned_csv_files(ll_data, testfile, partition_by_fieldname='category', max_rows_per_file=2)
+    >>> for part in l_parts: print(part)
+    CsvPartFile(partition_test_Kabel_0001.csv, partition='Kabel', rows=2, bytes=52)
+    CsvPartFile(partition_test_Rohr_Fitting_0001.csv, partition='Rohr/Fitting', rows=2, bytes=66)
+    CsvPartFile(partition_test_Kabel_0002.csv, partition='Kabel', rows=1, bytes=35)
+    >>> read_csv_file_with_header_to_list_of_dicts(l_parts[2].path_csv_file, encoding='utf-8')
+    [{'nr': '4', 'category': 'Kabel', 'title': 'te"st'}]
+    >>> all(part.sha256 == hashlib.sha256(part.path_csv_file.read_bytes()).hexdigest() for part in l_parts)
+    True
+    >>> for part in l_parts: part.path_csv_file.unlink()
+
+    >>> # Test max bytes
+    >>> l_parts = write_ll_data_to_partitioned_csv_files(ll_data, testfile, max_bytes_per_file=60, encoder='csv', max_open_files=2, buffer_size=1)
+    >>> [(part.path_csv_file.name, part.number_of_rows, part.number_of_bytes) for part in l_parts]
+    [('partition_test_0001.csv', 2, 59), ('partition_test_0002.csv', 2, 59), ('partition_test_0003.csv', 1, 35)]
+    >>> for part in l_parts: part.path_csv_file.unlink()
+
+    >>> # Test partitions with the same file name, also if only the case differs
+    >>> write_ll_data_to_partitioned_csv_files([['category'], ['Kabel'], ['KABEL']], testfile, partition_by_fieldname='category')
+    Traceback (most recent call last):
+        ...
+    ValueError: the partitions "Kabel" and "KABEL" have the same file name "partition_test_KABEL_0001.csv"
+
+    >>> # Test wrong row length
+    >>> write_ll_data_to_partitioned_csv_files([['a', 'b'], [1]], testfile, encoder='csv')
+    Traceback (most recent call last):
+        ...
+    ValueError: row "[1]" has a different length as the header line
+    >>> write_ll_data_to_partitioned_csv_files([['nr', 'category'], [1]], testfile, partition_by_fieldname='category')
+    Traceback (most recent call last):
+        ...
+    ValueError: row "[1]" has no value for the partition field "category"
+    >>> for path in test_directory.glob('partition_test_*.csv'): path.unlink()
+
+    """
+    if encoder not in ENCODERS:
+        raise ValueError(f'encoder must be "csv" or "ebay", not "{encoder}"')
+    path_csv_file = pathlib.Path(path_csv_file)
+    it_rows = iter(ll_data)
+    header = next(it_rows, None)
+    if header is None:
+        raise RuntimeError('Nothing to export')
+    number_of_fields = len(header)
+    index_of_partition_field = None
+    if partition_by_fieldname is not None:
+        if partition_by_fieldname not in header:
+            raise ValueError(f'Field "{partition_by_fieldname}" is not available in the header')
+        index_of_partition_field = header.index(partition_by_fieldname)
+
+    if encoder == 'ebay':
+        b_delimiter, b_quotechar, b_escapechar = delimiter.encode(encoding), quotechar.encode(encoding), escapechar.encode(encoding)
+        b_lineterminator = lineterminator.encode(encoding)
+
+        def encode_row(row: List[Any]) -> bytes:
+            if len(row) != number_of_fields:
+                logger.warning(f'row {row} has a different length as the header line')
+            return get_ebay_csv_row(row, delimiter=b_delimiter, quotechar=b_quotechar, escapechar=b_escapechar, encoding=encoding) + b_lineterminator
+    else:
+        f_text = io.StringIO()
+        csv_writer = csv.writer(f_text, delimiter=delimiter, quotechar=quotechar, quoting=quoting, lineterminator=lineterminator)
+
+        def encode_row(row: List[Any]) -> bytes:
+            if len(row) != number_of_fields:
+                raise ValueError(f'row "{row}" has a different length as the header line')
+            f_text.seek(0)
+            f_text.truncate()
+            csv_writer.writerow(row)
+            return f_text.getvalue().encode(encoding)
+
+    b_header = encode_row(header)
+    l_parts = []                                            # type: List[CsvPartFile]
+    dict_current_part = dict()                              # type: Dict[Optional[str], CsvPartFile]
+    dict_partition_by_file_name = dict()                    # type: Dict[str, Optional[str]]
+    number_of_buffered_bytes = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_open_files) as executor:
+        try:
+            for row in it_rows:
+                if index_of_partition_field is None:
+                    partition = None
+                elif index_of_partition_field < len(row):
+                    partition = str(row[index_of_partition_field])
+                else:
+                    raise ValueError(f'row "{row}" has no value for the partition field "{partition_by_fieldname}"')
+                b_row = encode_row(row)
+                part = dict_current_part.get(partition)
+                if part is not None and _is_part_full(part, len(b_row), max_rows_per_file, max_bytes_per_file):
+                    number_of_buffered_bytes -= _submit_pending_chunks(executor, part)
+                    part = None
+                if part is None:
+                    part = _new_part(path_csv_file, partition, dict_current_part, dict_partition_by_file_name)
+                    l_parts.append(part)
+                    dict_current_part[partition] = part
+                    _add_chunk(part, b_header)
+                    number_of_buffered_bytes += len(b_header)
+                _add_chunk(part, b_row)
+                part.number_of_rows += 1
+                number_of_buffered_bytes += len(b_row)
+
+                if part._number_of_pending_bytes >= buffer_size:
+                    number_of_buffered_bytes -= _submit_pending_chunks(executor, part)
+                if number_of_buffered_bytes > max_buffered_bytes:
+                    for part in dict_current_part.values():
+                        number_of_buffered_bytes -= _submit_pending_chunks(executor, part)
+            for part in dict_current_part.values():
+                _submit_pending_chunks(executor, part)
+        finally:
+            # the exceptions of the threads are raised here
+            for part in l_parts:
+                if part._future is not None:
+                    part._future.result()
+    return l_parts
+
+
+def _new_part(path_csv_file: pathlib.Path, partition: Optional[str], dict_current_part: Dict[Optional[str], CsvPartFile],
+              dict_partition_by_file_name: Dict[str, Optional[str]]) -> CsvPartFile:
+    previous_part = dict_current_part.get(partition)
+    part_number = previous_part.part_number + 1 if previous_part is not None else 1
+    if partition is None:
+        file_name = f'{path_csv_file.stem}_{part_number:04d}{path_csv_file.suffix}'
+    else:
+        file_name = f'{path_csv_file.stem}_{get_partition_file_name(partition)}_{part_number:04d}{path_csv_file.suffix}'
+    # case insensitive, like the file systems of windows and macOS
+    other_partition = dict_partition_by_file_name.setdefault(file_name.casefold(), partition)
+    if other_partition != partition:
+        raise ValueError(f'the partitions "{other_partition}" and "{partition}" have the same file name "{file_name}"')
+    return CsvPartFile(path_csv_file.with_name(file_name), partition, part_number)
+
+
+def _is_part_full(part: CsvPartFile, number_of_row_bytes: int, max_rows_per_file: Optional[int], max_bytes_per_file: Optional[int]) -> bool:
+    if not part.number_of_rows:
+        return False
+    if max_rows_per_file is not None and part.number_of_rows >= max_rows_per_file:
+        return True
+    return max_bytes_per_file is not None and part.number_of_bytes + number_of_row_bytes > max_bytes_per_file
+
+
+def get_partition_file_name(partition: str) -> str:
+    """
+    the partition value as part of a file name
+
+    >>> get_partition_file_name('Rohr/Fitting: 1" x 2"')
+    'Rohr_Fitting__1__x_2_'
+    """
+    return re.sub(r'[^\w.-]', '_', partition)
+
+
+def _add_chunk(part: CsvPartFile, chunk: bytes) -> None:
+    part._l_pending_chunks.append(chunk)
+    part._number_of_pending_bytes += len(chunk)
+    part.number_of_bytes += len(chunk)
+
+
+def _submit_pending_chunks(executor: concurrent.futures.ThreadPoolExecutor, part: CsvPartFile) -> int:
+    """ submits the pending chunks of the part to the thread pool, returns the number of submitted bytes """
+    if not part._l_pending_chunks:
+        return 0
+    data = b''.join(part._l_pending_chunks)
+    part._l_pending_chunks = []
+    part._number_of_pending_bytes = 0
+    part._hash.update(data)
+    if part._future is not None:
+        # the chunks of one part are written in order
+        part._future.result()
+    part._future = executor.submit(_write_chunk, part.path_csv_file, data, part._is_created)
+    part._is_created = True
+    return len(data)
+
+
+def _write_chunk(path_csv_file: pathlib.Path, data: bytes, is_append: bool) -> None:
+    with open(str(path_csv_file), 'ab' if is_append else 'wb') as f_csv_file:
+        f_csv_file.write(data)
@@ -0,0 +1,338 @@
+# STDLIB
+import collections
+import concurrent.futures
+import csv
+import logging
+import pathlib
+import queue
+import threading
+import time
+from typing import Any, Callable, Deque, Iterable, List, Optional, Sequence, Tuple
+
+# PROJ
+try:
+    from .lib_csv import read_csv_file_header, read_csv_file_with_header_to_iterator_of_dicts
+    from .sink import CsvSink
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import read_csv_file_header, read_csv_file_with_header_to_iterator_of_dicts      # type: ignore  # pragma: no cover
+    from sink import CsvSink                                                # type: ignore  # pragma: no cover
+
+
+logger = logging.getLogger()     # type: logging.Logger
+
+# the marker after the last batch in a queue
+_END = object()
+
+
+class PipelineStage(object):
+    """
+    a transform stage of run_pipeline :
+    function(row) returns the transformed row, or None to drop the row.
+    with is_batch_function=True, function(l_rows) gets the list of the rows of a batch and returns the list of the transformed rows.
+
+    max_workers: the number of threads, or with use_processes=True the number of processes, which transform the batches in parallel.
+                 with processes the function and the rows must be picklable, so the function must be defined at module level
+    """
+
+    def __init__(self, function: Callable[[Any], Any], name: Optional[str] = None, max_workers: int = 1, use_processes: bool = False,
+                 is_batch_function: bool = False) -> None:
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self.function = function
+        self.name = name or getattr(function, '__name__', 'stage')
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.is_batch_function = is_batch_function
+
+
+class PipelineStageMetrics(object):
+    """
+    the metrics of a stage of run_pipeline, also of the reader ('read') and the writer ('write').
+    busy_seconds: the time the stage spent in the function, summed over all workers - for the reader the time in the source,
+                  for the writer the time in the sink
+    elapsed_seconds: the time from the start of the pipeline until the stage finished its last batch
+    utilization: busy_seconds / (elapsed_seconds * number_of_workers) - the stage with the highest utilization is the bottleneck,
+                 a low utilization means the stage is waiting for the other stages
+    """
+
+    def __init__(self, name: str, number_of_workers: int = 1) -> None:
+        self.name = name
+        self.number_of_workers = number_of_workers
+        self.number_of_batches = 0
+        self.number_of_rows_in = 0
+        self.number_of_rows_out = 0
+        self.busy_seconds = 0.0
+        self.elapsed_seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.number_of_rows_in / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def utilization(self) -> float:
+        return self.busy_seconds / (self.elapsed_seconds * self.number_of_workers) if self.elapsed_seconds else 0.0
+
+    def __repr__(self) -> str:
+        return (f'PipelineStageMetrics({self.name}, rows_in={self.number_of_rows_in}, rows_out={self.number_of_rows_out}, '
+                f'batches={self.number_of_batches}, rows_per_second={self.rows_per_second:.0f}, utilization={self.utilization:.0%})')
+
+
+class _Pipeline(object):
+    """ the threads of run_pipeline : the reader, one dispatcher per stage, and the writer in the calling thread """
+
+    def __init__(self, batch_size: int, max_queue_size: int, is_ordered: bool) -> None:
+        self.batch_size = batch_size
+        self.max_queue_size = max_queue_size
+        self.is_ordered = is_ordered
+        self.time_start = time.perf_counter()
+        self.stop_event = threading.Event()
+        self.failed_stage_name = ''
+        self.exception = None                               # type: Optional[BaseException]
+        self._lock = threading.Lock()
+
+    def fail(self, stage_name: str, exc: BaseException) -> None:
+        with self._lock:
+            if self.exception is None:
+                logger.error(f'pipeline stage "{stage_name}" failed: {exc}')
+                self.failed_stage_name = stage_name
+                self.exception = exc
+        self.stop_event.set()
+
+    def put(self, q: 'queue.Queue[Any]', item: Any) -> bool:
+        """ blocks while the queue is full, returns False if the pipeline is stopped """
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q: 'queue.Queue[Any]') -> Any:
+        """ blocks while the queue is empty, returns _END if the pipeline is stopped """
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def read(self, source: Iterable[Any], metrics: PipelineStageMetrics, q_out: 'queue.Queue[Any]') -> None:
+        try:
+            it_source = iter(source)
+            while True:
+                time_start = time.perf_counter()
+                l_rows = [row for _, row in zip(range(self.batch_size), it_source)]
+                metrics.busy_seconds += time.perf_counter() - time_start
+                if not l_rows:
+                    break
+                metrics.number_of_batches += 1
+                metrics.number_of_rows_in += len(l_rows)
+                metrics.number_of_rows_out += len(l_rows)
+                if not self.put(q_out, l_rows):
+                    return
+            metrics.elapsed_seconds = time.perf_counter() - self.time_start
+            self.put(q_out, _END)
+        except BaseException as exc:
+            self.fail(metrics.name, exc)
+
+    def transform(self, stage: PipelineStage, metrics: PipelineStageMetrics, q_in: 'queue.Queue[Any]', q_out: 'queue.Queue[Any]') -> None:
+        executor_class = concurrent.futures.ProcessPoolExecutor if stage.use_processes else concurrent.futures.ThreadPoolExecutor
+        try:
+            with executor_class(max_workers=stage.max_workers) as executor:     # type: ignore
+                pending = collections.deque()               # type: Deque[concurrent.futures.Future[Tuple[List[Any], float]]]
+                is_end = False
+                while not is_end or pending:
+                    if not is_end:
+                        l_rows = self.get(q_in)
+                        if l_rows is _END:
+                            is_end = True
+                        else:
+                            metrics.number_of_batches += 1
+                            metrics.number_of_rows_in += len(l_rows)
+                            pending.append(executor.submit(_transform_batch, stage.function, stage.is_batch_function, l_rows))
+                    if self.stop_event.is_set():
+                        return
+                    # not more than two batches per worker are in the executor - blocks until a result is available
+                    is_blocking = is_end or len(pending) >= 2 * stage.max_workers
+                    for future in self._take_finished(pending, is_blocking):
+                        l_rows_out, busy_seconds = future.result()
+                        metrics.busy_seconds += busy_seconds
+                        metrics.number_of_rows_out += len(l_rows_out)
+                        if l_rows_out and not self.put(q_out, l_rows_out):
+                            return
+            metrics.elapsed_seconds = time.perf_counter() - self.time_start
+            self.put(q_out, _END)
+        except BaseException as exc:
+            self.fail(metrics.name, exc)
+
+    def _take_finished(self, pending: 'Deque[concurrent.futures.Future[Any]]', is_blocking: bool) -> 'List[concurrent.futures.Future[Any]]':
+        """ removes the finished futures from pending - if ordered, only the finished futures at the start """
+        if not pending:
+            return []
+        if self.is_ordered:
+            if is_blocking:
+                concurrent.futures.wait([pending[0]])
+            l_finished = []
+            while pending and pending[0].done():
+                l_finished.append(pending.popleft())
+            return l_finished
+        if is_blocking:
+            concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        l_finished = [future for future in pending if future.done()]
+        for future in l_finished:
+            pending.remove(future)
+        return l_finished
+
+    def write(self, sink: Callable[[List[Any]], None], metrics: PipelineStageMetrics, q_in: 'queue.Queue[Any]') -> None:
+        try:
+            while True:
+                l_rows = self.get(q_in)
+                if l_rows is _END:
+                    break
+                time_start = time.perf_counter()
+                sink(l_rows)
+                metrics.busy_seconds += time.perf_counter() - time_start
+                metrics.number_of_batches += 1
+                metrics.number_of_rows_in += len(l_rows)
+                metrics.number_of_rows_out += len(l_rows)
+            metrics.elapsed_seconds = time.perf_counter() - self.time_start
+        except BaseException as exc:
+            self.fail(metrics.name, exc)
+
+
+def _transform_batch(function: Callable[[Any], Any], is_batch_function: bool, l_rows: List[Any]) -> Tuple[List[Any], float]:
+    """ runs in the worker thread or process, returns the transformed rows and the busy seconds """
+    time_start = time.perf_counter()
+    if is_batch_function:
+        l_rows_out = list(function(l_rows))
+    else:
+        l_rows_out = [row_out for row_out in map(function, l_rows) if row_out is not None]
+    return l_rows_out, time.perf_counter() - time_start
+
+
+def run_pipeline(source: Iterable[Any],
+                 stages: Sequence[PipelineStage],
+                 sink: Callable[[List[Any]], None],
+                 batch_size: int = 1000,
+                 max_queue_size: int = 4,
+                 is_ordered: bool = True) -> List[PipelineStageMetrics]:
+    """
+    reads the rows from source in a thread, transforms them with the stages and calls sink with the list of the rows of each batch
+    in the calling thread - reading, the stages and writing overlap. returns the metrics of the reader, the stages and the writer.
+
+    the stages are connected by queues of max_queue_size batches of up to batch_size rows - a slow stage blocks the stages before it.
+    is_ordered: the batches are written in the order of the source, otherwise in the order they are finished by the parallel workers
+    if a stage fails, the pipeline is stopped and RuntimeError is raised with the original exception as cause.
+
+    >>> # Test ordered threads
+    >>> def slow_square(number):
+    ...     time.sleep((number % 7) / 10000)
+    ...     return number * number if number % 3 else None
+    >>> l_result = []
+    >>> l_metrics = run_pipeline(range(1000), [PipelineStage(slow_square, max_workers=4)], l_result.extend, batch_size=10)
+    >>> l_result == [number * number for number in range(1000) if number % 3]
+    True
+    >>> for metrics in l_metrics: print(metrics)  # doctest: +ELLIPSIS
+    PipelineStageMetrics(read, rows_in=1000, rows_out=1000, batches=100, rows_per_second=..., utilization=...)
+    PipelineStageMetrics(slow_square, rows_in=1000, rows_out=666, batches=100, rows_per_second=..., utilization=...)
+    PipelineStageMetrics(write, rows_in=666, rows_out=666, batches=100, rows_per_second=..., utilization=...)
+
+    >>> # Test unordered processes with a batch function
+    >>> l_result = []
+    >>> l_metrics = run_pipeline(range(1000), [PipelineStage(sorted, max_workers=2, use_processes=True, is_batch_function=True)],
+    ...                          l_result.extend, batch_size=100, is_ordered=False)
+    >>> sorted(l_result) == list(range(1000)), l_metrics[1].number_of_workers
+    (True, 2)
+
+    >>> # Test failure of a stage
+    >>> run_pipeline(['1', 'x'], [PipelineStage(int, max_workers=2)], l_result.extend, batch_size=1)
+    Traceback (most recent call last):
+        ...
+    RuntimeError: pipeline stage "int" failed: invalid literal for int() with base 10: 'x'
+
+    """
+    pipeline = _Pipeline(batch_size=batch_size, max_queue_size=max_queue_size, is_ordered=is_ordered)
+    l_metrics = [PipelineStageMetrics('read')]
+    l_queues = [queue.Queue(maxsize=max_queue_size)]         # type: List[queue.Queue[Any]]
+    l_threads = [threading.Thread(target=pipeline.read, args=(source, l_metrics[0], l_queues[0]), name='pipeline read', daemon=True)]
+    for stage in stages:
+        l_metrics.append(PipelineStageMetrics(stage.name, stage.max_workers))
+        l_queues.append(queue.Queue(maxsize=max_queue_size))
+        l_threads.append(threading.Thread(target=pipeline.transform, args=(stage, l_metrics[-1], l_queues[-2], l_queues[-1]),
+                                          name=f'pipeline {stage.name}', daemon=True))
+    l_metrics.append(PipelineStageMetrics('write'))
+
+    for thread in l_threads:
+        thread.start()
+    try:
+        pipeline.write(sink, l_metrics[-1], l_queues[-1])
+    finally:
+        pipeline.stop_event.set()
+        for thread in l_threads:
+            thread.join()
+    if pipeline.exception is not None:
+        raise RuntimeError(f'pipeline stage "{pipeline.failed_stage_name}" failed: {pipeline.exception}') from pipeline.exception
+    return l_metrics
+
+
+def run_csv_pipeline(path_csv_file: pathlib.Path,
+                     path_output_file: pathlib.Path,
+                     stages: Sequence[PipelineStage],
+                     fieldnames: Optional[List[str]] = None,
+                     encoding: str = "ISO-8859-1",
+                     delimiter: str = ";",
+                     quotechar: str = '"',
+                     quoting: int = csv.QUOTE_MINIMAL,
+                     output_encoding: Optional[str] = None,
+                     batch_size: int = 1000,
+                     max_queue_size: int = 4,
+                     is_ordered: bool = True,
+                     engine: str = 'auto') -> List[PipelineStageMetrics]:
+    """
+    run_pipeline from the rows of read_csv_file_with_header_to_iterator_of_dicts to a CsvSink, which writes in its own thread.
+    the stages get and return the rows as dicts. the output file has the fieldnames as header,
+    by default the keys of the first written row - or the header of the input file, if no row is written.
+
+    >>> # setup
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / '2018-06-06_active_qty.csv'
+    >>> path_output_file = test_directory / 'pipeline_test.csv'
+    >>> def add_stock(dict_row):
+    ...     return dict(dict_row, stock=int(dict_row['Quantity']) * 2) if dict_row['Quantity'] not in ('', '0') else None
+
+    >>> # Test
+    >>> l_metrics = run_csv_pipeline(testfile, path_output_file, [PipelineStage(add_stock, max_workers=2)], batch_size=100)
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_dicts(path_output_file)
+    >>> l_dict_data[0]['stock'] == str(2 * int(l_dict_data[0]['Quantity'])), l_metrics[-1].number_of_rows_in == len(l_dict_data)
+    (True, True)
+
+    >>> # Teardown
+    >>> path_output_file.unlink()
+
+    """
+    output_encoding = output_encoding or encoding
+    it_dict_data = read_csv_file_with_header_to_iterator_of_dicts(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar,
+                                                                  quoting=quoting, engine=engine)
+    l_sinks = []                                            # type: List[CsvSink]
+    l_fieldnames = list(fieldnames or [])
+
+    def write_rows(l_dict_data: List[Any]) -> None:
+        if not l_sinks:
+            l_fieldnames[:] = l_fieldnames or list(l_dict_data[0])
+            l_sinks.append(CsvSink(path_output_file, encoding=output_encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                   header=l_fieldnames))
+        l_sinks[0].put_many([[dict_row[fieldname] for fieldname in l_fieldnames] for dict_row in l_dict_data])
+
+    try:
+        l_metrics = run_pipeline(it_dict_data, stages, write_rows, batch_size=batch_size, max_queue_size=max_queue_size, is_ordered=is_ordered)
+    finally:
+        for sink in l_sinks:
+            sink.close()
+    if not l_sinks:
+        # no row was written
+        header = l_fieldnames or read_csv_file_header(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting)
+        CsvSink(path_output_file, encoding=output_encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting, header=header).close()
+    return l_metrics
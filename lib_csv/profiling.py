@@ -0,0 +1,359 @@
+# STDLIB
+import concurrent.futures
+import itertools
+import mmap
+import pathlib
+from typing import List, Optional, Tuple
+
+# PROJ
+try:
+    from .bytes_reader import check_ascii_compatible_encoding
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from bytes_reader import check_ascii_compatible_encoding     # type: ignore  # pragma: no cover
+
+
+class CsvFileProfile(object):
+    """
+    the result of profile_file. a record is a row of csv.reader, including the header and empty lines
+
+    min_fields, max_fields: the number of fields of the records, an empty line has 0 fields - None if the fields are not counted
+    number_of_multiline_records: the records with a newline within quotes
+    """
+
+    def __init__(self, path_csv_file: pathlib.Path, is_fields_counted: bool = True) -> None:
+        self.path_csv_file = path_csv_file
+        self.is_fields_counted = is_fields_counted
+        self.size = 0
+        self.number_of_records = 0
+        self.number_of_empty_records = 0
+        self.number_of_multiline_records = 0
+        self.number_of_bytes = 0
+        self.min_fields = None          # type: Optional[int]
+        self.max_fields = None          # type: Optional[int]
+
+    @property
+    def average_bytes_per_record(self) -> float:
+        return self.number_of_bytes / self.number_of_records if self.number_of_records else 0.0
+
+    @property
+    def has_embedded_newlines(self) -> bool:
+        return self.number_of_multiline_records > 0
+
+    def add_record(self, number_of_fields: int, number_of_bytes: int, is_multiline: bool) -> None:
+        self.number_of_records += 1
+        self.number_of_bytes += number_of_bytes
+        if is_multiline:
+            self.number_of_multiline_records += 1
+        if number_of_fields == 0:
+            self.number_of_empty_records += 1
+        if self.is_fields_counted:
+            self.min_fields = number_of_fields if self.min_fields is None else min(self.min_fields, number_of_fields)
+            self.max_fields = number_of_fields if self.max_fields is None else max(self.max_fields, number_of_fields)
+
+    def add_profile(self, other: 'CsvFileProfile') -> None:
+        """ adds the records of another part of the file """
+        self.number_of_records += other.number_of_records
+        self.number_of_empty_records += other.number_of_empty_records
+        self.number_of_multiline_records += other.number_of_multiline_records
+        self.number_of_bytes += other.number_of_bytes
+        for value in (other.min_fields, other.max_fields):
+            if value is not None:
+                self.min_fields = value if self.min_fields is None else min(self.min_fields, value)
+                self.max_fields = value if self.max_fields is None else max(self.max_fields, value)
+
+    def __repr__(self) -> str:
+        return (f'CsvFileProfile(records={self.number_of_records}, fields={self.min_fields}..{self.max_fields}, '
+                f'average_bytes_per_record={self.average_bytes_per_record:.1f}, multiline_records={self.number_of_multiline_records}, '
+                f'empty_records={self.number_of_empty_records})')
+
+
+class _OpenRecord(object):
+    """ the part of a record, which continues in the next block """
+
+    def __init__(self, number_of_delimiters: int = 0, number_of_bytes: int = 0, is_multiline: bool = False) -> None:
+        self.number_of_delimiters = number_of_delimiters
+        self.number_of_bytes = number_of_bytes
+        self.is_multiline = is_multiline
+
+    def add(self, other: '_OpenRecord') -> None:
+        self.number_of_delimiters += other.number_of_delimiters
+        self.number_of_bytes += other.number_of_bytes
+        # the previous block ended with a newline within quotes
+        self.is_multiline = True
+
+    def __bool__(self) -> bool:
+        return self.number_of_bytes > 0
+
+
+class _BlockProfile(object):
+    """
+    the profile of a block of lines, for one quoting state at the start of the block :
+    head : the end of a record from the previous block (if the block starts within quotes), is_head_complete if it ends in this block
+    profile : the records which start and end in this block
+    tail : a record which continues in the next block
+    """
+
+    def __init__(self, path_csv_file: pathlib.Path, is_fields_counted: bool) -> None:
+        self.head = _OpenRecord()
+        self.is_head_complete = False
+        self.profile = CsvFileProfile(path_csv_file, is_fields_counted)
+        self.tail = _OpenRecord()
+        self.is_end_in_quotes = False
+
+
+def count_records(path_csv_file: pathlib.Path,
+                  encoding: str = "ISO-8859-1",
+                  delimiter: str = ";",
+                  quotechar: Optional[str] = '"',
+                  max_workers: int = 1,
+                  chunk_size: int = 64 * 1024 * 1024) -> int:
+    """
+    returns the number of records (rows of csv.reader) including the header, see profile_file.
+    the fields are not counted.
+
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> count_records(test_directory / '2018-06-06_active_qty.csv')
+    1463
+    """
+    return profile_file(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar, max_workers=max_workers,
+                        chunk_size=chunk_size, is_fields_counted=False).number_of_records
+
+
+def profile_file(path_csv_file: pathlib.Path,
+                 encoding: str = "ISO-8859-1",
+                 delimiter: str = ";",
+                 quotechar: Optional[str] = '"',
+                 max_workers: int = 1,
+                 chunk_size: int = 64 * 1024 * 1024,
+                 is_fields_counted: bool = True) -> CsvFileProfile:
+    """
+    scans the raw bytes of the file (mmap) and returns the CsvFileProfile : the number of records, the minimum and maximum number of fields,
+    the bytes per record and the number of records with embedded newlines - without decoding or parsing the fields.
+
+    the quoting state is tracked by the parity of the quotechars, like the file is written by csv.writer (doublequote, no escapechar).
+    the line endings are \\n or \\r\\n. the encoding must be ascii compatible.
+
+    the file is split into chunks of chunk_size bytes at line ends. with max_workers > 1 the chunks are profiled in a process pool,
+    each chunk for both quoting states at its start, and the results are combined in the order of the chunks.
+
+    >>> # setup
+    >>> import csv
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile1 = test_directory / '0001_aktive_preis_qty.csv'
+    >>> testfile2 = test_directory / 'profile_test.csv'
+    >>> with open(str(testfile2), 'w', encoding='utf-8', newline='') as f_csv_file:
+    ...     csv_writer = csv.writer(f_csv_file, delimiter=';', lineterminator='\\r\\n')
+    ...     csv_writer.writerows([['a', 'b', 'c']] + [[index, 'mehr\\nzeilig "x";', ''] for index in range(1000)] + [[], ['ende']])
+
+    >>> # Test OK
+    >>> profile_file(testfile1)
+    CsvFileProfile(records=1489, fields=11..12, average_bytes_per_record=131.7, multiline_records=0, empty_records=0)
+    >>> profile = profile_file(testfile2, encoding='utf-8')
+    >>> profile
+    CsvFileProfile(records=1003, fields=0..3, average_bytes_per_record=26.8, multiline_records=1000, empty_records=1)
+    >>> profile.number_of_bytes == testfile2.stat().st_size
+    True
+
+    >>> # Test parallel chunks
+    >>> profile_parallel = profile_file(testfile2, encoding='utf-8', max_workers=2, chunk_size=1000)
+    >>> repr(profile_parallel) == repr(profile)
+    True
+    >>> count_records(testfile2, max_workers=2, chunk_size=100)
+    1003
+
+    >>> # Teardown
+    >>> testfile2.unlink()
+
+    """
+    check_ascii_compatible_encoding(encoding, delimiter + (quotechar or ''))
+    b_delimiter = delimiter.encode('ascii')
+    b_quotechar = quotechar.encode('ascii') if quotechar else None
+    profile = CsvFileProfile(path_csv_file, is_fields_counted)
+
+    with open(str(path_csv_file), 'rb') as f_csv_file:
+        profile.size = f_csv_file.seek(0, 2)
+        if not profile.size:
+            return profile
+        with mmap.mmap(f_csv_file.fileno(), 0, access=mmap.ACCESS_READ) as mm_csv_file:
+            l_chunks = _get_chunks(mm_csv_file, chunk_size)
+
+            if max_workers > 1 and len(l_chunks) > 1:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    # the state at the start of a chunk is known only after the previous chunk, so both states are profiled
+                    l_block_profiles = list(executor.map(_profile_chunk, itertools.repeat(path_csv_file), l_chunks,
+                                                         itertools.repeat(b_delimiter), itertools.repeat(b_quotechar),
+                                                         itertools.repeat(is_fields_counted), itertools.repeat((False, True))))
+                is_in_quotes = False
+                open_record = _OpenRecord()
+                for t_block_profiles in l_block_profiles:
+                    block_profile = t_block_profiles[1] if is_in_quotes else t_block_profiles[0]
+                    is_in_quotes, open_record = _add_block_profile(profile, block_profile, is_in_quotes, open_record)
+            else:
+                is_in_quotes = False
+                open_record = _OpenRecord()
+                for start, end in l_chunks:
+                    block_profile = _profile_block(path_csv_file, mm_csv_file[start:end], b_delimiter, b_quotechar, is_fields_counted, is_in_quotes)
+                    is_in_quotes, open_record = _add_block_profile(profile, block_profile, is_in_quotes, open_record)
+
+    if open_record:
+        # a quote which is not closed at the end of the file
+        _add_open_record(profile, open_record)
+    return profile
+
+
+def _get_chunks(mm_csv_file: mmap.mmap, chunk_size: int) -> List[Tuple[int, int]]:
+    """ the (start, end) of the chunks, which end after a newline - or at the end of the file """
+    l_chunks = list()
+    size = len(mm_csv_file)
+    start = 0
+    while start < size:
+        index_newline = mm_csv_file.find(b'\n', min(start + chunk_size, size) - 1)
+        end = size if index_newline < 0 else index_newline + 1
+        l_chunks.append((start, end))
+        start = end
+    return l_chunks
+
+
+def _profile_chunk(path_csv_file: pathlib.Path, chunk: Tuple[int, int], b_delimiter: bytes, b_quotechar: Optional[bytes],
+                   is_fields_counted: bool, t_is_start_in_quotes: Tuple[bool, ...]) -> Tuple[_BlockProfile, ...]:
+    """ runs in the worker processes of profile_file, so it must stay a module level function """
+    start, end = chunk
+    with open(str(path_csv_file), 'rb') as f_csv_file:
+        with mmap.mmap(f_csv_file.fileno(), 0, access=mmap.ACCESS_READ) as mm_csv_file:
+            block = mm_csv_file[start:end]
+    return tuple(_profile_block(path_csv_file, block, b_delimiter, b_quotechar, is_fields_counted, is_start_in_quotes)
+                 for is_start_in_quotes in t_is_start_in_quotes)
+
+
+def _add_block_profile(profile: CsvFileProfile, block_profile: _BlockProfile, is_in_quotes: bool, open_record: _OpenRecord) -> Tuple[bool, _OpenRecord]:
+    """ adds the block to the profile, returns the quoting state and the open record at the end of the block """
+    if is_in_quotes:
+        open_record.add(block_profile.head)
+        if not block_profile.is_head_complete:
+            return True, open_record
+        _add_open_record(profile, open_record)
+    profile.add_profile(block_profile.profile)
+    return block_profile.is_end_in_quotes, block_profile.tail
+
+
+def _add_open_record(profile: CsvFileProfile, open_record: _OpenRecord) -> None:
+    profile.add_record(open_record.number_of_delimiters + 1, open_record.number_of_bytes, open_record.is_multiline)
+
+
+def _profile_block(path_csv_file: pathlib.Path, block: bytes, b_delimiter: bytes, b_quotechar: Optional[bytes],
+                   is_fields_counted: bool, is_start_in_quotes: bool) -> _BlockProfile:
+    """
+    profiles a block of whole lines.
+
+    the block is split at the quotechars - the parts are alternately outside and inside of quotes, a doubled quotechar is an empty part.
+    the parts outside of quotes, joined by a quotechar for every quoted part, are split at the newlines into the records,
+    the delimiters are counted in them.
+
+    >>> block_profile = _profile_block(pathlib.Path('x'), b'b;c"\\na;"x\\n;y"\\n\\n"z', b';', b'"', True, True)
+    >>> block_profile.head.number_of_delimiters, block_profile.is_head_complete, block_profile.profile, block_profile.is_end_in_quotes
+    (0, True, CsvFileProfile(records=2, fields=0..2, average_bytes_per_record=5.0, multiline_records=1, empty_records=1), True)
+    """
+    block_profile = _BlockProfile(path_csv_file, is_fields_counted)
+    if b_quotechar is None or b_quotechar not in block:
+        if is_start_in_quotes:
+            block_profile.head = _OpenRecord(0, len(block), True)
+            block_profile.is_end_in_quotes = True
+        elif not is_fields_counted:
+            # only the records are counted, the lines are not split
+            block_profile.profile.number_of_records = block.count(b'\n') + (0 if block.endswith(b'\n') else 1)
+            block_profile.profile.number_of_bytes = len(block)
+        else:
+            l_lines = block.split(b'\n')
+            if l_lines[-1] == b'':
+                # the block ends with a newline
+                l_lines.pop()
+            _add_records(block_profile.profile, l_lines, len(block), 0, b_delimiter, is_fields_counted)
+        return block_profile
+
+    l_parts = block.split(b_quotechar)
+    index_first_outside_part = 1 if is_start_in_quotes else 0
+    l_outside_parts = l_parts[index_first_outside_part::2]
+    # an odd number of quotechars changes the state
+    is_end_in_quotes = is_start_in_quotes != (len(l_parts) % 2 == 0)
+    block_profile.is_end_in_quotes = is_end_in_quotes
+    outside_text = b_quotechar.join(l_outside_parts)
+    if is_start_in_quotes:
+        outside_text = b_quotechar + outside_text
+    l_lines = outside_text.split(b'\n')
+
+    # the records which contain a newline within quotes
+    l_newlines_per_outside_part = list(map(bytes.count, l_outside_parts, itertools.repeat(b'\n')))
+    l_record_index_after_outside_part = list(itertools.accumulate(l_newlines_per_outside_part))
+    l_inside_parts = l_parts[1 - index_first_outside_part::2]
+    set_multiline_records = set()
+    for index_inside_part in itertools.compress(range(len(l_inside_parts)), map(bytes.__contains__, l_inside_parts, itertools.repeat(b'\n'))):
+        # the inside part follows the outside part with the same index - or with the index - 1, if the block starts within quotes
+        index_outside_part = index_inside_part - index_first_outside_part
+        set_multiline_records.add(l_record_index_after_outside_part[index_outside_part] if index_outside_part >= 0 else 0)
+
+    index_last_line = len(l_lines) - 1
+    if is_start_in_quotes and not index_last_line:
+        # no record ends in this block
+        block_profile.head = _OpenRecord(l_lines[0].count(b_delimiter), len(block), True)
+        return block_profile
+
+    number_of_head_bytes = number_of_tail_bytes = 0
+    index_first_record = index_last_record = 0
+    if is_start_in_quotes:
+        number_of_head_bytes = _get_offset_after_newline(l_parts, l_newlines_per_outside_part, index_first_outside_part, is_first_newline=True)
+        block_profile.head = _OpenRecord(l_lines[0].count(b_delimiter), number_of_head_bytes, True)
+        block_profile.is_head_complete = True
+        index_first_record = 1
+    if is_end_in_quotes:
+        if index_last_line:
+            number_of_tail_bytes = len(block) - _get_offset_after_newline(l_parts, l_newlines_per_outside_part, index_first_outside_part,
+                                                                          is_first_newline=False)
+        else:
+            number_of_tail_bytes = len(block)
+        block_profile.tail = _OpenRecord(l_lines[-1].count(b_delimiter), number_of_tail_bytes, index_last_line in set_multiline_records)
+        index_last_record = index_last_line
+    elif l_lines[-1] == b'':
+        # the block ends with a newline
+        index_last_record = index_last_line
+    else:
+        # the last record of the file, without newline
+        index_last_record = index_last_line + 1
+
+    _add_records(block_profile.profile, l_lines[index_first_record:index_last_record], len(block) - number_of_head_bytes - number_of_tail_bytes,
+                 sum(1 for index_record in set_multiline_records if index_first_record <= index_record < index_last_record), b_delimiter,
+                 is_fields_counted)
+    return block_profile
+
+
+def _get_offset_after_newline(l_parts: List[bytes], l_newlines_per_outside_part: List[int], index_first_outside_part: int, is_first_newline: bool) -> int:
+    """ the offset in the block after the first or the last newline outside of quotes """
+    l_is_newline_in_outside_part = [bool(number_of_newlines) for number_of_newlines in l_newlines_per_outside_part]
+    if is_first_newline:
+        index_outside_part = l_is_newline_in_outside_part.index(True)
+    else:
+        index_outside_part = len(l_is_newline_in_outside_part) - 1 - l_is_newline_in_outside_part[::-1].index(True)
+    index_part = index_first_outside_part + 2 * index_outside_part
+    part = l_parts[index_part]
+    index_newline = part.index(b'\n') if is_first_newline else part.rindex(b'\n')
+    # every part before is followed by one quotechar
+    return sum(map(len, l_parts[:index_part])) + index_part + index_newline + 1
+
+
+def _add_records(profile: CsvFileProfile, l_lines: List[bytes], number_of_bytes: int, number_of_multiline_records: int,
+                 b_delimiter: bytes, is_fields_counted: bool = True) -> None:
+    """ adds the records of the lines outside of quotes, an empty line is a record without fields """
+    number_of_records = len(l_lines)
+    number_of_empty_records = l_lines.count(b'') + l_lines.count(b'\r')
+    profile.number_of_records = number_of_records
+    profile.number_of_empty_records = number_of_empty_records
+    profile.number_of_multiline_records = number_of_multiline_records
+    profile.number_of_bytes = number_of_bytes
+    if not is_fields_counted or not number_of_records:
+        return
+    if number_of_records == number_of_empty_records:
+        profile.min_fields = profile.max_fields = 0
+        return
+    l_number_of_delimiters = list(map(bytes.count, l_lines, itertools.repeat(b_delimiter)))
+    profile.min_fields = 0 if number_of_empty_records else min(l_number_of_delimiters) + 1
+    profile.max_fields = max(l_number_of_delimiters) + 1
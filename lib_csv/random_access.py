@@ -0,0 +1,291 @@
+# STDLIB
+import collections
+import csv
+import io
+import itertools
+import math
+import pathlib
+import random
+import re
+from typing import Any, Dict, IO, Iterable, List, Optional, Tuple
+
+# PROJ
+try:
+    from .bytes_reader import check_ascii_compatible_encoding
+    from .lib_csv import read_csv_file_header
+    from .parser_engine import FAST_ENGINE_QUOTING, FastCsvReader
+    from .schema import compile_row_builder
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from bytes_reader import check_ascii_compatible_encoding     # type: ignore  # pragma: no cover
+    from lib_csv import read_csv_file_header                     # type: ignore  # pragma: no cover
+    from parser_engine import FAST_ENGINE_QUOTING, FastCsvReader  # type: ignore  # pragma: no cover
+    from schema import compile_row_builder                       # type: ignore  # pragma: no cover
+
+
+def read_csv_file_tail(path_csv_file: pathlib.Path,
+                       number_of_rows: int = 10,
+                       encoding: str = "ISO-8859-1",
+                       delimiter: str = ";",
+                       quotechar: str = '"',
+                       quoting: int = csv.QUOTE_MINIMAL,
+                       doublequote: bool = True,
+                       check_row_length: bool = True,
+                       escapechar: Optional[str] = None,
+                       block_size: int = 64 * 1024) -> 'List[Dict[str, str]]':
+    """
+    returns the last number_of_rows rows of the csv file, like read_csv_file_with_header_to_list_of_dicts(...)[-number_of_rows:]
+
+    the file is scanned backwards from the end in blocks of block_size bytes : a newline starts a record,
+    if the number of quotechars after it is even. only the records after that position are parsed.
+    the whole file is read forward, if the scan is not possible : an escapechar, \\r line endings or an encoding which is not ascii compatible,
+    or if the records after that position are not consistent : a quotechar in an unquoted field, or a row length different from the header.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile1 = test_directory / '2018-06-06_active_qty.csv'
+    >>> testfile2 = test_directory / 'eBay-active-listing-wrong_doublequote.csv'
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+
+    >>> # Test OK
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile1)
+    >>> read_csv_file_tail(testfile1, number_of_rows=3, block_size=100) == l_dict_data[-3:]
+    True
+    >>> read_csv_file_tail(testfile1, number_of_rows=5000) == l_dict_data
+    True
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile2, encoding='utf-8-sig', check_row_length=False)
+    >>> read_csv_file_tail(testfile2, number_of_rows=2, encoding='utf-8-sig', check_row_length=False) == l_dict_data[-2:]
+    True
+
+    >>> # Test a stray quotechar, the quotes after the newline in the quoted field are even
+    >>> path_test_file = test_directory / 'random_access_tail_test.csv'
+    >>> _ = path_test_file.write_bytes(b'h1;h2\\na;b\\n"m\\nn";b"c\\n')
+    >>> read_csv_file_tail(path_test_file, number_of_rows=1)
+    [{'h1': 'm\\nn', 'h2': 'b"c'}]
+    >>> path_test_file.unlink()
+
+    """
+    fieldnames = read_csv_file_header(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                      doublequote=doublequote, escapechar=escapechar)
+    dict_csv_kwargs = dict(delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote, escapechar=escapechar)
+    if number_of_rows <= 0:
+        return []
+
+    with open(str(path_csv_file), 'rb') as f_binary_file:
+        offset = None
+        if _is_backward_scan_possible(encoding, dict_csv_kwargs):
+            b_quotechar = quotechar.encode('ascii') if quotechar and quoting != csv.QUOTE_NONE else None
+            offset = _find_offset_of_last_records(f_binary_file, number_of_rows, b_quotechar, block_size)
+        if offset is not None:
+            f_binary_file.seek(offset)
+            f_text_file = io.TextIOWrapper(f_binary_file, encoding=encoding, newline=None)
+            text = f_text_file.read()
+            f_text_file.detach()
+            if _is_quoting_consistent(text, dict_csv_kwargs):
+                l_rows = list(_get_raw_reader(io.StringIO(text), dict_csv_kwargs))
+                if len(l_rows) == number_of_rows and all(len(row) == len(fieldnames) for row in l_rows):
+                    return _build_rows(l_rows, fieldnames, path_csv_file, check_row_length)
+
+    # read forward
+    with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
+        raw_reader = _get_raw_reader(f_csv_file, dict_csv_kwargs, skip_records=1)
+        l_rows = list(collections.deque(raw_reader, maxlen=number_of_rows))
+    return _build_rows(l_rows, fieldnames, path_csv_file, check_row_length)
+
+
+def read_csv_file_rows(path_csv_file: pathlib.Path,
+                       start: int = 0,
+                       stop: Optional[int] = None,
+                       encoding: str = "ISO-8859-1",
+                       delimiter: str = ";",
+                       quotechar: str = '"',
+                       quoting: int = csv.QUOTE_MINIMAL,
+                       doublequote: bool = True,
+                       check_row_length: bool = True,
+                       escapechar: Optional[str] = None) -> 'List[Dict[str, str]]':
+    """
+    returns the rows start to stop (without the header, 0 based), like read_csv_file_with_header_to_list_of_dicts(...)[start:stop]
+    the rows before start are skipped with FastCsvReader - the lines of blocks without quotes are not even split.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile1 = test_directory / '2018-06-06_active_qty.csv'
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile1)
+
+    >>> # Test OK
+    >>> read_csv_file_rows(testfile1, start=1000, stop=1003) == l_dict_data[1000:1003]
+    True
+    >>> read_csv_file_rows(testfile1, start=1460) == l_dict_data[1460:]
+    True
+
+    >>> # Test Number of Fields less as in Header
+    >>> read_csv_file_rows(test_directory / 'csv_file_broken_less_fields_than_header.csv', start=0, stop=1)
+    Traceback (most recent call last):
+        ...
+    ValueError: csv file "...": header has 4 rows, current row has 3 rows: Header: ['a', 'b', 'c', 'd'], current Row: ['1', '2', '3']
+
+    >>> # Test negative start
+    >>> read_csv_file_rows(testfile1, start=-3)
+    Traceback (most recent call last):
+        ...
+    ValueError: start and stop must not be negative, use read_csv_file_tail for the last rows
+
+    """
+    if start < 0 or (stop is not None and stop < 0):
+        raise ValueError('start and stop must not be negative, use read_csv_file_tail for the last rows')
+    fieldnames = read_csv_file_header(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                      doublequote=doublequote, escapechar=escapechar)
+    dict_csv_kwargs = dict(delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote, escapechar=escapechar)
+    with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
+        raw_reader = _get_raw_reader(f_csv_file, dict_csv_kwargs, skip_records=start + 1)
+        number_of_rows = None if stop is None else max(stop - start, 0)
+        l_rows = list(itertools.islice(raw_reader, number_of_rows))
+    return _build_rows(l_rows, fieldnames, path_csv_file, check_row_length)
+
+
+def read_csv_file_sample(path_csv_file: pathlib.Path,
+                         number_of_rows: int = 10,
+                         seed: Any = None,
+                         encoding: str = "ISO-8859-1",
+                         delimiter: str = ";",
+                         quotechar: str = '"',
+                         quoting: int = csv.QUOTE_MINIMAL,
+                         doublequote: bool = True,
+                         check_row_length: bool = True,
+                         escapechar: Optional[str] = None) -> 'List[Dict[str, str]]':
+    """
+    returns a uniform random sample of number_of_rows rows in the order of the file - the same sample for the same seed.
+    reservoir sampling (algorithm L) in one pass : the rows between the selected rows are skipped, the dicts are built only for the sample.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile1 = test_directory / '2018-06-06_active_qty.csv'
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_dicts(path_csv_file=testfile1)
+
+    >>> # Test OK
+    >>> l_sample = read_csv_file_sample(testfile1, number_of_rows=5, seed=42)
+    >>> len(l_sample), l_sample == read_csv_file_sample(testfile1, number_of_rows=5, seed=42)
+    (5, True)
+    >>> l_indexes = [l_dict_data.index(dict_row) for dict_row in l_sample]
+    >>> l_indexes == sorted(l_indexes)
+    True
+    >>> read_csv_file_sample(testfile1, number_of_rows=5000) == l_dict_data
+    True
+
+    """
+    fieldnames = read_csv_file_header(path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                      doublequote=doublequote, escapechar=escapechar)
+    dict_csv_kwargs = dict(delimiter=delimiter, quotechar=quotechar, quoting=quoting, doublequote=doublequote, escapechar=escapechar)
+    if number_of_rows <= 0:
+        return []
+    random_generator = random.Random(seed)
+
+    with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
+        raw_reader = iter(_get_raw_reader(f_csv_file, dict_csv_kwargs, skip_records=1))
+        l_reservoir = list(enumerate(itertools.islice(raw_reader, number_of_rows)))     # type: List[Tuple[int, List[str]]]
+        index = len(l_reservoir) - 1
+        weight = math.exp(math.log(1.0 - random_generator.random()) / number_of_rows)
+        while len(l_reservoir) == number_of_rows:
+            number_of_rows_to_skip = math.floor(math.log(1.0 - random_generator.random()) / math.log(1.0 - weight))
+            row = next(itertools.islice(raw_reader, number_of_rows_to_skip, None), None)
+            if row is None:
+                break
+            index += number_of_rows_to_skip + 1
+            l_reservoir[random_generator.randrange(number_of_rows)] = (index, row)
+            weight *= math.exp(math.log(1.0 - random_generator.random()) / number_of_rows)
+
+    l_rows = [row for _, row in sorted(l_reservoir, key=lambda index_row: index_row[0])]
+    return _build_rows(l_rows, fieldnames, path_csv_file, check_row_length)
+
+
+def _get_raw_reader(f_csv_file: IO[str], dict_csv_kwargs: Dict[str, Any], skip_records: int = 0) -> Iterable[List[str]]:
+    if dict_csv_kwargs['quoting'] in FAST_ENGINE_QUOTING:
+        return FastCsvReader(f_csv_file, skip_records=skip_records, **dict_csv_kwargs)
+    return itertools.islice(csv.reader(f_csv_file, **dict_csv_kwargs), skip_records, None)
+
+
+def _build_rows(l_rows: List[List[str]], fieldnames: List[str], path_csv_file: pathlib.Path, check_row_length: bool) -> 'List[Dict[str, str]]':
+    """ the rows as read_csv_file_with_header_to_iterator_of_dicts builds them - without schema, so the line number is not needed """
+    build_row = compile_row_builder(fieldnames, source=str(path_csv_file))
+    len_of_header_rows = len(fieldnames)
+    l_dict_data = list()
+    for row in l_rows:
+        len_current_row = len(row)
+        if check_row_length and len_current_row != len_of_header_rows:
+            raise ValueError(f'csv file "{path_csv_file}": header has {len_of_header_rows} rows,'
+                             f' current row has {len_current_row} rows: Header: {fieldnames}, current Row: {row}')
+        l_dict_data.append(build_row(row, 0))
+    return l_dict_data
+
+
+def _is_backward_scan_possible(encoding: str, dict_csv_kwargs: Dict[str, Any]) -> bool:
+    """ the quotechars toggle the quoting state, and the bytes of newline and quotechar can be found in the raw file """
+    if dict_csv_kwargs['escapechar'] or dict_csv_kwargs['quoting'] not in FAST_ENGINE_QUOTING:
+        return False
+    try:
+        check_ascii_compatible_encoding(encoding, dict_csv_kwargs['delimiter'] + (dict_csv_kwargs['quotechar'] or ''))
+    except ValueError:
+        return False
+    return True
+
+
+def _is_quoting_consistent(text: str, dict_csv_kwargs: Dict[str, Any]) -> bool:
+    """
+    True if the quotechars of the records are only around quoted fields (and doubled within), like csv.writer writes them -
+    a stray quotechar means the quote parity of the backward scan can be wrong
+
+    >>> dict_csv_kwargs = dict(delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL, doublequote=True, escapechar=None)
+    >>> _is_quoting_consistent('a;"b\\n""c"";d"\\n;\\n', dict_csv_kwargs), _is_quoting_consistent('n";b\\n', dict_csv_kwargs)
+    (True, False)
+    """
+    quotechar = dict_csv_kwargs['quotechar']
+    if not quotechar or dict_csv_kwargs['quoting'] == csv.QUOTE_NONE:
+        return True
+    q, d = re.escape(quotechar), re.escape(dict_csv_kwargs['delimiter'])
+    quoted_field = f'{q}(?:[^{q}]|{q}{q})*{q}' if dict_csv_kwargs['doublequote'] else f'{q}[^{q}]*{q}'
+    field = f'(?:{quoted_field}|[^{q}{d}\\n]*)'
+    return re.fullmatch(f'(?:{field}(?:{d}{field})*\\n)*(?:{field}(?:{d}{field})*)?', text) is not None
+
+
+def _find_offset_of_last_records(f_binary_file: IO[bytes], number_of_records: int, b_quotechar: Optional[bytes], block_size: int) -> Optional[int]:
+    """
+    returns the byte offset of the start of the last number_of_records records,
+    or None if the file has not more records (including the header), or contains \\r line endings
+
+    >>> _find_offset_of_last_records(io.BytesIO(b'h1;h2\\na;"b\\nc"\\nd;e\\n'), 2, b'"', block_size=4)
+    6
+    >>> _find_offset_of_last_records(io.BytesIO(b'h1;h2\\na;"b\\nc"\\nd;e'), 3, b'"', block_size=4) is None
+    True
+    """
+    size = f_binary_file.seek(0, io.SEEK_END)
+    position = size
+    number_of_quotes = 0            # after the current position
+    number_of_records_found = 0
+    previous_block = b''
+    while position > 0:
+        block_start = max(0, position - block_size)
+        f_binary_file.seek(block_start)
+        block = f_binary_file.read(position - block_start)
+        number_of_cr_lf = block.count(b'\r\n') + (1 if block.endswith(b'\r') and previous_block.startswith(b'\n') else 0)
+        if block.count(b'\r') != number_of_cr_lf:
+            return None
+
+        index = len(block)
+        while True:
+            index_newline = block.rfind(b'\n', 0, index)
+            if b_quotechar is not None:
+                number_of_quotes += block.count(b_quotechar, index_newline + 1, index)
+            if index_newline < 0:
+                break
+            index = index_newline
+            offset = block_start + index_newline + 1
+            # the newline at the end of the file terminates the last record, a newline within quotes is part of a field
+            if offset < size and number_of_quotes % 2 == 0:
+                number_of_records_found += 1
+                if number_of_records_found == number_of_records:
+                    return offset
+        position = block_start
+        previous_block = block
+    return None
@@ -0,0 +1,395 @@
+# STDLIB
+from collections import OrderedDict
+import datetime
+import decimal
+import functools
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Type
+
+
+Converter = Callable[[str], Any]
+RowBuilder = Callable[[List[str], int], Any]
+Formatter = Callable[[Any], str]
+RowSerializer = Callable[[Sequence[Any]], List[str]]
+
+
+def int_converter(thousands_separator: str = '') -> Converter:
+    """
+    returns a converter for integer fields
+
+    >>> int_converter()('42')
+    42
+    >>> int_converter(thousands_separator='.')('1.234')
+    1234
+    """
+    if not thousands_separator:
+        return int
+
+    def convert_int(value: str) -> int:
+        return int(value.replace(thousands_separator, ''))
+    return convert_int
+
+
+def float_converter(decimal_separator: str = '.', thousands_separator: str = '') -> Converter:
+    """
+    returns a converter for float fields
+
+    >>> float_converter()('1.5')
+    1.5
+    >>> float_converter(decimal_separator=',', thousands_separator='.')('7.017,50')
+    7017.5
+    """
+    if decimal_separator == '.' and not thousands_separator:
+        return float
+
+    def convert_float(value: str) -> float:
+        return float(_normalize_number(value, decimal_separator, thousands_separator))
+    return convert_float
+
+
+def decimal_converter(decimal_separator: str = '.', thousands_separator: str = '') -> Converter:
+    """
+    returns a converter for decimal fields, invalid values raise ValueError
+
+    >>> decimal_converter()('19.90')
+    Decimal('19.90')
+    >>> decimal_converter(decimal_separator=',', thousands_separator='.')('3.667,01')
+    Decimal('3667.01')
+    >>> decimal_converter()('abc')
+    Traceback (most recent call last):
+        ...
+    ValueError: invalid decimal literal: 'abc'
+    """
+    def convert_decimal(value: str) -> decimal.Decimal:
+        try:
+            return decimal.Decimal(_normalize_number(value, decimal_separator, thousands_separator))
+        except decimal.InvalidOperation:
+            raise ValueError(f'invalid decimal literal: {value!r}') from None
+    return convert_decimal
+
+
+def bool_converter(true_values: Iterable[str] = ('Ja', 'WAHR', 'True', '1'),
+                   false_values: Iterable[str] = ('Nein', 'FALSCH', 'False', '0')) -> Converter:
+    """
+    returns a converter for boolean fields with custom true/false tokens
+
+    >>> convert_bool = bool_converter()
+    >>> convert_bool('Ja'), convert_bool('Nein')
+    (True, False)
+    >>> convert_bool('vielleicht')
+    Traceback (most recent call last):
+        ...
+    ValueError: invalid boolean literal: 'vielleicht'
+    """
+    dict_tokens = dict()    # type: Dict[str, bool]
+    dict_tokens.update((token, False) for token in false_values)
+    dict_tokens.update((token, True) for token in true_values)
+
+    def convert_bool(value: str) -> bool:
+        try:
+            return dict_tokens[value]
+        except KeyError:
+            raise ValueError(f'invalid boolean literal: {value!r}') from None
+    return convert_bool
+
+
+def date_converter(date_format: str = '%Y-%m-%d') -> Converter:
+    """
+    returns a converter for date fields
+
+    >>> date_converter('%d.%m.%Y')('26.04.2018')
+    datetime.date(2018, 4, 26)
+    """
+    strptime = datetime.datetime.strptime
+
+    def convert_date(value: str) -> datetime.date:
+        return strptime(value, date_format).date()
+    return convert_date
+
+
+def nullable_converter(converter: Converter, null_values: Iterable[str] = ('',)) -> Converter:
+    """
+    wraps a converter, the null values are converted to None
+
+    >>> convert_nullable_int = nullable_converter(int)
+    >>> convert_nullable_int(''), convert_nullable_int('3')
+    (None, 3)
+    """
+    set_null_values = frozenset(null_values)
+
+    def convert_nullable(value: str) -> Any:
+        if value in set_null_values:
+            return None
+        return converter(value)
+    return convert_nullable
+
+
+def compile_row_builder(fieldnames: List[str],
+                        schema: Optional[Dict[str, Converter]] = None,
+                        dict_type: Type[Dict[str, Any]] = dict,
+                        source: str = '') -> RowBuilder:
+    """
+    compiles the schema once into a specialised function, which builds the row dict and converts the values in one step.
+    fields not in the schema are passed unchanged.
+    the returned function takes the row and the line number (for the error message) and returns the dict,
+    rows with a different length as the header are converted as far as the header reaches.
+
+    >>> build_row = compile_row_builder(['nr', 'price', 'publish'], {'price': decimal_converter(','), 'publish': bool_converter()})
+    >>> build_row(['HUB025', '19,90', 'Nein'], 2)
+    {'nr': 'HUB025', 'price': Decimal('19.90'), 'publish': False}
+    >>> build_row(['HUB025', '19,90'], 3)
+    {'nr': 'HUB025', 'price': Decimal('19.90')}
+
+    >>> # conversion errors are reported with line number and field name
+    >>> build_row(['HUB101', 'teuer', 'Ja'], 4)
+    Traceback (most recent call last):
+        ...
+    ValueError: csv file "", line 4, field "price": can not convert "teuer": invalid decimal literal: 'teuer'
+
+    >>> # fields of the schema must exist in the header
+    >>> compile_row_builder(['nr'], {'price': float})
+    Traceback (most recent call last):
+        ...
+    ValueError: Field "price" of the schema is not available in the header
+
+    >>> compile_row_builder(['a', 'b'], dict_type=OrderedDict)(['1', '2'], 2)
+    OrderedDict([('a', '1'), ('b', '2')])
+    """
+    if schema is None:
+        schema = dict()
+
+    for fieldname in schema:
+        if fieldname not in fieldnames:
+            raise ValueError(f'Field "{fieldname}" of the schema is not available in the header')
+
+    l_converters = [schema.get(fieldname) for fieldname in fieldnames]
+    number_of_fields = len(fieldnames)
+
+    def raise_conversion_error(row: List[str], line_num: int, exc: Exception) -> None:
+        for index, value in enumerate(row[:number_of_fields]):
+            converter = l_converters[index]
+            if converter is not None:
+                try:
+                    converter(value)
+                except Exception as exc_field:
+                    raise ValueError(f'csv file "{source}", line {line_num}, field "{fieldnames[index]}": '
+                                     f'can not convert "{value}": {exc_field}') from exc_field
+        raise exc       # pragma: no cover - the exception was not raised by a converter
+
+    def build_row_partial(row: List[str], line_num: int) -> Dict[str, Any]:
+        dict_row = dict_type()
+        try:
+            for index, value in enumerate(row[:number_of_fields]):
+                converter = l_converters[index]
+                dict_row[fieldnames[index]] = value if converter is None else converter(value)
+        except Exception as exc:
+            raise_conversion_error(row, line_num, exc)
+        return dict_row
+
+    namespace = {'dict_type': dict_type,
+                 'number_of_fields': number_of_fields,
+                 'build_row_partial': build_row_partial,
+                 'raise_conversion_error': raise_conversion_error}      # type: Dict[str, Any]
+    l_value_expressions = []
+    for index, fieldname in enumerate(fieldnames):
+        namespace[f'n{index}'] = fieldname
+        if l_converters[index] is None:
+            l_value_expressions.append(f'row[{index}]')
+        else:
+            namespace[f'c{index}'] = l_converters[index]
+            l_value_expressions.append(f'c{index}(row[{index}])')
+
+    if dict_type is dict:
+        # a dict display is the fastest way to build the row
+        l_body = ['return {' + ', '.join(f'n{index}: {value}' for index, value in enumerate(l_value_expressions)) + '}']
+    else:
+        # other mappings (OrderedDict) are faster filled item by item than constructed from pairs
+        l_body = ['dict_row = dict_type()']
+        l_body.extend(f'dict_row[n{index}] = {value}' for index, value in enumerate(l_value_expressions))
+        l_body.append('return dict_row')
+
+    l_source_code = ['def build_row(row, line_num=0):',
+                     '    if len(row) != number_of_fields:',
+                     '        return build_row_partial(row, line_num)',
+                     '    try:']
+    l_source_code.extend('        ' + line for line in l_body)
+    l_source_code.extend(['    except Exception as exc:',
+                          '        raise_conversion_error(row, line_num, exc)'])
+    source_code = '\n'.join(l_source_code) + '\n'
+    exec(source_code, namespace)
+    build_row = namespace['build_row']      # type: RowBuilder
+    return build_row
+
+
+def decimal_formatter(decimals: int = 2, decimal_separator: str = '.', thousands_separator: str = '') -> Formatter:
+    """
+    returns a formatter for int, float and Decimal values with a fixed number of decimals
+
+    >>> decimal_formatter()(19.9)
+    '19.90'
+    >>> decimal_formatter(decimal_separator=',', thousands_separator='.')(decimal.Decimal('7017.5'))
+    '7.017,50'
+    >>> decimal_formatter(decimals=0)(3)
+    '3'
+    >>> decimal_formatter(decimal_separator=',', thousands_separator=',')
+    Traceback (most recent call last):
+        ...
+    ValueError: the decimal separator and the thousands separator must be different, not ","
+    """
+    if decimal_separator == thousands_separator:
+        raise ValueError(f'the decimal separator and the thousands separator must be different, not "{decimal_separator}"')
+    format_spec = f',.{decimals}f' if thousands_separator else f'.{decimals}f'
+    if decimal_separator == '.' and thousands_separator in ('', ','):
+        return functools.partial(_format_decimal, format_spec)
+    translation = str.maketrans({'.': decimal_separator, ',': thousands_separator})
+    return functools.partial(_format_decimal_translated, format_spec, translation)
+
+
+def bool_formatter(true_token: str = 'Ja', false_token: str = 'Nein') -> Formatter:
+    """
+    returns a formatter for boolean fields with custom true/false tokens
+
+    >>> format_bool = bool_formatter()
+    >>> format_bool(True), format_bool(False)
+    ('Ja', 'Nein')
+    """
+    return functools.partial(_format_bool, true_token, false_token)
+
+
+def date_formatter(date_format: str = '%Y-%m-%d') -> Formatter:
+    """
+    returns a formatter for date and datetime fields
+
+    >>> date_formatter('%d.%m.%Y')(datetime.date(2018, 4, 26))
+    '26.04.2018'
+    """
+    return functools.partial(_format_date, date_format)
+
+
+def nullable_formatter(formatter: Formatter, null_token: str = '') -> Formatter:
+    """
+    wraps a formatter, None is formatted as the null token
+
+    >>> format_nullable_bool = nullable_formatter(bool_formatter(), null_token='NULL')
+    >>> format_nullable_bool(None), format_nullable_bool(True)
+    ('NULL', 'Ja')
+    """
+    return functools.partial(_format_nullable, formatter, null_token)
+
+
+def compile_row_serializer(fieldnames: List[str], output_schema: Optional[Dict[str, Formatter]] = None, null_token: str = '') -> RowSerializer:
+    """
+    compiles the output schema once into a specialised function, which formats the values of a row (a sequence in the order of the
+    fieldnames) into a list of str. values which are already str are passed unchanged, without calling the formatter.
+    the values of fields not in the schema are formatted with str(), None as null_token - the formatters of the schema get None
+    like any other value, wrap them with nullable_formatter for their own null token.
+    rows with a different length as the header are formatted as far as the header reaches, the other values with str().
+
+    >>> serialize_row = compile_row_serializer(['nr', 'price', 'publish', 'date'],
+    ...                                        {'price': decimal_formatter(decimal_separator=','), 'publish': bool_formatter(),
+    ...                                         'date': nullable_formatter(date_formatter('%d.%m.%Y'))})
+    >>> serialize_row(['HUB025', decimal.Decimal('19.9'), False, None])
+    ['HUB025', '19,90', 'Nein', '']
+    >>> serialize_row([25, '19,90', 'Ja', datetime.date(2018, 4, 26), 'x'])
+    ['25', '19,90', 'Ja', '26.04.2018', 'x']
+
+    >>> # the null token is only used for fields without a formatter
+    >>> compile_row_serializer(['nr', 'publish'], {'publish': bool_formatter()}, null_token='NULL')([None, None])
+    ['NULL', 'Nein']
+
+    >>> # formatting errors are reported with the field name
+    >>> serialize_row(['HUB101', 'teuer', True, 2018])
+    Traceback (most recent call last):
+        ...
+    ValueError: field "date": can not format "2018": 'int' object has no attribute 'strftime'
+
+    >>> # fields of the schema must exist in the header
+    >>> compile_row_serializer(['nr'], {'price': decimal_formatter()})
+    Traceback (most recent call last):
+        ...
+    ValueError: Field "price" of the schema is not available in the header
+    """
+    if output_schema is None:
+        output_schema = dict()
+
+    for fieldname in output_schema:
+        if fieldname not in fieldnames:
+            raise ValueError(f'Field "{fieldname}" of the schema is not available in the header')
+
+    def format_value(value: Any) -> str:
+        return null_token if value is None else str(value)
+
+    l_formatters = [output_schema.get(fieldname, format_value) for fieldname in fieldnames]
+    number_of_fields = len(fieldnames)
+
+    def raise_format_error(row: Sequence[Any], exc: Exception) -> None:
+        for index, value in enumerate(row[:number_of_fields]):
+            if value.__class__ is not str:
+                try:
+                    l_formatters[index](value)
+                except Exception as exc_field:
+                    raise ValueError(f'field "{fieldnames[index]}": can not format "{value}": {exc_field}') from exc_field
+        raise exc       # pragma: no cover - the exception was not raised by a formatter
+
+    def serialize_row_partial(row: Sequence[Any]) -> List[str]:
+        try:
+            l_values = [value if value.__class__ is str else formatter(value) for formatter, value in zip(l_formatters, row)]
+        except Exception as exc:
+            raise_format_error(row, exc)
+        l_values.extend(value if value.__class__ is str else format_value(value) for value in row[number_of_fields:])
+        return l_values
+
+    namespace = {'str': str,
+                 'number_of_fields': number_of_fields,
+                 'serialize_row_partial': serialize_row_partial,
+                 'raise_format_error': raise_format_error}      # type: Dict[str, Any]
+    l_value_expressions = []
+    for index, formatter in enumerate(l_formatters):
+        namespace[f'f{index}'] = formatter
+        l_value_expressions.append(f'v{index} if v{index}.__class__ is str else f{index}(v{index})')
+
+    l_source_code = ['def serialize_row(row):',
+                     '    if len(row) != number_of_fields:',
+                     '        return serialize_row_partial(row)',
+                     '    ' + ''.join(f'v{index}, ' for index in range(number_of_fields)) + '= row',
+                     '    try:',
+                     '        return [' + ', '.join(l_value_expressions) + ']',
+                     '    except Exception as exc:',
+                     '        raise_format_error(row, exc)']
+    if not number_of_fields:
+        l_source_code = ['def serialize_row(row):',
+                         '    return serialize_row_partial(row)']
+    source_code = '\n'.join(l_source_code) + '\n'
+    exec(source_code, namespace)
+    serialize_row = namespace['serialize_row']      # type: RowSerializer
+    return serialize_row
+
+
+def _normalize_number(value: str, decimal_separator: str, thousands_separator: str) -> str:
+    if thousands_separator:
+        value = value.replace(thousands_separator, '')
+    if decimal_separator != '.':
+        value = value.replace(decimal_separator, '.')
+    return value
+
+
+# the formatters are partials of module level functions, so an output schema can be pickled to worker processes
+def _format_decimal(format_spec: str, value: Any) -> str:
+    return format(value, format_spec)
+
+
+def _format_decimal_translated(format_spec: str, translation: Dict[int, str], value: Any) -> str:
+    return format(value, format_spec).translate(translation)
+
+
+def _format_bool(true_token: str, false_token: str, value: Any) -> str:
+    return true_token if value else false_token
+
+
+def _format_date(date_format: str, value: Any) -> str:
+    return str(value.strftime(date_format))
+
+
+def _format_nullable(formatter: Formatter, null_token: str, value: Any) -> str:
+    if value is None:
+        return null_token
+    return formatter(value)
@@ -0,0 +1,346 @@
+# STDLIB
+import array
+import csv
+import hashlib
+import itertools
+import json
+import pathlib
+import struct
+import sys
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from multiprocessing import resource_tracker
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:                                         # pragma: no cover
+    # python < 3.8
+    shared_memory = None    # type: ignore                  # pragma: no cover
+
+# PROJ
+try:
+    from .parser_engine import get_csv_reader
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from parser_engine import get_csv_reader      # type: ignore  # pragma: no cover
+
+
+# the block starts with the magic and the length of the json metadata, which holds the offsets of the arrays
+SHARED_TABLE_MAGIC = b'LIBCSV01'
+_HEADER_STRUCT = struct.Struct('<8sQ')
+
+_resource_tracker_lock = threading.Lock()
+
+
+class SharedCsvTable(object):
+    """
+    a csv table in one multiprocessing.shared_memory block, which other processes attach read-only by name -
+    created with load_csv_file_to_shared_memory, attached with attach_shared_csv_table.
+
+    the columns are stored as utf-8 data with an array of the offsets of the values, the key index is an open addressing
+    hash table of the row numbers, hashed with blake2b so it is the same in every process.
+    a lookup reads the shared memory directly and decodes only the values of the found row - nothing is copied per process.
+    the table is pickled as its name, so it can be passed to the workers of a process pool, which attach it.
+
+    the creator owns the block : close() and unlink() it when the workers are done, or use it as context manager.
+    the other processes only close() it. the views are read-only, but the memory itself is not protected by the operating system.
+    """
+
+    def __init__(self, shm: Any, is_owner: bool) -> None:
+        self._shm = shm
+        self.is_owner = is_owner
+        self._l_views = []                                  # type: List[memoryview]
+        try:
+            buffer = self._view(shm.buf)
+            magic, metadata_length = _HEADER_STRUCT.unpack_from(buffer)
+            if magic != SHARED_TABLE_MAGIC:
+                raise ValueError(f'shared memory "{shm.name}" does not contain a SharedCsvTable')
+            dict_metadata = json.loads(bytes(buffer[_HEADER_STRUCT.size:_HEADER_STRUCT.size + metadata_length]).decode('utf-8'))
+            # the positions in the metadata are relative to the start of the arrays, after the metadata
+            start = _get_aligned_size(_HEADER_STRUCT.size + metadata_length)
+            self.fieldnames = dict_metadata['fieldnames']       # type: List[str]
+            self.hash_by_fieldname = dict_metadata['hash_by_fieldname']     # type: str
+            self._number_of_rows = dict_metadata['number_of_rows']          # type: int
+            self._l_offsets = []                                # type: List[memoryview]
+            self._l_data = []                                   # type: List[memoryview]
+            for offsets_position, data_position, data_length in dict_metadata['columns']:
+                offsets_offset, data_offset = start + offsets_position, start + data_position
+                self._l_offsets.append(self._view(buffer[offsets_offset:offsets_offset + 8 * (self._number_of_rows + 1)].cast('Q')))
+                self._l_data.append(self._view(buffer[data_offset:data_offset + data_length]))
+            index_position, index_size = dict_metadata['index']
+            index_offset = start + index_position
+            self._index = self._view(buffer[index_offset:index_offset + 8 * index_size].cast('q'))
+            self._index_mask = index_size - 1
+            self._index_of_hash_field = self.fieldnames.index(self.hash_by_fieldname)
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def name(self) -> str:
+        return str(self._shm.name)
+
+    @property
+    def size(self) -> int:
+        return int(self._shm.size)
+
+    def __len__(self) -> int:
+        return self._number_of_rows
+
+    def __contains__(self, key: str) -> bool:
+        return self._find_row_number(key) >= 0
+
+    def __getitem__(self, key: str) -> Dict[str, str]:
+        row_number = self._find_row_number(key)
+        if row_number < 0:
+            raise KeyError(key)
+        return self.get_row(row_number)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row_number = self._find_row_number(key)
+        return self.get_row(row_number) if row_number >= 0 else default
+
+    def get_value(self, key: str, fieldname: str, default: Any = None) -> Any:
+        """ decodes only one value of the row """
+        row_number = self._find_row_number(key)
+        if row_number < 0:
+            return default
+        return self._get_value(self.fieldnames.index(fieldname), row_number)
+
+    def get_row(self, row_number: int) -> Dict[str, str]:
+        """ the row by its number in the csv file, starting with 0 for the first row after the header """
+        if not 0 <= row_number < self._number_of_rows:
+            raise IndexError('SharedCsvTable row number out of range')
+        return {fieldname: self._get_value(index_of_field, row_number) for index_of_field, fieldname in enumerate(self.fieldnames)}
+
+    def keys(self) -> Iterator[str]:
+        """ the keys in the order of the csv file """
+        for row_number in range(self._number_of_rows):
+            yield self._get_value(self._index_of_hash_field, row_number)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def close(self) -> None:
+        """ releases the views and closes the shared memory in this process """
+        for view in reversed(self._l_views):
+            view.release()
+        self._l_views = []
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """ frees the shared memory block - only the creator should call it, after the other processes are done """
+        self._shm.unlink()
+
+    def __enter__(self) -> 'SharedCsvTable':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+        if self.is_owner:
+            self.unlink()
+
+    def __del__(self) -> None:
+        # the views must be released before the shared memory is closed
+        if self._l_views:
+            self.close()
+
+    def __reduce__(self) -> Any:
+        return attach_shared_csv_table, (self.name, )
+
+    def __repr__(self) -> str:
+        return f'SharedCsvTable(name={self.name!r}, rows={self._number_of_rows}, fieldnames={self.fieldnames})'
+
+    def _view(self, view: memoryview) -> memoryview:
+        """ a read-only view, which is released on close """
+        view = view.toreadonly()
+        self._l_views.append(view)
+        return view
+
+    def _get_value(self, index_of_field: int, row_number: int) -> str:
+        offsets = self._l_offsets[index_of_field]
+        return str(self._l_data[index_of_field][offsets[row_number]:offsets[row_number + 1]], 'utf-8')
+
+    def _find_row_number(self, key: str) -> int:
+        """ the row number of the key, or -1 """
+        b_key = key.encode('utf-8')
+        index = self._index
+        offsets = self._l_offsets[self._index_of_hash_field]
+        data = self._l_data[self._index_of_hash_field]
+        slot = _get_key_hash(b_key) & self._index_mask
+        while True:
+            row_number = index[slot]
+            if row_number < 0:
+                return -1
+            if data[offsets[row_number]:offsets[row_number + 1]] == b_key:
+                return row_number
+            slot = (slot + 1) & self._index_mask
+
+
+def load_csv_file_to_shared_memory(path_csv_file: pathlib.Path,
+                                   hash_by_fieldname: str,
+                                   name: Optional[str] = None,
+                                   encoding: str = "ISO-8859-1",
+                                   delimiter: str = ";",
+                                   quotechar: str = '"',
+                                   quoting: int = csv.QUOTE_MINIMAL,
+                                   engine: str = 'auto') -> SharedCsvTable:
+    """
+    reads the csv file once into a new shared memory block (with the given name, or a generated one) and returns the SharedCsvTable,
+    which is owned by the calling process. the keys are the values of hash_by_fieldname, which must be unique.
+
+    >>> # setup
+    >>> import subprocess, sys
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_hashed_odict_of_odicts
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / '2018-04-26_alle_Navision_Artikel.csv'
+    >>> testfile_not_unique = test_directory / '0001_aktive_preis_qty.csv'
+
+    >>> # Test same rows as the hashed reader
+    >>> table = load_csv_file_to_shared_memory(testfile, hash_by_fieldname='Nr.')
+    >>> dict_data = read_csv_file_with_header_to_hashed_odict_of_odicts(testfile, hash_by_fieldname='Nr.')
+    >>> len(table) == len(dict_data), all(table[key] == dict(row) for key, row in dict_data.items()), list(table) == list(dict_data)
+    (True, True, True)
+    >>> table.get('not existing'), 'HUB025' in table, table.get_value('HUB025', 'Beschreibung')
+    (None, True, 'Arbeitsbühne APF-A-10-125, Höhe 10m, Cap. 125kg')
+
+    >>> # Test attach in another process
+    >>> code = f'import lib_csv; table = lib_csv.attach_shared_csv_table({table.name!r}); print(table.get_value("HUB025", "Nr.")); table.close()'
+    >>> subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, cwd=str(test_directory.parent), check=True).stdout.strip()
+    b'HUB025'
+    >>> table.close()
+    >>> table.unlink()
+
+    >>> # Test a wide table, with long metadata
+    >>> path_wide_file = test_directory / 'shared_table_wide_test.csv'
+    >>> _ = path_wide_file.write_text(';'.join(f'field_{index}' for index in range(60)) + '\\n' + ';'.join(map(str, range(60))) + '\\n')
+    >>> with load_csv_file_to_shared_memory(path_wide_file, hash_by_fieldname='field_0') as table:
+    ...     attached_table = attach_shared_csv_table(table.name)
+    ...     attached_table.get_value('0', 'field_59'), attached_table.get_row(0) == table['0']
+    ...     attached_table.close()
+    ('59', True)
+    >>> path_wide_file.unlink()
+
+    >>> # Test the keys must be unique
+    >>> load_csv_file_to_shared_memory(testfile_not_unique, hash_by_fieldname='CustomLabel')
+    Traceback (most recent call last):
+        ...
+    ValueError: Index is not unique, field: "CustomLabel", value: "HUB179"
+
+    """
+    if shared_memory is None:
+        raise RuntimeError('load_csv_file_to_shared_memory needs multiprocessing.shared_memory (python >= 3.8)')
+
+    fieldnames = []                                         # type: List[str]
+    ll_columns = []                                         # type: List[List[bytes]]
+    set_keys = set()                                        # type: Set[str]
+    with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
+        # the same checks as read_csv_file_with_header_to_hashed_odict_of_odicts
+        my_csv_reader = get_csv_reader(f_csv_file, engine=engine, delimiter=delimiter, quotechar=quotechar, quoting=quoting)
+        for row in my_csv_reader:
+            if not fieldnames:
+                fieldnames = row
+                if hash_by_fieldname not in fieldnames:
+                    raise ValueError('Field "{}" is not available, or the csv file does not have header information'.format(hash_by_fieldname))
+                index_of_hash_field = fieldnames.index(hash_by_fieldname)
+                ll_columns = [[] for _ in fieldnames]
+                continue
+            if len(row) != len(fieldnames):
+                raise ValueError('Row has length {} instead of {} : "{}"'.format(len(row), len(fieldnames), row))
+            if row[index_of_hash_field] in set_keys:
+                raise ValueError('Index is not unique, field: "{}", value: "{}"'.format(hash_by_fieldname, row[index_of_hash_field]))
+            set_keys.add(row[index_of_hash_field])
+            for l_column, value in zip(ll_columns, row):
+                l_column.append(value.encode('utf-8'))
+    if not fieldnames:
+        raise ValueError('Field "{}" is not available, or the csv file does not have header information'.format(hash_by_fieldname))
+    number_of_rows = len(ll_columns[0])
+    del set_keys
+    index = _build_key_index(ll_columns[index_of_hash_field])
+
+    # the layout : header, metadata, for every column the offsets and the data, the index - the arrays aligned to 8 bytes
+    l_blocks = []                                           # type: List[bytes]
+    l_columns_metadata = []
+    position = 0
+    for l_column in ll_columns:
+        offsets = array.array('Q', itertools.accumulate(itertools.chain((0, ), map(len, l_column))))
+        data = b''.join(l_column)
+        l_blocks.extend((offsets.tobytes(), data))
+        l_columns_metadata.append([position, position + len(l_blocks[-2]), len(data)])
+        position += len(l_blocks[-2]) + _get_aligned_size(len(data))
+        l_blocks.append(bytes(_get_aligned_size(len(data)) - len(data)))
+    index_position = position
+    l_blocks.append(index.tobytes())
+    position += len(l_blocks[-1])
+
+    # the positions are relative to the start of the arrays, so they do not depend on the length of the metadata
+    metadata = json.dumps({'fieldnames': fieldnames, 'hash_by_fieldname': hash_by_fieldname, 'number_of_rows': number_of_rows,
+                           'columns': l_columns_metadata, 'index': [index_position, len(index)]}).encode('utf-8')
+    start = _get_aligned_size(_HEADER_STRUCT.size + len(metadata))
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(start + position, 1))
+    try:
+        _HEADER_STRUCT.pack_into(shm.buf, 0, SHARED_TABLE_MAGIC, len(metadata))
+        shm.buf[_HEADER_STRUCT.size:_HEADER_STRUCT.size + len(metadata)] = metadata
+        shm.buf[start:start + position] = b''.join(l_blocks)
+        return SharedCsvTable(shm, is_owner=True)
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+
+def attach_shared_csv_table(name: str) -> SharedCsvTable:
+    """
+    attaches the SharedCsvTable with the name, created by load_csv_file_to_shared_memory in another process.
+    the block is not registered at the resource tracker of this process, which would remove it when this process ends.
+    before python 3.13 the registration of this block is skipped while it is attached, the other resources are registered
+    """
+    if shared_memory is None:
+        raise RuntimeError('attach_shared_csv_table needs multiprocessing.shared_memory (python >= 3.8)')
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)     # type: ignore
+    else:
+        # unregistering afterwards would also remove the registration of the creator, if the resource tracker is inherited by fork
+        with _resource_tracker_lock:
+            register = resource_tracker.register
+            attached_name = name.lstrip('/')
+
+            def register_other_resources(name: Any, rtype: str) -> None:
+                if rtype != 'shared_memory' or name.lstrip('/') != attached_name:
+                    register(name, rtype)
+
+            resource_tracker.register = register_other_resources
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+    try:
+        return SharedCsvTable(shm, is_owner=False)
+    except BaseException:
+        shm.close()
+        raise
+
+
+def _build_key_index(l_keys: List[bytes]) -> 'array.array[int]':
+    """ an open addressing hash table with linear probing of the row numbers of the unique keys, -1 is an empty slot - at most half full """
+    index_size = 8
+    while index_size < 2 * len(l_keys):
+        index_size *= 2
+    index_mask = index_size - 1
+    index = array.array('q', [-1]) * index_size
+    for row_number, b_key in enumerate(l_keys):
+        slot = _get_key_hash(b_key) & index_mask
+        while index[slot] >= 0:
+            slot = (slot + 1) & index_mask
+        index[slot] = row_number
+    return index
+
+
+def _get_key_hash(b_key: bytes) -> int:
+    """ the same in every process - unlike hash(), which is randomized per process """
+    return int.from_bytes(hashlib.blake2b(b_key, digest_size=8).digest(), 'little')
+
+
+def _get_aligned_size(size: int) -> int:
+    return (size + 7) // 8 * 8
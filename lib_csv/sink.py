@@ -0,0 +1,290 @@
+# STDLIB
+import csv
+import logging
+import pathlib
+import queue
+import threading
+import time
+from typing import Any, IO, Iterable, List, Optional, Sequence
+
+# PROJ
+try:
+    from .lib_csv import get_ebay_csv_rows_block
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import get_ebay_csv_rows_block      # type: ignore  # pragma: no cover
+
+
+logger = logging.getLogger()     # type: logging.Logger
+
+ENCODERS = ('csv', 'ebay')
+
+# the markers in the queue of the writer thread
+_CLOSE = object()
+
+
+class _RowBatch(list):
+    """ the rows of one put_many call, which are one item in the queue """
+
+
+class CsvSink(object):
+    """
+    a csv file which many threads can put rows into. one background thread takes the rows from a bounded queue,
+    encodes them in batches of up to batch_size rows with csv.writer or the eBay encoder, and writes them in large chunks.
+
+    put blocks while the queue holds max_queue_size items - the producers are slowed down to the speed of the disk.
+    put_many puts the rows as one item into the queue, which is much faster than many calls of put.
+    the file is flushed every flush_interval seconds, on flush() and on close().
+    if the writer thread fails (for instance a row which can not be encoded, or the disk is full), the rows in the queue are discarded
+    and put, flush and close raise RuntimeError with the original exception as cause.
+
+    encoder:
+        'csv'  : csv.writer with the encoding, delimiter, quotechar, quoting and lineterminator
+        'ebay' : the encoder of write_ll_data_to_csv_file_ebay, rows with a different length as the header (or the first row) are logged as warning
+    header: written as first row, the rows must have the same length - otherwise put raises ValueError.
+            with append=True the header is only written into an empty file
+
+    >>> # setup
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / 'sink_test.csv'
+
+    >>> # Test many producers
+    >>> def produce(sink, thread_index):
+    ...     for index in range(500):
+    ...         sink.put([thread_index, index, 'x;"y"'])
+    >>> with CsvSink(testfile, header=['thread', 'index', 'text'], max_queue_size=100, batch_size=64) as sink:
+    ...     l_threads = [threading.Thread(target=produce, args=(sink, thread_index)) for thread_index in range(4)]
+    ...     for thread in l_threads: thread.start()
+    ...     for thread in l_threads: thread.join()
+    >>> l_dict_data = read_csv_file_with_header_to_list_of_dicts(testfile)
+    >>> len(l_dict_data), sink.number_of_rows_written, l_dict_data[0]['text']
+    (2000, 2001, 'x;"y"')
+    >>> sorted(int(dict_row['index']) for dict_row in l_dict_data if dict_row['thread'] == '3') == list(range(500))
+    True
+
+    >>> # Test eBay encoder and flush
+    >>> sink = CsvSink(testfile, encoding='utf-8', encoder='ebay', header=['a', 'b'])
+    >>> sink.put_many([['φ', 'te"st'], [None, 1]])
+    >>> sink.flush()
+    >>> testfile.read_bytes()
+    b'a;b\\n\\xcf\\x86;"te""st"\\n;1\\n'
+    >>> sink.put([1])
+    Traceback (most recent call last):
+        ...
+    ValueError: row "[1]" has a different length as the header line
+    >>> sink.close()
+
+    >>> # Test append, without header and rows of another length as the first row
+    >>> import io
+    >>> log_stream = io.StringIO()
+    >>> log_handler = logging.StreamHandler(log_stream)
+    >>> logger.addHandler(log_handler)
+    >>> with CsvSink(testfile, encoding='utf-8', encoder='ebay', header=['a', 'b'], append=True) as sink:
+    ...     sink.put([2, 3])
+    >>> with CsvSink(testfile, encoding='utf-8', encoder='ebay', append=True) as sink:
+    ...     sink.put([4, 5])
+    ...     sink.flush()
+    ...     sink.put([6])
+    >>> logger.removeHandler(log_handler)
+    >>> testfile.read_bytes(), log_stream.getvalue()
+    (b'a;b\\n\\xcf\\x86;"te""st"\\n;1\\n2;3\\n4;5\\n6\\n', 'row [6] has a different length as the header line\\n')
+
+    >>> # Test error of the writer thread
+    >>> sink = CsvSink(testfile, encoding='ascii')
+    >>> sink.put(['φ'])
+    >>> sink.flush()
+    Traceback (most recent call last):
+        ...
+    RuntimeError: csv sink "...sink_test.csv" failed: 'ascii' codec can't encode character '\\u03c6' in position 0: ordinal not in range(128)
+    >>> sink.close()
+    Traceback (most recent call last):
+        ...
+    RuntimeError: csv sink "...sink_test.csv" failed: 'ascii' codec can't encode character '\\u03c6' in position 0: ordinal not in range(128)
+
+    >>> # Teardown
+    >>> testfile.unlink()
+
+    """
+
+    def __init__(self,
+                 path_csv_file: pathlib.Path,
+                 encoding: str = "ISO-8859-1",
+                 delimiter: str = ";",
+                 quotechar: str = '"',
+                 quoting: int = csv.QUOTE_MINIMAL,
+                 lineterminator: str = '\n',
+                 escapechar: Optional[str] = None,
+                 encoder: str = 'csv',
+                 header: Optional[List[str]] = None,
+                 append: bool = False,
+                 max_queue_size: int = 100000,
+                 batch_size: int = 10000,
+                 flush_interval: float = 1.0,
+                 buffer_size: int = 1024 * 1024) -> None:
+        if encoder not in ENCODERS:
+            raise ValueError(f'encoder must be "csv" or "ebay", not "{encoder}"')
+        self.path_csv_file = pathlib.Path(path_csv_file)
+        self.encoding = encoding
+        self.encoder = encoder
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.number_of_fields = len(header) if header is not None else None
+        self.number_of_rows_written = 0
+        self.exception = None                           # type: Optional[BaseException]
+        self.closed = False
+        self._queue = queue.Queue(maxsize=max_queue_size)  # type: queue.Queue[Any]
+        self._close_lock = threading.Lock()
+        # close waits for the puts which passed the check of closed, so no row is put behind the close marker
+        self._put_condition = threading.Condition()
+        self._number_of_active_puts = 0
+        # the reference for the row length of the eBay encoder without header : the first row written
+        self._number_of_fields_written = self.number_of_fields
+        is_header_needed = not (append and self.path_csv_file.is_file() and self.path_csv_file.stat().st_size > 0)
+
+        if encoder == 'csv':
+            self._f_csv_file = open(str(self.path_csv_file), 'a' if append else 'w', encoding=encoding, newline='',
+                                    buffering=buffer_size)     # type: IO[Any]
+            self._csv_writer = csv.writer(self._f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                          lineterminator=lineterminator, escapechar=escapechar)
+        else:
+            self._f_csv_file = open(str(self.path_csv_file), 'ab' if append else 'wb', buffering=buffer_size)
+            self._b_delimiter = delimiter.encode(encoding)
+            self._b_quotechar = quotechar.encode(encoding)
+            self._b_escapechar = (escapechar or quotechar).encode(encoding)
+            self._b_lineterminator = lineterminator.encode(encoding)
+
+        if header is not None and is_header_needed:
+            self._queue.put(header)
+        self._thread = threading.Thread(target=self._write_rows, name=f'CsvSink {self.path_csv_file.name}', daemon=True)
+        self._thread.start()
+
+    def put(self, row: Sequence[Any], timeout: Optional[float] = None) -> None:
+        """
+        puts a row into the queue, blocks while the queue is full - raises queue.Full if the timeout expires.
+        raises RuntimeError if the sink is closed or the writer thread failed
+        """
+        self._raise_if_failed()
+        if self.number_of_fields is not None and len(row) != self.number_of_fields:
+            raise ValueError(f'row "{row}" has a different length as the header line')
+        self._put(row, timeout)
+
+    def put_many(self, rows: Iterable[Sequence[Any]], timeout: Optional[float] = None) -> None:
+        """ puts the rows as one item into the queue, see put """
+        self._raise_if_failed()
+        row_batch = _RowBatch(rows)
+        if self.number_of_fields is not None:
+            for row in row_batch:
+                if len(row) != self.number_of_fields:
+                    raise ValueError(f'row "{row}" has a different length as the header line')
+        if row_batch:
+            self._put(row_batch, timeout)
+
+    def flush(self) -> None:
+        """ waits until the rows put so far are written and flushed to the file """
+        self._raise_if_failed()
+        if self.closed:
+            return
+        flushed_event = threading.Event()
+        self._queue.put(flushed_event)
+        while not flushed_event.wait(0.1):
+            if not self._thread.is_alive():
+                break
+        self._raise_if_failed()
+
+    def close(self) -> None:
+        """ writes the rows in the queue, stops the writer thread and closes the file """
+        with self._close_lock:
+            if not self.closed:
+                with self._put_condition:
+                    self.closed = True
+                    self._put_condition.wait_for(lambda: self._number_of_active_puts == 0)
+                self._queue.put(_CLOSE)
+                self._thread.join()
+                self._f_csv_file.close()
+        self._raise_if_failed()
+
+    def __enter__(self) -> 'CsvSink':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _put(self, item: Any, timeout: Optional[float]) -> None:
+        with self._put_condition:
+            if self.closed:
+                raise RuntimeError(f'csv sink "{self.path_csv_file}" is closed')
+            self._number_of_active_puts += 1
+        try:
+            self._queue.put(item, timeout=timeout)
+        finally:
+            with self._put_condition:
+                self._number_of_active_puts -= 1
+                self._put_condition.notify_all()
+
+    def _raise_if_failed(self) -> None:
+        if self.exception is not None:
+            raise RuntimeError(f'csv sink "{self.path_csv_file}" failed: {self.exception}') from self.exception
+
+    def _write_rows(self) -> None:
+        """ the writer thread """
+        get_row = self._queue.get
+        get_row_nowait = self._queue.get_nowait
+        time_last_flush = time.monotonic()
+        is_dirty = False
+        while True:
+            try:
+                item = get_row(timeout=max(self.flush_interval - (time.monotonic() - time_last_flush), 0.001) if is_dirty else None)
+            except queue.Empty:
+                item = None
+
+            # take the rows which are already in the queue, up to the batch size
+            l_rows = []         # type: List[Sequence[Any]]
+            l_markers = []      # type: List[Any]
+            while item is not None:
+                if item is _CLOSE or isinstance(item, threading.Event):
+                    l_markers.append(item)
+                    break
+                if isinstance(item, _RowBatch):
+                    l_rows.extend(item)
+                else:
+                    l_rows.append(item)
+                if len(l_rows) >= self.batch_size:
+                    break
+                try:
+                    item = get_row_nowait()
+                except queue.Empty:
+                    item = None
+
+            if self.exception is None:
+                try:
+                    if l_rows:
+                        self._write_batch(l_rows)
+                        is_dirty = True
+                    if is_dirty and (l_markers or time.monotonic() - time_last_flush >= self.flush_interval):
+                        self._f_csv_file.flush()
+                        time_last_flush = time.monotonic()
+                        is_dirty = False
+                except Exception as exc:
+                    logger.error(f'csv sink "{self.path_csv_file}" failed, the following rows are discarded: {exc}')
+                    self.exception = exc
+
+            for marker in l_markers:
+                if marker is _CLOSE:
+                    return
+                marker.set()
+
+    def _write_batch(self, l_rows: List[Any]) -> None:
+        if self.encoder == 'csv':
+            self._csv_writer.writerows(l_rows)
+        else:
+            if self._number_of_fields_written is None:
+                self._number_of_fields_written = len(l_rows[0])
+            block, l_index_wrong_length = get_ebay_csv_rows_block(l_rows, delimiter=self._b_delimiter, quotechar=self._b_quotechar,
+                                                                  escapechar=self._b_escapechar, lineterminator=self._b_lineterminator,
+                                                                  number_of_fields=self._number_of_fields_written,
+                                                                  encoding=self.encoding)
+            self._f_csv_file.write(block)
+            for index in l_index_wrong_length:
+                logger.warning(f'row {l_rows[index]} has a different length as the header line')
+        self.number_of_rows_written += len(l_rows)
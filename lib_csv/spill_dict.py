@@ -0,0 +1,230 @@
+# STDLIB
+import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import csv
+import pathlib
+import pickle
+import sys
+import tempfile
+from typing import Any, Callable, Dict, IO, Iterator, Optional, Tuple
+
+# PROJ
+try:
+    from .lib_csv import _read_csv_file_with_header_to_hashed_mapping
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import _read_csv_file_with_header_to_hashed_mapping      # type: ignore  # pragma: no cover
+
+
+# the estimated memory of one key in the index : the slot of the dict and the int of the row number, without the key itself
+BYTES_PER_KEY = 100
+
+
+class SpilledHashedDict(MutableMapping):    # type: ignore
+    """
+    a dict of rows, which keeps the rows in memory up to memory_budget bytes. the following rows are appended to a segment file
+    in a temporary directory (in path_spill_directory), only their keys and file offsets stay in memory.
+    the rows read from the segment file are kept in a LRU cache of cache_size rows.
+
+    the keys keep the order of insertion, like a dict. the memory of a row is estimated with sys.getsizeof of the row and its values,
+    the keys are always in memory. the spilled rows are returned as a new copy on every access, also from the cache -
+    changing it does not change the stored row, assign the changed row to store it.
+    a row which is replaced or deleted stays in the segment file until close(), which removes the temporary directory.
+    after close() the spilled rows can not be read or written any more, which raises ValueError.
+
+    >>> spilled_dict = SpilledHashedDict(memory_budget=5000, cache_size=2)
+    >>> for index in range(100): spilled_dict[str(index)] = OrderedDict([('nr', str(index)), ('text', 'x' * index)])
+    >>> 0 < spilled_dict.number_of_spilled_rows < 100, len(spilled_dict), list(spilled_dict)[:3]
+    (True, 100, ['0', '1', '2'])
+    >>> spilled_dict['99'] == OrderedDict([('nr', '99'), ('text', 'x' * 99)]), '100' in spilled_dict
+    (True, False)
+    >>> spilled_dict['50'] = OrderedDict([('nr', '50'), ('text', 'changed')])
+    >>> del spilled_dict['51']
+    >>> spilled_dict['50']['text'], spilled_dict.get('51'), len(spilled_dict)
+    ('changed', None, 99)
+
+    >>> # Test the spilled rows are copies, also from the cache
+    >>> spilled_dict['99']['text'] = 'lost'
+    >>> spilled_dict['99']['text'] == 'x' * 99
+    True
+
+    >>> # Test closed
+    >>> spilled_dict.close()
+    >>> spilled_dict['99']
+    Traceback (most recent call last):
+        ...
+    ValueError: SpilledHashedDict is closed
+
+    """
+
+    def __init__(self, memory_budget: int = 256 * 1024 * 1024, cache_size: int = 10000, path_spill_directory: Optional[pathlib.Path] = None,
+                 dict_type: Callable[..., Dict[str, Any]] = OrderedDict) -> None:
+        self.memory_budget = memory_budget
+        self.cache_size = cache_size
+        self.path_spill_directory = path_spill_directory
+        self.dict_type = dict_type
+        self.memory_size = 0
+        self.number_of_spilled_rows = 0
+        # {key: row in memory, or the number of the record in the segment file}
+        self._dict_index = dict()                           # type: Dict[Any, Any]
+        self._dict_sizes = dict()                           # type: Dict[Any, int]
+        self._dict_cache = OrderedDict()                    # type: OrderedDict[Any, Dict[str, Any]]
+        self._record_offsets = array.array('q', [0])        # the start of every record and the end of the last record
+        self._t_fieldnames = None                           # type: Optional[Tuple[str, ...]]
+        self._temporary_directory = None                    # type: Optional[tempfile.TemporaryDirectory[str]]
+        self._f_segment_file = None                         # type: Optional[IO[bytes]]
+        self._is_at_end_of_segment_file = True
+        self.closed = False
+
+    def __getitem__(self, key: Any) -> Dict[str, Any]:
+        value = self._dict_index[key]
+        if value.__class__ is not int:
+            return value                                    # type: ignore
+        dict_row = self._dict_cache.get(key)
+        if dict_row is not None:
+            self._dict_cache.move_to_end(key)
+        else:
+            dict_row = self._read_record(value)
+            self._dict_cache[key] = dict_row
+            if len(self._dict_cache) > self.cache_size:
+                self._dict_cache.popitem(last=False)
+        # a copy, so changes of the caller are not kept in the cache and lost on eviction
+        return self.dict_type(dict_row)
+
+    def __setitem__(self, key: Any, dict_row: Dict[str, Any]) -> None:
+        value = self._dict_index.get(key)
+        if value is None:
+            self.memory_size += BYTES_PER_KEY
+        elif value.__class__ is int:
+            self._dict_cache.pop(key, None)
+        else:
+            self.memory_size -= self._dict_sizes.pop(key)
+
+        # the size is not estimated when the memory is full
+        is_in_memory = self.memory_size < self.memory_budget and (value is None or value.__class__ is not int)
+        row_size = sys.getsizeof(dict_row) + sum(map(sys.getsizeof, dict_row.values())) if is_in_memory else 0
+        if is_in_memory and self.memory_size + row_size <= self.memory_budget:
+            self._dict_index[key] = dict_row
+            self._dict_sizes[key] = row_size
+            self.memory_size += row_size
+        else:
+            self._dict_index[key] = self._write_record(dict_row)
+            if value is None or value.__class__ is not int:
+                self.number_of_spilled_rows += 1
+
+    def __delitem__(self, key: Any) -> None:
+        value = self._dict_index.pop(key)
+        self.memory_size -= BYTES_PER_KEY
+        if value.__class__ is int:
+            self._dict_cache.pop(key, None)
+            self.number_of_spilled_rows -= 1
+        else:
+            self.memory_size -= self._dict_sizes.pop(key)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._dict_index
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._dict_index)
+
+    def __len__(self) -> int:
+        return len(self._dict_index)
+
+    def close(self) -> None:
+        """ closes and removes the segment file """
+        self.closed = True
+        self._dict_cache.clear()
+        if self._f_segment_file is not None:
+            self._f_segment_file.close()
+            self._f_segment_file = None
+        if self._temporary_directory is not None:
+            self._temporary_directory.cleanup()
+            self._temporary_directory = None
+
+    def __enter__(self) -> 'SpilledHashedDict':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f'SpilledHashedDict(rows={len(self._dict_index)}, spilled_rows={self.number_of_spilled_rows}, memory_size={self.memory_size})'
+
+    def _write_record(self, dict_row: Dict[str, Any]) -> int:
+        """ appends the row to the segment file, returns the number of the record """
+        if self.closed:
+            raise ValueError('SpilledHashedDict is closed')
+        if self._f_segment_file is None:
+            self._temporary_directory = tempfile.TemporaryDirectory(prefix='lib_csv_spill_', dir=self.path_spill_directory)
+            self._f_segment_file = open(str(pathlib.Path(self._temporary_directory.name) / 'rows.segment'), 'w+b')
+            self._t_fieldnames = tuple(dict_row)
+        # the rows with the fieldnames of the first spilled row are stored as tuple of the values
+        t_fieldnames = tuple(dict_row)
+        record = pickle.dumps(tuple(dict_row.values()) if t_fieldnames == self._t_fieldnames else dict(dict_row), pickle.HIGHEST_PROTOCOL)
+        if not self._is_at_end_of_segment_file:
+            # seek flushes the write buffer, so it is only called after a read
+            self._f_segment_file.seek(self._record_offsets[-1])
+            self._is_at_end_of_segment_file = True
+        self._f_segment_file.write(record)
+        self._record_offsets.append(self._record_offsets[-1] + len(record))
+        return len(self._record_offsets) - 2
+
+    def _read_record(self, record_number: int) -> Dict[str, Any]:
+        if self._f_segment_file is None:
+            raise ValueError('SpilledHashedDict is closed')
+        self._is_at_end_of_segment_file = False
+        self._f_segment_file.seek(self._record_offsets[record_number])
+        record = pickle.loads(self._f_segment_file.read(self._record_offsets[record_number + 1] - self._record_offsets[record_number]))
+        if isinstance(record, tuple):
+            return self.dict_type(zip(self._t_fieldnames or (), record))
+        return self.dict_type(record)
+
+
+def read_csv_file_with_header_to_spilled_hashed_dict(path_csv_file: pathlib.Path,
+                                                     hash_by_fieldname: str,
+                                                     memory_budget: int = 256 * 1024 * 1024,
+                                                     cache_size: int = 10000,
+                                                     path_spill_directory: Optional[pathlib.Path] = None,
+                                                     encoding: str = "ISO-8859-1",
+                                                     delimiter: str = ";",
+                                                     quotechar: str = '"',
+                                                     quoting: int = csv.QUOTE_MINIMAL,
+                                                     schema: Optional[Dict[str, Callable[[str], Any]]] = None,
+                                                     value_interner: Any = None,
+                                                     engine: str = 'auto') -> SpilledHashedDict:
+    """
+    like read_csv_file_with_header_to_hashed_odict_of_odicts, with the same order and the same checks of the row length and the
+    uniqueness of the index - but the rows which exceed the memory_budget are spilled to disk, see SpilledHashedDict.
+    close() the result to remove the segment file, or use it as context manager.
+
+    >>> # setup
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_hashed_odict_of_odicts
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / '2018-04-26_alle_Navision_Artikel.csv'
+    >>> testfile_not_unique = test_directory / '0001_aktive_preis_qty.csv'
+
+    >>> # Test same rows and order as the hashed reader
+    >>> with read_csv_file_with_header_to_spilled_hashed_dict(testfile, hash_by_fieldname='Nr.', memory_budget=1024 * 1024, cache_size=100) as dict_data:
+    ...     dict_expected = read_csv_file_with_header_to_hashed_odict_of_odicts(testfile, hash_by_fieldname='Nr.')
+    ...     list(dict_data) == list(dict_expected), all(dict_data[key] == row for key, row in dict_expected.items())
+    ...     dict_data.number_of_spilled_rows > 4000
+    (True, True)
+    True
+
+    >>> # Test index is not unique
+    >>> read_csv_file_with_header_to_spilled_hashed_dict(testfile_not_unique, hash_by_fieldname='CustomLabel', memory_budget=0)
+    Traceback (most recent call last):
+        ...
+    ValueError: Index is not unique, field: "CustomLabel", value: "HUB179"
+
+    """
+    dict_result = SpilledHashedDict(memory_budget=memory_budget, cache_size=cache_size, path_spill_directory=path_spill_directory)
+    try:
+        _read_csv_file_with_header_to_hashed_mapping(path_csv_file, hash_by_fieldname, dict_result, encoding=encoding, delimiter=delimiter,
+                                                     quotechar=quotechar, quoting=quoting, schema=schema, value_interner=value_interner,
+                                                     engine=engine)
+    except BaseException:
+        dict_result.close()
+        raise
+    return dict_result
@@ -0,0 +1,265 @@
+# STDLIB
+import csv
+import itertools
+import pathlib
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# PROJ
+try:
+    from .lib_csv import ls_rstrip_list, write_ll_data_to_csv_file
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from lib_csv import ls_rstrip_list, write_ll_data_to_csv_file      # type: ignore  # pragma: no cover
+
+
+IndexDefinition = Union[str, Sequence[str]]
+
+# tuned for a bulk load, only with is_bulk_load_unsafe=True : a crash during the load can corrupt the whole database,
+# not only the loaded table. the previous values are restored after the load
+BULK_LOAD_PRAGMAS = {'synchronous': 'OFF',
+                     'journal_mode': 'MEMORY',
+                     'temp_store': 'MEMORY',
+                     'cache_size': '-65536'}
+
+
+def load_csv_file_to_sqlite(path_csv_file: pathlib.Path,
+                            path_sqlite_file: pathlib.Path,
+                            table_name: str = 'csv_data',
+                            index_fieldnames: Iterable[IndexDefinition] = (),
+                            unique_index_fieldnames: Iterable[IndexDefinition] = (),
+                            batch_size: int = 10000,
+                            force: bool = False,
+                            encoding: str = "ISO-8859-1",
+                            delimiter: str = ";",
+                            quotechar: str = '"',
+                            quoting: int = csv.QUOTE_MINIMAL,
+                            doublequote: bool = True,
+                            escapechar: Optional[str] = None,
+                            is_bulk_load_unsafe: bool = False) -> bool:
+    """
+    streams the csv file into a table of the sqlite database, all columns are TEXT columns named like the header fields.
+    the rows are inserted with executemany in batches of batch_size, in one transaction.
+    the indexes are created after loading, an index definition is a fieldname or a sequence of fieldnames for a composite index.
+
+    the size and modification time of the csv file are stored in the table "lib_csv_sources" of the database,
+    the load is skipped if the csv file and the index definitions are unchanged (unless force=True).
+    is_bulk_load_unsafe: loads faster without journal and sync (see BULK_LOAD_PRAGMAS) - only for a database which can be rebuilt,
+                         because a crash during the load can corrupt the whole database
+
+    returns True if the table was loaded, False if it was up to date
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile = test_directory / '2018-06-06_active_qty.csv'
+    >>> testfile_broken = test_directory / 'csv_file_broken_less_fields_than_header.csv'
+    >>> path_sqlite_file = test_directory / 'sqlite_test.db'
+    >>> path_export_file = test_directory / 'sqlite_export_test.csv'
+
+    >>> # Test OK
+    >>> load_csv_file_to_sqlite(testfile, path_sqlite_file, table_name='active', index_fieldnames=['ItemID', 'CustomLabel'])
+    True
+    >>> query_sqlite_to_list_of_dicts(path_sqlite_file, 'SELECT ItemID, Quantity FROM active WHERE CustomLabel = ?', ('GEN232',))
+    [{'ItemID': '120724800937', 'Quantity': '0'}]
+
+    >>> # Test unchanged file is not loaded again
+    >>> load_csv_file_to_sqlite(testfile, path_sqlite_file, table_name='active', index_fieldnames=['ItemID', 'CustomLabel'])
+    False
+
+    >>> # Test export through the csv writer
+    >>> write_sqlite_query_to_csv_file(path_sqlite_file, 'SELECT ItemID, CustomLabel FROM active WHERE CustomLabel LIKE ? ORDER BY ItemID',
+    ...                                path_export_file, parameters=('GEN23%', ))
+    >>> path_export_file.read_text(encoding='ISO-8859-1')
+    'ItemID;CustomLabel\\n120724800937;GEN232\\n132034340884;GEN231\\n'
+
+    >>> # Test unique index
+    >>> load_csv_file_to_sqlite(testfile, path_sqlite_file, table_name='active_unique', unique_index_fieldnames=['ItemID'])
+    Traceback (most recent call last):
+        ...
+    ValueError: Index is not unique, fields: ['ItemID']
+
+    >>> # Test unique and non unique index on the same fields, bulk load pragmas are restored
+    >>> load_csv_file_to_sqlite(path_export_file, path_sqlite_file, table_name='both', index_fieldnames=['CustomLabel'],
+    ...                         unique_index_fieldnames=['CustomLabel'], is_bulk_load_unsafe=True)
+    True
+    >>> query_sqlite_to_list_of_dicts(path_sqlite_file, "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'both' ORDER BY name")
+    [{'name': 'idx_both_CustomLabel'}, {'name': 'uq_both_CustomLabel'}]
+    >>> query_sqlite_to_list_of_dicts(path_sqlite_file, 'PRAGMA journal_mode')
+    [{'journal_mode': 'delete'}]
+
+    >>> # Test duplicate header field - sqlite column names are not case sensitive
+    >>> path_duplicate_header_file = test_directory / 'sqlite_duplicate_header_test.csv'
+    >>> _ = path_duplicate_header_file.write_text('nr;Text;text\\n1;a;b\\n')
+    >>> load_csv_file_to_sqlite(path_duplicate_header_file, path_sqlite_file, table_name='duplicate')
+    Traceback (most recent call last):
+        ...
+    ValueError: csv file ".../sqlite_duplicate_header_test.csv": header field "text" is not unique
+
+    >>> # Test empty file
+    >>> _ = path_duplicate_header_file.write_text('')
+    >>> load_csv_file_to_sqlite(path_duplicate_header_file, path_sqlite_file, table_name='duplicate')
+    Traceback (most recent call last):
+        ...
+    ValueError: csv file ".../sqlite_duplicate_header_test.csv" does not have header information
+    >>> path_duplicate_header_file.unlink()
+
+    >>> # Test composite index on a not existing field
+    >>> load_csv_file_to_sqlite(testfile, path_sqlite_file, table_name='active', index_fieldnames=[('CustomLabel', 'not_existing')])
+    Traceback (most recent call last):
+        ...
+    ValueError: Field "not_existing" is not available, or the csv file does not have header information
+
+    >>> # Test Number of Fields less as in Header
+    >>> load_csv_file_to_sqlite(testfile_broken, path_sqlite_file, table_name='broken')
+    Traceback (most recent call last):
+        ...
+    ValueError: csv file ".../csv_file_broken_less_fields_than_header.csv", line 2: header has 4 fields, current row has 3 fields
+
+    >>> # Teardown
+    >>> path_sqlite_file.unlink()
+    >>> path_export_file.unlink()
+
+    """
+    l_index_definitions = [(_get_index_fieldnames(index_definition), False) for index_definition in index_fieldnames]
+    l_index_definitions += [(_get_index_fieldnames(index_definition), True) for index_definition in unique_index_fieldnames]
+    stat_csv_file = pathlib.Path(path_csv_file).stat()
+    source_signature = (str(pathlib.Path(path_csv_file).absolute()), stat_csv_file.st_size, stat_csv_file.st_mtime_ns, repr(l_index_definitions))
+
+    connection = sqlite3.connect(str(path_sqlite_file), isolation_level=None)
+    try:
+        connection.execute('CREATE TABLE IF NOT EXISTS lib_csv_sources '
+                           '(table_name TEXT PRIMARY KEY, path TEXT, size INTEGER, mtime_ns INTEGER, index_definitions TEXT)')
+        stored_signature = connection.execute('SELECT path, size, mtime_ns, index_definitions FROM lib_csv_sources WHERE table_name = ?',
+                                              (table_name, )).fetchone()
+        if not force and stored_signature == source_signature:
+            return False
+
+        dict_previous_pragmas = dict()                      # type: Dict[str, Any]
+        if is_bulk_load_unsafe:
+            for pragma_name, value in BULK_LOAD_PRAGMAS.items():
+                dict_previous_pragmas[pragma_name] = connection.execute(f'PRAGMA {pragma_name}').fetchone()[0]
+                connection.execute(f'PRAGMA {pragma_name} = {value}')
+        try:
+            _load_csv_file_to_table(connection, path_csv_file, table_name, l_index_definitions, source_signature, batch_size,
+                                    encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                    doublequote=doublequote, escapechar=escapechar)
+        finally:
+            for pragma_name, value in dict_previous_pragmas.items():
+                connection.execute(f'PRAGMA {pragma_name} = {value}')
+        return True
+    finally:
+        connection.close()
+
+
+def _load_csv_file_to_table(connection: sqlite3.Connection, path_csv_file: pathlib.Path, table_name: str,
+                            l_index_definitions: List[Tuple[List[str], bool]], source_signature: Tuple[Any, ...], batch_size: int,
+                            encoding: str, delimiter: str, quotechar: str, quoting: int, doublequote: bool, escapechar: Optional[str]) -> None:
+    """ replaces the table with the rows of the csv file and creates the indexes, in one transaction """
+    with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
+        my_csv_reader = csv.reader(f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                   doublequote=doublequote, escapechar=escapechar)
+        # like read_csv_file_with_header_to_list_of_dicts, without empty header fields at the end
+        fieldnames = ls_rstrip_list(next(my_csv_reader, []))
+        _check_header(fieldnames, path_csv_file)
+        number_of_fields = len(fieldnames)
+        for l_index_fieldnames, _ in l_index_definitions:
+            for fieldname in l_index_fieldnames:
+                if fieldname not in fieldnames:
+                    raise ValueError(f'Field "{fieldname}" is not available, or the csv file does not have header information')
+
+        quoted_table_name = _quote_identifier(table_name)
+        connection.execute('BEGIN')
+        try:
+            connection.execute(f'DROP TABLE IF EXISTS {quoted_table_name}')
+            connection.execute(f'CREATE TABLE {quoted_table_name} ({", ".join(_quote_identifier(fieldname) + " TEXT" for fieldname in fieldnames)})')
+            sql_insert = f'INSERT INTO {quoted_table_name} VALUES ({", ".join("?" * number_of_fields)})'
+
+            def checked_rows() -> Iterable[List[str]]:
+                for row in my_csv_reader:
+                    if len(row) != number_of_fields:
+                        raise ValueError(f'csv file "{path_csv_file}", line {my_csv_reader.line_num}: '
+                                         f'header has {number_of_fields} fields, current row has {len(row)} fields')
+                    yield row
+
+            it_rows = iter(checked_rows())
+            while True:
+                l_batch = list(itertools.islice(it_rows, batch_size))
+                if not l_batch:
+                    break
+                connection.executemany(sql_insert, l_batch)
+
+            for l_index_fieldnames, is_unique in l_index_definitions:
+                index_name = _quote_identifier(('uq_' if is_unique else 'idx_') + table_name + '_' + '_'.join(l_index_fieldnames))
+                try:
+                    connection.execute(f'CREATE {"UNIQUE " if is_unique else ""}INDEX {index_name} ON {quoted_table_name} '
+                                       f'({", ".join(_quote_identifier(fieldname) for fieldname in l_index_fieldnames)})')
+                except sqlite3.IntegrityError:
+                    raise ValueError(f'Index is not unique, fields: {l_index_fieldnames}') from None
+
+            connection.execute('INSERT OR REPLACE INTO lib_csv_sources VALUES (?, ?, ?, ?, ?)', (table_name, ) + source_signature)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+
+def query_sqlite_to_list_of_dicts(path_sqlite_file: pathlib.Path, query: str, parameters: Sequence[Any] = ()) -> 'List[Dict[str, Any]]':
+    """
+    runs the query and returns the result rows as dicts, the keys are the column names of the result
+    """
+    header, l_rows = _query_sqlite(path_sqlite_file, query, parameters)
+    return [dict(zip(header, row)) for row in l_rows]
+
+
+def write_sqlite_query_to_csv_file(path_sqlite_file: pathlib.Path,
+                                   query: str,
+                                   path_csv_file: pathlib.Path,
+                                   parameters: Sequence[Any] = (),
+                                   encoding: str = "ISO-8859-1",
+                                   delimiter: str = ";",
+                                   quotechar: str = '"',
+                                   quoting: int = csv.QUOTE_MINIMAL) -> None:
+    """
+    runs the query and writes the result with the column names as header line with write_ll_data_to_csv_file
+    """
+    header, l_rows = _query_sqlite(path_sqlite_file, query, parameters)
+    ll_data = [header]      # type: List[List[Any]]
+    ll_data.extend(list(row) for row in l_rows)
+    write_ll_data_to_csv_file(ll_data, path_csv_file=path_csv_file, encoding=encoding, delimiter=delimiter, quotechar=quotechar, quoting=quoting)
+
+
+def _query_sqlite(path_sqlite_file: pathlib.Path, query: str, parameters: Sequence[Any]) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+    connection = sqlite3.connect(str(path_sqlite_file))
+    try:
+        cursor = connection.execute(query, parameters)
+        header = [description[0] for description in cursor.description]
+        return header, cursor.fetchall()
+    finally:
+        connection.close()
+
+
+def _check_header(fieldnames: List[str], path_csv_file: pathlib.Path) -> None:
+    """ the fieldnames are the column names, which must not be empty and must be unique - sqlite compares them case insensitive """
+    if not fieldnames:
+        raise ValueError(f'csv file "{path_csv_file}" does not have header information')
+    set_fieldnames = set()
+    for index, fieldname in enumerate(fieldnames):
+        if not fieldname:
+            raise ValueError(f'csv file "{path_csv_file}": header field {index + 1} is empty')
+        if fieldname.casefold() in set_fieldnames:
+            raise ValueError(f'csv file "{path_csv_file}": header field "{fieldname}" is not unique')
+        set_fieldnames.add(fieldname.casefold())
+
+
+def _get_index_fieldnames(index_definition: IndexDefinition) -> List[str]:
+    if isinstance(index_definition, str):
+        return [index_definition]
+    return list(index_definition)
+
+
+def _quote_identifier(identifier: str) -> str:
+    """
+    >>> _quote_identifier('Kred.-Artikelnr. "alt" ')
+    '"Kred.-Artikelnr. ""alt"" "'
+    """
+    return '"' + identifier.replace('"', '""') + '"'
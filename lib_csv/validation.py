@@ -0,0 +1,157 @@
+# STDLIB
+import csv
+import pathlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# PROJ
+try:
+    from .schema import compile_row_builder
+except (ImportError, ModuleNotFoundError):                 # pragma: no cover
+    # imports for doctest
+    from schema import compile_row_builder      # type: ignore  # pragma: no cover
+
+
+class ValidationSummary(object):
+    """
+    the result of validate_csv_file
+    """
+
+    def __init__(self, path_csv_file: pathlib.Path, max_errors: int) -> None:
+        self.path_csv_file = path_csv_file
+        self.max_errors = max_errors
+        self.number_of_rows = 0
+        self.number_of_valid_rows = 0
+        self.number_of_errors = 0
+        self.dict_number_of_errors_by_reason = dict()     # type: Dict[str, int]
+        self.l_errors = list()                            # type: List[Tuple[int, str]]
+
+    @property
+    def is_valid(self) -> bool:
+        return self.number_of_errors == 0
+
+    @property
+    def is_truncated(self) -> bool:
+        """ True if more errors were found as reported in l_errors """
+        return self.number_of_errors > len(self.l_errors)
+
+    def add_error(self, line_number: int, reason_kind: str, reason: str) -> bool:
+        """ counts the error, returns True if the error is still within max_errors """
+        self.number_of_errors += 1
+        self.dict_number_of_errors_by_reason[reason_kind] = self.dict_number_of_errors_by_reason.get(reason_kind, 0) + 1
+        if len(self.l_errors) < self.max_errors:
+            self.l_errors.append((line_number, reason))
+            return True
+        return False
+
+    def __repr__(self) -> str:
+        return (f'ValidationSummary(rows={self.number_of_rows}, valid_rows={self.number_of_valid_rows}, '
+                f'errors={self.number_of_errors}, errors_by_reason={self.dict_number_of_errors_by_reason})')
+
+
+def validate_csv_file(path_csv_file: pathlib.Path,
+                      hash_by_fieldname: Optional[str] = None,
+                      schema: Optional[Dict[str, Callable[[str], Any]]] = None,
+                      path_quarantine_file: Optional[pathlib.Path] = None,
+                      max_errors: int = 1000,
+                      encoding: str = "ISO-8859-1",
+                      delimiter: str = ";",
+                      quotechar: str = '"',
+                      quoting: int = csv.QUOTE_MINIMAL,
+                      doublequote: bool = True,
+                      escapechar: Optional[str] = None) -> ValidationSummary:
+    """
+    validates the csv file in one pass, instead of stopping at the first error like the readers do.
+    checked are the row length, the uniqueness of hash_by_fieldname (if given) and the conversions of the schema (if given).
+
+    the bad rows are written to the quarantine csv file (if given) with the columns "line_number", "reason" and the original row.
+    only the first max_errors errors are reported and quarantined, but all errors are counted.
+
+    >>> # setup
+    >>> test_directory = pathlib.Path(__file__).absolute().parent.parent / 'tests'
+    >>> testfile1 = test_directory / '0001_aktive_preis_qty.csv'
+    >>> testfile2 = test_directory / 'csv_file_broken_less_fields_than_header.csv'
+    >>> path_quarantine_file = test_directory / 'quarantine_test.csv'
+
+    >>> # Test all errors are found in one pass
+    >>> summary = validate_csv_file(path_csv_file=testfile1, hash_by_fieldname='CustomLabel', path_quarantine_file=path_quarantine_file)
+    >>> summary
+    ValidationSummary(rows=1488, valid_rows=1413, errors=75, errors_by_reason={'duplicate_key': 74, 'row_length': 1})
+    >>> summary.l_errors[0]
+    (404, 'Index is not unique, field: "CustomLabel", value: "HUB179", first seen in line 90')
+    >>> from lib_csv.lib_csv import read_csv_file_with_header_to_list_of_dicts
+    >>> l_quarantine = read_csv_file_with_header_to_list_of_dicts(path_quarantine_file, check_row_length=False)
+    >>> len(l_quarantine), l_quarantine[0]['line_number'], l_quarantine[0]['CustomLabel']
+    (75, '404', 'HUB179')
+
+    >>> # Test max_errors and schema errors
+    >>> summary = validate_csv_file(path_csv_file=testfile1, schema={'Quantity': int}, max_errors=2)
+    >>> summary
+    ValidationSummary(rows=1488, valid_rows=1482, errors=6, errors_by_reason={'conversion': 5, 'row_length': 1})
+    >>> summary.is_truncated, summary.l_errors[0]
+    (True, (306, 'csv file "...0001_aktive_preis_qty.csv", line 306, field "Quantity": can not convert "": invalid literal for int() ...'))
+
+    >>> # Test Number of Fields is smaller than the header
+    >>> validate_csv_file(path_csv_file=testfile2).l_errors
+    [(2, 'Row has length 3 instead of 4')]
+
+    >>> # Test Fieldname for hashing not existent in the header
+    >>> validate_csv_file(path_csv_file=testfile2, hash_by_fieldname='not_existing')
+    Traceback (most recent call last):
+        ...
+    ValueError: Field "not_existing" is not available, or the csv file does not have header information
+
+    >>> # Teardown
+    >>> if path_quarantine_file.is_file(): path_quarantine_file.unlink()
+
+    """
+    summary = ValidationSummary(path_csv_file=path_csv_file, max_errors=max_errors)
+    f_quarantine_file = None
+    quarantine_writer = None
+
+    try:
+        with open(str(path_csv_file), 'r', encoding=encoding) as f_csv_file:
+            my_csv_reader = csv.reader(f_csv_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                       doublequote=doublequote, escapechar=escapechar)
+            fieldnames = next(my_csv_reader, [])
+            if hash_by_fieldname is not None and hash_by_fieldname not in fieldnames:
+                raise ValueError(f'Field "{hash_by_fieldname}" is not available, or the csv file does not have header information')
+            build_row = compile_row_builder(fieldnames, schema=schema, source=str(path_csv_file)) if schema else None
+            number_of_fields = len(fieldnames)
+            index_of_hash_field = fieldnames.index(hash_by_fieldname) if hash_by_fieldname is not None else 0
+            dict_first_line_by_key = dict()    # type: Dict[str, int]
+
+            if path_quarantine_file is not None:
+                f_quarantine_file = open(str(path_quarantine_file), 'w', encoding=encoding, newline='')
+                quarantine_writer = csv.writer(f_quarantine_file, delimiter=delimiter, quotechar=quotechar, quoting=quoting,
+                                               doublequote=doublequote, escapechar=escapechar, lineterminator='\n')
+                quarantine_writer.writerow(['line_number', 'reason'] + fieldnames)
+
+            for row in my_csv_reader:
+                summary.number_of_rows += 1
+                line_number = my_csv_reader.line_num
+                reason_kind, reason = '', ''
+
+                if len(row) != number_of_fields:
+                    reason_kind, reason = 'row_length', f'Row has length {len(row)} instead of {number_of_fields}'
+                elif build_row is not None:
+                    try:
+                        build_row(row, line_number)
+                    except ValueError as exc:
+                        reason_kind, reason = 'conversion', str(exc)
+
+                if not reason_kind and hash_by_fieldname is not None:
+                    index_value = row[index_of_hash_field]
+                    first_line_number = dict_first_line_by_key.setdefault(index_value, line_number)
+                    if first_line_number != line_number:
+                        reason_kind = 'duplicate_key'
+                        reason = f'Index is not unique, field: "{hash_by_fieldname}", value: "{index_value}", first seen in line {first_line_number}'
+
+                if not reason_kind:
+                    summary.number_of_valid_rows += 1
+                elif summary.add_error(line_number, reason_kind, reason) and quarantine_writer is not None:
+                    quarantine_writer.writerow([line_number, reason] + row)
+    finally:
+        if f_quarantine_file is not None:
+            f_quarantine_file.close()
+
+    return summary